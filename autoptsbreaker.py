@@ -0,0 +1,264 @@
+"""Circuit breaker that stops running test cases against a dead IUT
+
+When the IUT crashes every next test case waits for the full PTS_TIMEOUT
+and every implicit send for MQTT_TIMEOUT. The breaker counts consecutive
+test cases ending with a timeout, an XML-RPC error or an implicit send the
+IUT did not respond to. After the threshold is reached dispatching on the
+PTS/IUT pair is paused and the IUT is probed over MQTT. If it does not come
+back, the remaining test cases are blocked instead of being run.
+
+Before that, LivenessProbe pings the IUT before every test case, so a dead
+IUT is found before a test case is started against it. Only IUTs whose tester
+answered the Capabilities command at session start are pinged, testers
+without the probe commands never answer them.
+"""
+
+import time
+import logging
+import xmlrpc.client
+
+import ptsprojects.ptstypes as ptstypes
+from autoptstimeouts import TIMEOUT_STATUS
+from config import BREAKER_THRESHOLD, BREAKER_PROBE_COUNT, \
+    BREAKER_PROBE_INTERVAL, IUT_PROBE_TIMEOUT, IUT_PING_TIMEOUT, \
+    IUT_PING_INTERVAL
+
+log = logging.debug
+
+# Status of test cases not run because the IUT is not responding
+BLOCKED = "BLOCKED"
+
+# Statuses that suggest the IUT or PTS does not respond
+SUSPICIOUS_STATUSES = (TIMEOUT_STATUS, ptstypes.E_XML_RPC_ERROR,
+                       ptstypes.E_FATAL_ERROR)
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of a single PTS/IUT pair"""
+
+    def __init__(self, pts, threshold=BREAKER_THRESHOLD,
+                 probe_count=BREAKER_PROBE_COUNT,
+                 probe_interval=BREAKER_PROBE_INTERVAL,
+                 probe_timeout=IUT_PROBE_TIMEOUT, sleep=time.sleep):
+        """Constructor
+
+        pts -- PyPTS proxy, used to read MQTT no response count and to probe
+        threshold -- Number of consecutive suspicious test cases that trips
+                     the breaker, 0 disables the breaker
+        probe_count -- How many times the IUT is probed before giving up
+        probe_interval -- Seconds between the probes
+        probe_timeout -- Seconds to wait for the probe response
+
+        """
+        self._pts = pts
+        self._threshold = threshold
+        self._probe_count = probe_count
+        self._probe_interval = probe_interval
+        self._probe_timeout = probe_timeout
+        self._sleep = sleep
+
+        self._no_response_count = None
+        self._suspicious_durations = []
+
+        # set once the IUT did not come back, then test cases are blocked
+        self.dead = False
+
+    def _get_new_no_responses(self):
+        """Returns number of implicit sends not responded since last call"""
+        try:
+            count = self._pts.get_mqtt_no_response_count()
+        except Exception as error:
+            log("Cannot get MQTT no response count: %r", error)
+            return 0
+
+        previous = self._no_response_count
+        self._no_response_count = count
+
+        # counter starts from 0 when PTS is (re)started
+        if previous is None or count < previous:
+            return count
+
+        return count - previous
+
+    def record(self, status, duration):
+        """Records final status of a test case run on the pair"""
+        if not self._threshold:
+            return
+
+        no_responses = self._get_new_no_responses()
+
+        if status in SUSPICIOUS_STATUSES or no_responses:
+            self._suspicious_durations.append(duration)
+            log("Suspicious test case %d/%d: %s, MQTT no responses %d",
+                len(self._suspicious_durations), self._threshold, status,
+                no_responses)
+        else:
+            self._suspicious_durations = []
+
+    def is_open(self):
+        """Returns True if the breaker tripped"""
+        return bool(self._threshold) and \
+            len(self._suspicious_durations) >= self._threshold
+
+    def allow(self):
+        """Returns True if next test case can be run on the pair
+
+        If the breaker tripped, this blocks probing the IUT until it responds
+        or the probes are exhausted. In the latter case the pair is marked
+        dead and False is returned.
+
+        """
+        if self.dead:
+            return False
+
+        if not self.is_open():
+            return True
+
+        print("IUT does not respond, pausing and probing it ...")
+        return self.wait_for_iut()
+
+    def wait_for_iut(self):
+        """Probes the IUT until it responds or the probes are exhausted, in
+        that case the pair is marked dead. Returns True if the IUT is back.
+
+        It gives up after probe_count * probe_interval seconds, so a test
+        case held for an IUT that does not respond is eventually blocked.
+
+        """
+        for attempt in range(self._probe_count):
+            try:
+                if self._pts.probe_iut(self._probe_timeout):
+                    log("IUT responded to probe %d", attempt)
+                    print("IUT is back, resuming")
+                    self._suspicious_durations = []
+                    return True
+
+            except Exception as error:
+                log("IUT probe failed: %r", error)
+
+            self._sleep(self._probe_interval)
+
+        print("IUT is dead, blocking remaining test cases")
+        self.dead = True
+        return False
+
+    def reset(self):
+        """Closes the breaker, e.g. after the dead IUT has been replaced"""
+        self._suspicious_durations = []
+        self.dead = False
+
+    def get_expected_duration(self):
+        """Returns expected duration of a test case run against dead IUT"""
+        if not self._suspicious_durations:
+            return 0.0
+
+        return sum(self._suspicious_durations) / len(self._suspicious_durations)
+
+
+class LivenessProbe(object):
+    """Pings the IUT of a PTS instance before test cases
+
+    The ping is sent before the PTS setup of the test case and its response
+    is read after it, so the MQTT round trip costs no time if the IUT is
+    alive. A ping not answered in time is sent once more with the longer
+    probe timeout before the IUT is taken as not responding, it may be busy
+    e.g. answering implicit sends of another PTS instance.
+
+    Pinging is enabled once the tester answers a query, see start_query.
+    Servers without the probe calls are not pinged.
+
+    """
+
+    def __init__(self, pts, timeout=IUT_PING_TIMEOUT,
+                 interval=IUT_PING_INTERVAL, retry_timeout=IUT_PROBE_TIMEOUT,
+                 clock=time.time):
+        """Constructor
+
+        timeout -- Seconds to wait for the response since the ping is sent
+        interval -- Seconds since the last response before the IUT is pinged
+                    again, 0 to ping before every test case
+        retry_timeout -- Seconds to wait for the response to the second ping
+                         and to queries
+
+        """
+        self._pts = pts
+        self._timeout = timeout
+        self._interval = interval
+        self._retry_timeout = retry_timeout
+        self._clock = clock
+
+        self._pending = False
+        self._query_pending = False
+        self._last_response = None
+        self.enabled = False  # set once the tester answers a query
+        self.ping_count = 0
+        self.failure_count = 0
+        self.round_trips = []
+
+    def start_query(self, command):
+        """Sends the command without waiting for the response"""
+        try:
+            self._pts.start_iut_probe(command)
+            self._query_pending = True
+
+        except xmlrpc.client.Fault as fault:
+            log("IUT probes not supported: %s", fault)
+
+    def finish_query(self):
+        """Waits for the response to the command sent by start_query, the
+        IUT is pinged before test cases from now on if it is answered
+
+        Returns the probe result dict, see PyPTS.get_iut_probe_result, None
+        if the server does not support probes
+
+        """
+        if not self._query_pending:
+            return None
+
+        self._query_pending = False
+        result = self._pts.get_iut_probe_result(self._retry_timeout)
+        if result["ok"]:
+            self.enabled = True
+            self._last_response = self._clock()
+
+        return result
+
+    def start(self):
+        """Sends the ping if it is due"""
+        if not self.enabled or (self._last_response is not None and
+                                self._clock() - self._last_response <
+                                self._interval):
+            return
+
+        try:
+            self._pts.start_iut_probe(ptstypes.IUT_PROBE_PING)
+            self._pending = True
+
+        except xmlrpc.client.Fault as fault:
+            log("IUT probes not supported: %s", fault)
+            self.enabled = False
+
+    def finish(self):
+        """Returns False if the ping sent by start has not been answered"""
+        if not self._pending:
+            return True
+
+        self._pending = False
+        result = self._pts.get_iut_probe_result(self._timeout)
+
+        self.ping_count += 1
+        if not result["ok"]:
+            self.failure_count += 1
+            log("IUT did not respond to ping, pinging it once more")
+
+            self._pts.start_iut_probe(ptstypes.IUT_PROBE_PING)
+            result = self._pts.get_iut_probe_result(self._retry_timeout)
+
+            self.ping_count += 1
+            if not result["ok"]:
+                self.failure_count += 1
+                return False
+
+        self.round_trips.append(result["time"])
+        self._last_response = self._clock()
+        return True
@@ -24,9 +24,14 @@ def main():
 
     args = parse_args()
 
+    if args.plan:
+        autoptsclient.plan_test_cases(autoprojects.pbap.test_cases(), args)
+        return
+
     ptses = autoptsclient.init_pts(args)
 
-    autoprojects.pbap.set_pixits(ptses[0])
+    for pts in ptses:
+        autoprojects.pbap.set_pixits(pts)
 
     test_cases = autoprojects.pbap.test_cases()
     # test_cases += autoprojects.hfp.test_cases()
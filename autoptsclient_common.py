@@ -5,18 +5,32 @@
 import os
 import errno
 import sys
+import socket
 import logging
 import xmlrpc.client
-import queue
 import threading
 from traceback import format_exception
 from xmlrpc.server import SimpleXMLRPCServer
 import time
 import datetime
 import argparse
-from termcolor import colored
+import collections
 
 from ptsprojects.testcase import PTSCallback
+import autoptshistory
+from autoptshistory import write_file_durably, save_session_plan, \
+    load_session_plan
+import autoptsshard
+import autoptsparams
+import autoptsselect
+import autoptsflaky
+import autoptsiut
+import autoptsevents
+from autoptspipeline import PipelineTurns
+import ptsrpc
+from autoptsbreaker import CircuitBreaker, LivenessProbe, BLOCKED
+from autoptstimeouts import AdaptiveTimeouts, VERDICT_STATUSES, percentile
+from config import BREAKER_THRESHOLD, QUARANTINE_RETRY
 import ptsprojects.ptstypes as ptstypes
 from config import SERVER_PORT, CLIENT_PORT, PTS_TIMEOUT
 
@@ -26,6 +40,32 @@ import xml.etree.ElementTree as ET
 log = logging.debug
 
 RUNNING_TEST_CASE = {}
+# autoptsevents.Publisher of the session of each running test case
+RUNNING_TEST_CASE_EVENTS = {}
+
+# Session logs, plan and results are kept in SESSION_LOGS_DIR/<session>
+SESSION_LOGS_DIR = "logs"
+SESSION_RESULTS_FILE = autoptshistory.RESULTS_FILE
+# Every test case run is recorded in, see autoptsdb
+RESULTS_DB = os.path.join(SESSION_LOGS_DIR, "results.db")
+
+# Values of --callback: how PTS callbacks reach the client
+CALLBACK_AUTO = "auto"  # event stream if the server offers it
+CALLBACK_STREAM = "stream"  # event stream pushed by the server
+CALLBACK_XMLRPC = "xmlrpc"  # server calls local callback server
+
+# Values of --fetch-logs: test cases whose PTS logs are fetched
+FETCH_LOGS_FAILED = "failed"  # not passed
+FETCH_LOGS_ALL = "all"
+
+# PTS debug logs kept by the server, fetched into the test case log directory
+DEBUG_LOG_FILE = "pts_debug.log"
+
+# Fetched PTS logs by hash, linked into the test case log directories
+ARTIFACTS_DIR = os.path.join(SESSION_LOGS_DIR, "artifacts")
+
+# Seconds to wait for the verdict event after run_test_case returned
+EVENT_STREAM_SYNC_TIMEOUT = 10
 
 
 class ClientCallback(PTSCallback):
@@ -66,6 +106,22 @@ class ClientCallback(PTSCallback):
             # exit does not work, cause app is blocked in PTS.RunTestCase?
             sys.exit("Exception in Log")
 
+    def mmi(self, project_name, wid, test_case_name, description, style,
+            response):
+        """Answered implicit send, received over the event stream"""
+        logger = logging.getLogger("{}.{}".format(self.__class__.__name__,
+                                                  self.mmi.__name__))
+
+        logger.info("%s %s WID %d %s: %r" % (project_name, test_case_name,
+                                             wid, description, response))
+
+        events = RUNNING_TEST_CASE_EVENTS.get(test_case_name)
+        if events is not None:
+            events.publish(autoptsevents.MMI, test_case=test_case_name,
+                           project=project_name, wid=wid,
+                           description=description, style=style,
+                           response=response)
+
 
 class CallbackThread(threading.Thread):
     """Thread for XML-RPC callback server
@@ -124,43 +180,186 @@ def init_logging():
 
 
 def init_pts_thread_entry(proxy, local_address, local_port, workspace_path,
-                          bd_addr, enable_max_logs):
-    """PTS instance initialization thread function entry"""
+                          bd_addr, enable_max_logs, restart_pts=True,
+                          server_host=None, callback=CALLBACK_AUTO, iut=None,
+                          fetch_logs=None, fetch_debug_logs=False):
+    """PTS instance initialization thread function entry
+
+    All setup calls after the PTS (re)start are sent in a single
+    system.multicall round trip. PTS is not restarted if restart_pts is
+    False and PTS is healthy with the workspace already open.
+
+    PTS callbacks are received over the event stream of the server, if it
+    offers one, see ptsstream. Otherwise the local callback server is
+    started and registered with the server.
+
+    If iut of the IUT pool is given, the instance is bound to it and its
+    address is used instead of bd_addr, see autoptsiut.
+
+    With fetch_logs PTS saves test history logs, the server streams them to
+    proxy.artifacts, see ptsartifacts.
+
+    With fetch_debug_logs and not enable_max_logs, PTS maximum logging is
+    enabled but the debug lines are kept by the server, see ptslogbuffer.
+
+    Time of each phase is stored in proxy.startup_phases
+
+    """
+    proxy.startup_phases = []
+    proxy.event_stream = None
+    proxy.iut = iut
+    proxy.workspace = workspace_path
+    proxy.artifacts = None
+    proxy.fetch_logs = fetch_logs
+    proxy.fetch_debug_logs = fetch_debug_logs and not enable_max_logs
+
+    def phase_done(name, start_time):
+        proxy.startup_phases.append((name, time.time() - start_time))
+        return time.time()
+
+    phase_start = time.time()
+
+    def start_callback_server():
+        proxy.callback_thread = CallbackThread(local_port)
+        proxy.callback_thread.daemon = True
+        proxy.callback_thread.start()
+
+        client_ip_address = local_address
+        if client_ip_address is None:
+            client_ip_address = get_my_ip_address()
+
+        log("Client IP Address: %s", client_ip_address)
+        return client_ip_address
+
+    if callback == CALLBACK_XMLRPC:
+        # does not depend on the server, serves while it is starting PTS
+        client_ip_address = start_callback_server()
 
     sys.stdout.flush()
-    proxy.restart_pts()
-    print("(%r) OK" % (id(proxy),))
 
-    proxy.callback_thread = CallbackThread(local_port)
-    proxy.callback_thread.start()
+    reuse = not restart_pts and proxy.is_workspace_open(workspace_path)
+    phase_start = phase_done("check", phase_start)
+
+    if reuse:
+        print("(%r) OK, reusing running PTS" % (id(proxy),))
+    else:
+        proxy.restart_pts()
+        print("(%r) OK" % (id(proxy),))
+        phase_start = phase_done("restart_pts", phase_start)
+
+    multicall = xmlrpc.client.MultiCall(proxy)
+
+    multicall.set_call_timeout(PTS_TIMEOUT)  # milliseconds
+    multicall.get_version()
+    multicall.bd_addr()
+
+    if callback == CALLBACK_XMLRPC:
+        multicall.register_xmlrpc_ptscallback(client_ip_address, local_port)
+    else:
+        multicall.register_event_stream()
 
-    proxy.set_call_timeout(PTS_TIMEOUT)  # milliseconds
+    if iut:
+        log("Bind IUT %s", iut.name)
+        multicall.bind_iut(iut.broker, *autoptsiut.get_mqtt_topics(
+            iut.namespace))
+        bd_addr = iut.bd_addr
 
-    log("Server methods: %s", proxy.system.listMethods())
-    log("PTS Version: %s", proxy.get_version())
+    if not reuse:
+        log("Opening workspace: %s", workspace_path)
+        multicall.open_workspace(workspace_path)
+
+    if bd_addr:
+        log("Set bd_addr PIXIT: %s for all projects", bd_addr)
+        multicall.set_pixits_bulk({ptstypes.ALL_PROJECTS:
+                                   {"TSPX_bd_addr_iut": bd_addr}})
+
+    if proxy.fetch_debug_logs:
+        multicall.enable_maximum_logging(True, False)
+    else:
+        multicall.enable_maximum_logging(enable_max_logs)
+
+    if fetch_logs:
+        multicall.save_test_history_log(True)
+        # last, the server may not serve logs
+        multicall.get_artifact_port()
+
+    # accessing results raises xmlrpc.client.Fault of a failed call
+    results = multicall()
+
+    results[0]  # set_call_timeout
+    log("PTS Version: %s", results[1])
 
     # cache locally for quick access (avoid contacting server)
-    proxy.q_bd_addr = proxy.bd_addr()
+    proxy.q_bd_addr = results[2]
     log("PTS BD_ADDR: %s", proxy.q_bd_addr)
 
-    client_ip_address = local_address
-    if client_ip_address is None:
-        client_ip_address = get_my_ip_address()
+    if callback == CALLBACK_XMLRPC:
+        results[3]  # register_xmlrpc_ptscallback
+    else:
+        try:
+            stream_info = results[3]
+
+        except xmlrpc.client.Fault as fault:
+            if callback == CALLBACK_STREAM:
+                raise
 
-    log("Client IP Address: %s", client_ip_address)
+            log("Server has no event stream, using callback server: %s",
+                fault)
+            proxy.register_xmlrpc_ptscallback(start_callback_server(),
+                                              local_port)
 
-    proxy.register_xmlrpc_ptscallback(client_ip_address, local_port)
+        else:
+            import ptsstream
 
-    log("Opening workspace: %s", workspace_path)
-    proxy.open_workspace(workspace_path)
+            proxy.event_stream = ptsstream.EventStreamClient(
+                server_host, stream_info["port"], stream_info["stream"],
+                ClientCallback(), stream_info.get("seq", 0))
+            proxy.event_stream.start()
 
-    if bd_addr:
-        projects = proxy.get_project_list()
-        for project_name in projects:
-            log("Set bd_addr PIXIT: %s for project: %s", bd_addr, project_name)
-            proxy.update_pixit_param(project_name, "TSPX_bd_addr_iut", bd_addr)
+    setup_count = len(results.results)
+    if fetch_logs:
+        setup_count -= 1
+
+        try:
+            artifact_port = results[setup_count]
+
+        except xmlrpc.client.Fault as fault:
+            log("Server does not serve PTS logs: %s", fault)
+            print("(%r) Server does not serve PTS logs, not fetching them" %
+                  (id(proxy),))
+
+        else:
+            import ptsartifacts
+
+            proxy.artifacts = ptsartifacts.ArtifactFetcher(
+                server_host, artifact_port, ARTIFACTS_DIR)
+            proxy.artifacts.start()
+
+    for index in range(4, setup_count):
+        results[index]
 
-    proxy.enable_maximum_logging(enable_max_logs)
+    phase_done("setup", phase_start)
+
+
+def init_pts_thread_wrapper(proxy, *args):
+    """Stores exception of init_pts_thread_entry in proxy.init_error"""
+    proxy.init_error = None
+
+    try:
+        init_pts_thread_entry(proxy, *args)
+
+    except Exception as error:
+        logging.exception(repr(error))
+        proxy.init_error = error
+
+
+def parse_server_address(server_addr):
+    """Splits "host[:port]" into host and port, SERVER_PORT is the default"""
+    host, sep, port = server_addr.rpartition(":")
+    if not sep:
+        return server_addr, SERVER_PORT
+
+    return host, int(port)
 
 
 def init_pts(args):
@@ -168,21 +367,39 @@ def init_pts(args):
 
     proxy_list = []
     thread_list = []
+    init_start_time = time.time()
 
     init_logging()
 
     local_port = CLIENT_PORT
 
-    for server_addr, local_addr in zip(args.ip_addr, args.local_addr):
-        proxy = xmlrpc.client.ServerProxy(
-            "http://{}:{}/".format(server_addr, SERVER_PORT),
-            allow_none=True,)
+    local_addrs = args.local_addr or [None] * len(args.ip_addr)
+
+    iuts = [None] * len(args.ip_addr)
+    if args.iut_pool:
+        iuts = [args.iut_pool.acquire() for _ in args.ip_addr]
+        if None in iuts:
+            sys.exit("IUT pool has %d IUTs for %d PTS servers" %
+                     (len(args.iut_pool.iuts), len(args.ip_addr)))
 
-        print("(%r) Starting PTS %s ..." % (id(proxy), server_addr))
+    for index, (server_addr, local_addr, iut) in \
+            enumerate(zip(args.ip_addr, local_addrs, iuts)):
+        server_host, server_port = parse_server_address(server_addr)
 
-        thread = threading.Thread(target=init_pts_thread_entry,
+        # instances are spread over the workspaces, see WorkspaceScheduler
+        workspace = args.workspaces[index % len(args.workspaces)]
+        proxy = ptsrpc.connect(server_host, server_port, args.rpc_transport)
+
+        print("(%r) Starting PTS %s%s ..." %
+              (id(proxy), server_addr, ", IUT %s" % iut.name if iut else ""))
+
+        thread = threading.Thread(target=init_pts_thread_wrapper,
                                   args=(proxy, local_addr, local_port,
-                                        args.workspace, args.bd_addr, args.enable_max_logs))
+                                        workspace, args.bd_addr,
+                                        args.enable_max_logs, args.restart_pts,
+                                        server_host, args.callback, iut,
+                                        args.fetch_logs,
+                                        args.debug_logs_on_failure))
         thread.start()
 
         local_port += 1
@@ -190,13 +407,27 @@ def init_pts(args):
         proxy_list.append(proxy)
         thread_list.append(thread)
 
+    # all instances are initialized in parallel, so they share the deadline
+    deadline = init_start_time + PTS_TIMEOUT / 1000.0
+
     for index, thread in enumerate(thread_list):
-        thread.join(timeout=180.0)
+        thread.join(timeout=max(0, deadline - time.time()))
 
         # check init completed
-        if thread.isAlive():
+        if thread.is_alive():
             raise Exception("(%r) init failed" % (id(proxy_list[index]),))
 
+        if proxy_list[index].init_error is not None:
+            raise Exception("(%r) init failed: %r" %
+                            (id(proxy_list[index]),
+                             proxy_list[index].init_error))
+
+    for proxy in proxy_list:
+        print("(%r) Startup: %s" % (id(proxy), ", ".join(
+            "%s %.2f s" % phase for phase in proxy.startup_phases)))
+
+    print("Startup took %.2f s" % (time.time() - init_start_time))
+
     return proxy_list
 
 
@@ -207,26 +438,81 @@ def get_result_color(status):
        return "red"
     elif status == "INCONC":
         return "yellow"
+    elif status == BLOCKED:
+        return "blue"
     else:
         return "magenta"
 
 
+def create_session_log_dir(session):
+    """Creates new session directory, a suffix is added to the session name
+    if a session with the same name exists"""
+    session_log_dir = os.path.join(SESSION_LOGS_DIR, session)
+    suffix = 0
+
+    while True:
+        try:
+            os.makedirs(session_log_dir)
+            return session_log_dir
+
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        suffix += 1
+        session_log_dir = os.path.join(SESSION_LOGS_DIR,
+                                       "%s_%d" % (session, suffix))
+
+
 class TestCaseRunStats(object):
-    def __init__(self, projects, test_cases, retry_count):
+    def __init__(self, projects, test_cases, retry_count, xml_results=None,
+                 iut_build=None, quarantined=(),
+                 quarantine_retry_count=QUARANTINE_RETRY):
+        """Constructor
+
+        xml_results -- Path of the results file. If the file exists results
+                       recorded in it are kept, so an interrupted session can
+                       be resumed. Temporary file is used if None.
+        iut_build -- IUT build identifier recorded in the results file
+        quarantined -- Flaky test cases, retried quarantine_retry_count
+                       times instead of retry_count times
+
+        """
 
         self.run_count_max = retry_count + 1  # Run test at least once
-        self.run_count = 0  # Run count of current test case
+        self.quarantined = set(quarantined)
+        self.quarantine_run_count_max = quarantine_retry_count + 1
         self.num_test_cases = len(test_cases)
         self.num_test_cases_width = len(str(self.num_test_cases))
         self.max_project_name = len(max(projects, key=len)) if projects else 0
         self.max_test_case_name = len(max(test_cases, key=len)) if test_cases else 0
         self.margin = 3
-        self.index = 0
-
-        self.xml_results = tempfile.NamedTemporaryFile(delete=False).name
+        # Number of PTS instances running test cases concurrently
+        self.workers = 1
+        # Serializes result file updates and console output of the workers
+        self.lock = threading.RLock()
+        # autoptsdb.ResultsRecorder of every run, if enabled, it is a sink
+        # of the verdict events
+        self.recorder = None
+        # autoptsevents.Publisher of the session
+        self.events = autoptsevents.NO_EVENTS
+
+        if xml_results is None:
+            xml_results = tempfile.NamedTemporaryFile(delete=False).name
+        elif os.path.exists(xml_results):
+            self.xml_results = xml_results
+            return
+
+        self.xml_results = xml_results
         root = ET.Element("results")
+        if iut_build is not None:
+            root.attrib[autoptshistory.BUILD_ATTRIBUTE] = iut_build
         tree = ET.ElementTree(root)
-        tree.write(self.xml_results)
+        self._write(tree)
+
+    def _write(self, tree):
+        """Writes results, each update is a checkpoint of the session"""
+        write_file_durably(self.xml_results, ET.tostring(tree.getroot()))
 
     def update(self, test_case_name, duration, status):
         tree = ET.parse(self.xml_results)
@@ -248,7 +534,45 @@ class TestCaseRunStats(object):
         elem.attrib["status"] = status
         elem.attrib["run_count"] = str(run_count + 1)
 
-        tree.write(self.xml_results)
+        self._write(tree)
+
+        self.events.publish(autoptsevents.VERDICT, test_case=test_case_name,
+                            run=run_count + 1, status=status,
+                            duration=duration)
+
+    def get_run_count_max(self, test_case_name):
+        """Returns how many times the test case can be run until it passes"""
+        if test_case_name in self.quarantined:
+            return self.quarantine_run_count_max
+
+        return self.run_count_max
+
+    def get_run_count(self, test_case_name):
+        """Returns how many times the test case has been run"""
+        tree = ET.parse(self.xml_results)
+
+        elem = tree.getroot().find("./test_case[@name='%s']" % test_case_name)
+        if elem is None:
+            return 0
+
+        return int(elem.attrib["run_count"])
+
+    def get_pending_test_cases(self, test_cases):
+        """Returns test cases that have not been run yet or still have
+        retries left"""
+        tree = ET.parse(self.xml_results)
+
+        done = set()
+        for elem in tree.getroot().findall("./test_case"):
+            if elem.attrib["status"] == BLOCKED:
+                continue
+
+            if elem.attrib["status"] == "PASS" or \
+                    int(elem.attrib["run_count"]) >= \
+                    self.get_run_count_max(elem.attrib["name"]):
+                done.add(elem.attrib["name"])
+
+        return [tc for tc in test_cases if tc not in done]
 
     def get_results(self):
         tree = ET.parse(self.xml_results)
@@ -316,31 +640,41 @@ class TestCaseRunStats(object):
 
 
 def run_test_case_wrapper(func):
-    def wrapper(*args):
-        test_case_name = args[3]
-        stats = args[4]
-
+    def wrapper(pts, workspace_path, test_case_instances, test_case_name,
+                stats, session_log_dir, index=0, run_count=0,
+                pts_timeout=PTS_TIMEOUT):
         run_count_max = stats.run_count_max
-        run_count = stats.run_count
         num_test_cases = stats.num_test_cases
         num_test_cases_width = stats.num_test_cases_width
         max_project_name = stats.max_project_name
         max_test_case_name = stats.max_test_case_name
         margin = stats.margin
-        index = stats.index
 
-        print((str(index + 1).rjust(num_test_cases_width) +
-               "/" +
-               str(num_test_cases).ljust(num_test_cases_width + margin) +
-               test_case_name.split('/')[0].ljust(max_project_name + margin) +
-               test_case_name.ljust(max_test_case_name + margin - 1)), end=' ')
-        sys.stdout.flush()
+        test_case_str = (str(index + 1).rjust(num_test_cases_width) +
+                         "/" +
+                         str(num_test_cases).ljust(num_test_cases_width + margin) +
+                         test_case_name.split('/')[0].ljust(max_project_name + margin) +
+                         test_case_name.ljust(max_test_case_name + margin - 1))
+
+        # With several PTS instances lines are printed once the test case is
+        # done, otherwise the output of concurrent test cases would mix
+        if stats.workers == 1:
+            print(test_case_str, end=' ')
+            sys.stdout.flush()
+
+        stats.events.publish(autoptsevents.TEST_START,
+                             test_case=test_case_name, index=index,
+                             run=run_count + 1, pts=id(pts))
 
         start_time = time.time()
-        status = func(*args)
+        status = func(pts, workspace_path, test_case_instances,
+                      test_case_name, stats, session_log_dir, pts_timeout)
         end_time = time.time() - start_time
 
-        stats.update(test_case_name, end_time, status)
+        # waiting for the IUT is not part of the duration
+        turns = vars(pts).get("turns")
+        if turns is not None:
+            end_time -= turns.take_wait()
 
         retries_max = run_count_max - 1
         if run_count:
@@ -356,10 +690,19 @@ def run_test_case_wrapper(func):
                 retries_msg.rjust(len("#{}".format(retries_max)) + margin))
 
         if sys.stdout.isatty():
+            from termcolor import colored
+
             output_color = get_result_color(status)
-            print(colored(result, output_color))
-        else:
+            result = colored(result, output_color)
+
+        with stats.lock:
+            stats.update(test_case_name, end_time, status)
+
+            if stats.workers > 1:
+                print(test_case_str, end=' ')
+
             print(result)
+            sys.stdout.flush()
 
         return status, end_time
 
@@ -382,8 +725,56 @@ def get_error_code(exc):
     return error_code
 
 
-def run_test_case_thread_entry(pts, workspace_path, test_case):
-    """Runs the test case specified by a TestCase instance"""
+def run_pts_test_case(pts, workspace_path, pts_timeout, test_case):
+    """Calls run_test_case of the PTS server
+
+    With the event stream, the logs of the test case, including the final
+    verdict, can still be on the way when the call returns. The number of
+    the last event is fetched in the same round trip and waited for.
+
+    """
+    # getattr of a missing attribute of a server proxy returns RPC method
+    event_stream = vars(pts).get("event_stream")
+
+    if event_stream is None:
+        return pts.run_test_case(workspace_path, pts_timeout,
+                                 test_case.project_name, test_case.name)
+
+    multicall = xmlrpc.client.MultiCall(pts)
+    multicall.run_test_case(workspace_path, pts_timeout,
+                            test_case.project_name, test_case.name)
+    multicall.get_event_stream_seq()
+    results = multicall()
+
+    if not event_stream.wait_for(results[1], EVENT_STREAM_SYNC_TIMEOUT):
+        logging.warning("Event stream of %s is %d events behind",
+                        test_case.name, results[1] - event_stream.last_seq)
+
+    return results[0]
+
+
+def run_pts_test_case_in_turn(pts, workspace_path, pts_timeout, test_case):
+    """Calls run_pts_test_case in the turn of the PTS instance if the
+    instances share one IUT, see autoptspipeline"""
+    turns = vars(pts).get("turns")
+    if turns is None:
+        return run_pts_test_case(pts, workspace_path, pts_timeout, test_case)
+
+    turns.acquire()
+    try:
+        return run_pts_test_case(pts, workspace_path, pts_timeout, test_case)
+    finally:
+        turns.release()
+
+
+def run_test_case_thread_entry(pts, workspace_path, test_case,
+                               pts_timeout=PTS_TIMEOUT):
+    """Runs the test case specified by a TestCase instance
+
+    pts_timeout -- RunTestCase timeout in milliseconds, it should be already
+                   set on PTS with set_call_timeout
+
+    """
     log("Starting TestCase %s %s %s",
         run_test_case_thread_entry.__name__, test_case, workspace_path)
 
@@ -393,8 +784,8 @@ def run_test_case_thread_entry(pts, workspace_path, test_case):
         RUNNING_TEST_CASE[test_case.name] = test_case
         test_case.status = "RUNNING"
         test_case.state = "RUNNING"
-        error_code = pts.run_test_case(workspace_path, PTS_TIMEOUT,
-                                       test_case.project_name, test_case.name)
+        error_code = run_pts_test_case_in_turn(pts, workspace_path,
+                                               pts_timeout, test_case)
 
         log("After run_test_case error_code=%r status=%r", error_code, test_case.status)
 
@@ -403,7 +794,7 @@ def run_test_case_thread_entry(pts, workspace_path, test_case):
         error_code = get_error_code(error)
 
     except BaseException:
-        traceback_list = format_exception(sys.exc_info())
+        traceback_list = format_exception(*sys.exc_info())
         logging.exception("".join(traceback_list))
         error_code = get_error_code(None)
 
@@ -412,8 +803,13 @@ def run_test_case_thread_entry(pts, workspace_path, test_case):
             test_case.status = error_code
 
         if error_code == ptstypes.E_XML_RPC_ERROR:
+            RUNNING_TEST_CASE_EVENTS[test_case.name].publish(
+                autoptsevents.RECOVERY,
+                action=autoptsevents.RECOVERY_RECOVER_PTS,
+                reason=error_code, pts=id(pts), test_case=test_case.name)
+
             pts.stop_test_case(test_case.project_name, test_case.name)
-            pts.recover_pts(workspace_path, PTS_TIMEOUT)
+            pts.recover_pts(workspace_path, pts_timeout)
 
         test_case.state = "FINISHING"
         del RUNNING_TEST_CASE[test_case.name]
@@ -421,20 +817,68 @@ def run_test_case_thread_entry(pts, workspace_path, test_case):
     log("Done TestCase %s %s", run_test_case_thread_entry.__name__, test_case)
 
 
-@run_test_case_wrapper
-def run_test_case(ptses, workspace_path, test_case_instances, test_case_name,
-                  stats, session_log_dir):
+def test_case_lookup_name(test_case_instances, name):
+    """Return test case class instance if found or None otherwise"""
+    if test_case_instances is None:
+        return None
 
-    def test_case_lookup_name(name):
-        """Return test case class instance if found or None otherwise"""
-        if test_case_instances is None:
-            return None
+    for tc in test_case_instances:
+        if tc.name == name:
+            return tc
 
-        for tc in test_case_instances:
-            if tc.name == name:
-                return tc
+    return None
 
-        return None
+
+class TestCaseLogFilter(logging.Filter):
+    """Passes records of a single test case to its log file
+
+    Test cases running concurrently on several PTS instances share the root
+    logger, records are matched by the thread running the test case or by the
+    test case name present in the PTS log callback messages.
+
+    """
+
+    def __init__(self, test_case_name):
+        logging.Filter.__init__(self)
+        self.test_case_name = test_case_name
+        self.thread_ident = threading.get_ident()
+
+    def filter(self, record):
+        if record.thread == self.thread_ident:
+            return True
+
+        return self.test_case_name in record.getMessage()
+
+
+def save_debug_log(pts, test_case):
+    """Fetches PTS logs of the last run of the test case kept by the server
+    into DEBUG_LOG_FILE of the test case log directory"""
+    try:
+        test_case_log = pts.get_test_case_log(test_case.name)
+
+    except (OSError, xmlrpc.client.Error) as error:
+        logging.exception("Cannot fetch PTS logs of %s: %r", test_case.name,
+                          error)
+        return
+
+    if test_case_log is None:
+        logging.warning("PTS logs of %s are not kept anymore", test_case.name)
+        return
+
+    with open(os.path.join(test_case.log_dir, DEBUG_LOG_FILE), "w") as f:
+        if test_case_log["dropped"]:
+            f.write("%d lines dropped, over the server memory limit\n" %
+                    test_case_log["dropped"])
+
+        for log_type, logtype_string, log_time, log_message in \
+                test_case_log["lines"]:
+            f.write("%d %s %s %s\n" % (log_type, logtype_string, log_time,
+                                       log_message))
+
+
+@run_test_case_wrapper
+def run_test_case(pts, workspace_path, test_case_instances, test_case_name,
+                  stats, session_log_dir, pts_timeout=PTS_TIMEOUT):
 
     logger = logging.getLogger()
 
@@ -443,7 +887,7 @@ def run_test_case(ptses, workspace_path, test_case_instances, test_case_name,
     formatter = logging.Formatter(format)
 
     # Lookup TestCase class instance
-    test_case = test_case_lookup_name(test_case_name)
+    test_case = test_case_lookup_name(test_case_instances, test_case_name)
     if test_case is None:
         return 'NOT_IMPLEMENTED'
 
@@ -451,75 +895,830 @@ def run_test_case(ptses, workspace_path, test_case_instances, test_case_name,
     test_case.initialize_logging(session_log_dir)
     file_handler = logging.FileHandler(test_case.log_filename)
     file_handler.setFormatter(formatter)
+    file_handler.addFilter(TestCaseLogFilter(test_case_name))
     logger.addHandler(file_handler)
 
     if test_case.status != 'init':
+        logger.removeHandler(file_handler)
         return 'NOT_INITIALIZED'
 
-    # If we want to run tests on multiple PTS instances
-    # we can create multiple threads here and implement
-    # multiple classes that inherit from the TestCase class
-    run_test_case_thread_entry(ptses[0], workspace_path, test_case)
+    start_time = time.time()
+    RUNNING_TEST_CASE_EVENTS[test_case_name] = stats.events
+    try:
+        run_test_case_thread_entry(pts, workspace_path, test_case,
+                                   pts_timeout)
+    finally:
+        del RUNNING_TEST_CASE_EVENTS[test_case_name]
 
     logger.removeHandler(file_handler)
+    file_handler.close()
+
+    if vars(pts).get("fetch_debug_logs") and test_case.status != "PASS":
+        save_debug_log(pts, test_case)
+
+    # fetched in the background while the next test case runs
+    artifacts = vars(pts).get("artifacts")
+    if artifacts is not None and (pts.fetch_logs == FETCH_LOGS_ALL or
+                                  test_case.status != "PASS"):
+        artifacts.fetch(workspace_path, test_case_name, start_time,
+                        test_case.log_dir)
 
     return test_case.status
 
 
-def run_test_cases(ptses, test_case_instances, args):
-    """Runs a list of test cases"""
+class TestCaseQueue(object):
+    """Test cases of the session shared by the PTS instances of this client"""
+
+    def __init__(self, test_cases):
+        """test_cases -- List of (index, test case name) to run"""
+        self._queue = collections.deque(test_cases)
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns (index, test case name) of next test case to run or None"""
+        with self._lock:
+            if not self._queue:
+                return None
+
+            return self._queue.popleft()
+
+    def done(self, test_case, status, duration, run_count):
+        """Called with the final status of the test case"""
+        pass
+
+    def put_back(self, next_test_case):
+        """Returns (index, test case name) taken by get but not run, it is
+        the next one to run"""
+        with self._lock:
+            self._queue.appendleft(next_test_case)
+
+    def __len__(self):
+        """Returns number of test cases left"""
+        return len(self._queue)
+
+    def close(self):
+        """Called when the PTS instance stops taking test cases"""
+        pass
+
+    def drain(self):
+        """Removes and returns (index, test case name) of test cases left"""
+        left = []
+        while True:
+            next_test_case = self.get()
+            if next_test_case is None:
+                return left
+
+            left.append(next_test_case)
+
+
+class CoordinatedTestCaseQueue(TestCaseQueue):
+    """Test cases leased from the session coordinator by one PTS instance"""
+
+    def __init__(self, worker):
+        self._worker = worker
+        self._lease = None
+        self._kept = None
+
+    def get(self):
+        # the lease of a test case put back is kept, the coordinator requeues
+        # it if this worker unregisters
+        if self._kept is not None:
+            next_test_case, self._kept = self._kept, None
+            return next_test_case
 
-    def run_or_not(test_case_name):
-        if args.excluded:
-            for n in args.excluded:
-                if test_case_name.startswith(n):
-                    return False
+        self._lease = self._worker.lease_test_case()
+        if self._lease is None:
+            return None
+
+        return self._lease["index"], self._lease["test_case"]
+
+    def done(self, test_case, status, duration, run_count):
+        if not self._worker.report_verdict(self._lease, status, duration,
+                                           run_count):
+            log("Coordinator dropped verdict of %s, lease expired", test_case)
+
+    def put_back(self, next_test_case):
+        self._kept = next_test_case
+
+    def __len__(self):
+        # known only to the coordinator
+        return 0
 
-        if args.test_cases:
-            for n in args.test_cases:
-                if test_case_name.startswith(n):
-                    return True
+    def close(self):
+        self._worker.unregister()
 
+    def drain(self):
+        # test cases left are run by other workers of the session
+        return []
+
+
+def replace_iut(pts, iut_pool):
+    """Takes the dead IUT of the PTS instance out of the pool and binds the
+    instance to a spare one. Returns False if there is no spare left."""
+    iut = pts.iut
+
+    while True:
+        spare = iut_pool.replace(iut)
+        if spare is None:
             return False
 
+        print("IUT %s is dead, continuing with %s" % (iut.name, spare.name))
+
+        multicall = xmlrpc.client.MultiCall(pts)
+        multicall.bind_iut(spare.broker, *autoptsiut.get_mqtt_topics(
+            spare.namespace))
+        multicall.set_pixits_bulk({ptstypes.ALL_PROJECTS:
+                                   {"TSPX_bd_addr_iut": spare.bd_addr}})
+
+        try:
+            for _ in multicall():
+                pass
+
+        except (OSError, xmlrpc.client.Error) as error:
+            logging.exception("Cannot bind IUT %s: %r", spare.name, error)
+            iut = spare
+            continue
+
+        pts.iut = spare
         return True
 
-    now = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    session_log_dir = 'logs/' + now
-    try:
-        os.makedirs(session_log_dir)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
 
-    test_cases = []
+class PTSHealthCheck(object):
+    """Recycles PTS instances between test cases when their watchdog finds
+    them degraded, see ptswatchdog"""
 
-    projects = ptses[0].get_project_list()
+    def __init__(self, durations, enabled=True):
+        """Constructor
 
-    for project in projects:
-        _test_case_list = ptses[0].get_test_case_list(project)
-        test_cases += [tc for tc in _test_case_list if run_or_not(tc)]
+        durations -- Dict of test case name: list of durations in seconds,
+                     the median is the expected duration of the test case
+        enabled -- If False, PTS is never asked
+
+        """
+        self.enabled = enabled
+        self._expected = dict((tc, percentile(values, 50)) for tc, values in
+                              durations.items() if values)
+        self._lock = threading.Lock()
+        self.recycles = []  # (PTS instance id, reason, seconds)
+
+    def check(self, pts, test_case, duration):
+        """Called after the first run of the test case on the instance,
+        returns reason PTS has been recycled for, None if it has not"""
+        if not self.enabled:
+            return None
+
+        try:
+            reason = pts.check_health(duration,
+                                      self._expected.get(test_case, 0))
+            if not reason:
+                return None
+
+            print("(%r) Recycling PTS: %s" % (id(pts), reason))
+            start_time = time.time()
+            pts.recycle_pts()
+
+        except (OSError, xmlrpc.client.Error) as error:
+            logging.exception("PTS health check failed: %r", error)
+            return None
+
+        with self._lock:
+            self.recycles.append((id(pts), reason, time.time() - start_time))
+
+        return reason
+
+    def print_report(self):
+        if not self.recycles:
+            return
+
+        print("\nPTS recycled %d times, %.1f s in total:" %
+              (len(self.recycles), sum(r[2] for r in self.recycles)))
+
+        for pts_id, reason, seconds in self.recycles:
+            print("  (%r) %s, %.1f s" % (pts_id, reason, seconds))
+
+
+class WorkspaceSession(object):
+    """Test cases of one workspace of the session
+
+    Each workspace is run as a separate session, with its own session log
+    directory, plan, results and summary.
+
+    """
+
+    def __init__(self, session_log_dir, plan, args, worker_count, bus):
+        """Constructor
+
+        plan -- Session plan, see save_session_plan
+        worker_count -- Number of PTS instances of the client
+        bus -- autoptsevents.EventBus the events of the session are
+               published to
+
+        """
+        self.session_log_dir = session_log_dir
+        self.name = os.path.basename(session_log_dir)
+        self.workspace = plan["workspace"]
+        self.test_cases = plan["test_cases"]
+        self.quarantined = plan.get("quarantined", [])
+
+        # Statistics, the results file is the checkpoint of the session
+        self.stats = TestCaseRunStats(
+            plan["projects"], self.test_cases, args.retry,
+            os.path.join(session_log_dir, SESSION_RESULTS_FILE),
+            plan.get("iut_build"), self.quarantined, args.quarantine_retry)
+        self.stats.workers = worker_count
+        self.stats.events = bus.bind(session=self.name)
+
+        if args.results_db:
+            import autoptsdb
+
+            self.stats.recorder = autoptsdb.ResultsRecorder(
+                args.results_db, self.name, plan.get("iut_build"),
+                self.workspace)
+            bus.subscribe(self.stats.recorder.handle_event,
+                          drop=autoptsevents.DROP_NONE,
+                          name="results-db-%s" % self.name,
+                          kinds=(autoptsevents.VERDICT,))
+
+        self.pending = self.stats.get_pending_test_cases(self.test_cases)
+        index_of = dict((tc, index) for index, tc in
+                        enumerate(self.test_cases))
+
+        # test case queue of each PTS instance
+        self.queues = [TestCaseQueue([(index_of[tc], tc)
+                                      for tc in self.pending])] * worker_count
+
+
+class WorkspaceScheduler(object):
+    """Hands test cases of the workspace sessions to the PTS instances
+
+    An instance takes test cases of the workspace it has open. Once there
+    are none left, it opens the workspace with most test cases left.
+
+    """
+
+    def __init__(self, sessions, events=autoptsevents.NO_EVENTS):
+        """Constructor
+
+        events -- autoptsevents.Publisher of events of the PTS instances
+
+        """
+        self.sessions = sessions
+        self.events = events
+        self.switch_count = 0
+        self._lock = threading.Lock()
+
+    def get(self, index, pts):
+        """Returns (session, (index, test case name)) of next test case to
+        run on the PTS instance with the index, None if there is none left"""
+        for session in self.sessions:
+            if session.workspace == pts.workspace:
+                next_test_case = session.queues[index].get()
+                if next_test_case is not None:
+                    return session, next_test_case
+
+        with self._lock:
+            others = sorted((s for s in self.sessions
+                             if s.workspace != pts.workspace),
+                            key=lambda s: -len(s.queues[index]))
+
+        for session in others:
+            next_test_case = session.queues[index].get()
+            if next_test_case is None:
+                continue
+
+            try:
+                self.switch(pts, session.workspace)
+
+            except Exception:
+                session.queues[index].put_back(next_test_case)
+                raise
+
+            return session, next_test_case
+
+        return None
+
+    def switch(self, pts, workspace):
+        """Opens the workspace on the PTS instance"""
+        print("(%r) Opening workspace %s" % (id(pts), workspace))
+
+        pts.switch_workspace(workspace)
+        pts.workspace = workspace
+
+        with self._lock:
+            self.switch_count += 1
 
-    # Statistics
-    stats = TestCaseRunStats(projects, test_cases, args.retry)
+    def close(self, index):
+        """Called when the PTS instance with the index stops"""
+        for session in self.sessions:
+            session.queues[index].close()
 
-    for test_case in test_cases:
-        stats.run_count = 0
 
+def run_test_cases_thread_entry(pts, index, scheduler, test_case_instances,
+                                args, breaker, timeouts, params, health,
+                                liveness):
+    """Runs test cases taken from the scheduler on a single PTS instance
+    until there are none left or the circuit breaker finds the IUT dead and
+    there is no spare IUT in the pool"""
+    log("%s %r", run_test_cases_thread_entry.__name__, id(pts))
+
+    try:
         while True:
-            status, duration = run_test_case(ptses, args.workspace, test_case_instances,
-                                             test_case, stats, session_log_dir)
+            if not breaker.allow():
+                iut = pts.iut
+                if not (args.iut_pool and replace_iut(pts, args.iut_pool)):
+                    break
+
+                scheduler.events.publish(
+                    autoptsevents.RECOVERY,
+                    action=autoptsevents.RECOVERY_REPLACE_IUT,
+                    reason="IUT %s is dead" % iut.name, pts=id(pts),
+                    iut=pts.iut.name)
 
-            if status == 'PASS' or stats.run_count == args.retry:
+                breaker.reset()
+
+            next_item = scheduler.get(index, pts)
+            if next_item is None:
                 break
 
-            stats.run_count += 1
+            session, next_test_case = next_item
+            test_case_queue = session.queues[index]
+            stats = session.stats
+
+            test_case_index, test_case = next_test_case
+            # non zero if resumed session has been interrupted during retries
+            run_count = stats.get_run_count(test_case)
+            total_duration = 0
+            first_duration = None
+
+            # the ping round trip overlaps the PTS setup
+            liveness.start()
+
+            pts_timeout = timeouts.get(test_case)
+            timeouts.apply(pts, pts_timeout)
+
+            params.apply(test_case_lookup_name(test_case_instances, test_case))
+
+            # the test case is held, other instances can take it meanwhile
+            if not liveness.finish():
+                print("(%r) IUT does not respond to ping, holding %s" %
+                      (id(pts), test_case))
+                test_case_queue.put_back(next_test_case)
+                stats.events.publish(autoptsevents.RECOVERY,
+                                     action=autoptsevents.RECOVERY_HOLD,
+                                     reason="IUT does not respond to ping",
+                                     pts=id(pts), test_case=test_case)
+                breaker.wait_for_iut()
+                continue
+
+            while True:
+                status, duration = run_test_case(pts, session.workspace,
+                                                 test_case_instances,
+                                                 test_case, stats,
+                                                 session.session_log_dir,
+                                                 test_case_index, run_count,
+                                                 pts_timeout)
+                total_duration += duration
+                if first_duration is None:
+                    first_duration = duration
+
+                breaker.record(status, duration)
+                timeouts.record(status, pts_timeout)
+
+                if status == 'PASS' or \
+                        run_count + 1 >= stats.get_run_count_max(test_case) or \
+                        breaker.is_open():
+                    break
+
+                run_count += 1
+                stats.events.publish(autoptsevents.RETRY, test_case=test_case,
+                                     run=run_count + 1, status=status)
+
+            test_case_queue.done(test_case, status, total_duration, run_count)
+
+            # PTS is recycled only between test cases
+            reason = health.check(pts, test_case, first_duration)
+            if reason:
+                scheduler.events.publish(
+                    autoptsevents.RECOVERY,
+                    action=autoptsevents.RECOVERY_RECYCLE_PTS, reason=reason,
+                    pts=id(pts))
+
+    finally:
+        scheduler.close(index)
+
+
+def get_test_case_catalog(pts, workspace):
+    """Returns ordered dict of project: test case names of the workspace
+    open in PTS, the catalog is cached for the planner"""
+    catalog_start_time = time.time()
+    catalog = collections.OrderedDict()
+
+    projects = pts.get_project_list()
+
+    # test case lists of all projects in one round trip
+    multicall = xmlrpc.client.MultiCall(pts)
+    for project in projects:
+        multicall.get_test_case_list(project)
+
+    for project, _test_case_list in zip(projects, multicall()):
+        catalog[project] = _test_case_list
+
+    log("Test case catalog fetched in %.2f s", time.time() - catalog_start_time)
+
+    import autoptsplan
+
+    autoptsplan.save_catalog(workspace, catalog)
+
+    return catalog
+
+
+def load_selection_history(args):
+    """Returns results history used to select test cases, see
+    autoptshistory.load_results, empty if the selection does not need it.
+
+    It is loaded once before the session directories are created, so the
+    sessions being started are not part of it.
+
+    """
+    if not (args.rerun_failed or args.quarantine or
+            (args.shard and args.history) or
+            autoptsselect.uses_history(list(args.test_cases) +
+                                       list(args.excluded))):
+        return []
+
+    return autoptshistory.load_results(args.history or [SESSION_LOGS_DIR])
+
+
+def select_test_cases(catalog, test_case_instances, args, sessions):
+    """Returns (test cases, quarantined, flaky) selected from the catalog by
+    the command line arguments and the results history sessions, in the
+    order they are run"""
+    included = list(args.test_cases)
+    if args.rerun_failed:
+        included.append(autoptsselect.HISTORY_PREFIX +
+                        autoptsselect.SELECTOR_FAILED)
+
+    run_or_not = autoptsselect.TestCaseSelector(included, args.excluded,
+                                                sessions)
+
+    test_cases = []
+    for _test_case_list in catalog.values():
+        test_cases += run_or_not.select(_test_case_list)
+
+    if args.shard:
+        # sharding by hash without --history, jobs must agree on the shards
+        durations = autoptshistory.get_durations(sessions) \
+            if args.history else {}
+        test_cases = autoptsshard.shard_test_cases(test_cases, args.shard,
+                                                   durations)
+
+    test_cases = autoptsparams.order_by_parameters(test_cases,
+                                                   test_case_instances)
 
-        stats.index += 1
+    # flaky test cases are run in a low priority pass after the others
+    quarantined = []
+    flaky = {}
+    if args.quarantine:
+        flaky = autoptsflaky.find_flaky(sessions)
+        test_cases, quarantined = autoptsflaky.quarantine(test_cases, flaky)
 
-    stats.print_summary()
+    return test_cases, quarantined, flaky
 
-    return stats.get_status_count(), stats.get_results()
+
+def plan_test_cases(test_case_instances, args):
+    """Prints the wall time estimate of running the selected test cases,
+    nothing is run, see autoptsplan"""
+    import autoptsplan
+
+    test_cases = []
+    quarantined = []
+    sessions = autoptshistory.load_results(args.history or
+                                           [SESSION_LOGS_DIR])
+
+    for workspace in args.workspaces:
+        catalog = autoptsplan.load_catalog(workspace)
+
+        # no session run with the workspace yet, ask PTS if it is ready anyway
+        if catalog is None and args.ip_addr:
+            server_host, server_port = parse_server_address(args.ip_addr[0])
+            proxy = ptsrpc.connect(server_host, server_port,
+                                   args.rpc_transport)
+
+            try:
+                if proxy.is_workspace_open(workspace):
+                    catalog = get_test_case_catalog(proxy, workspace)
+            except (OSError, xmlrpc.client.Error) as error:
+                log("Catalog not available from %s: %r", args.ip_addr[0],
+                    error)
+
+        if catalog is None:
+            sys.exit("No test case catalog of %s, run a session with it "
+                     "first or start PTS with the workspace open" % workspace)
+
+        selected, selected_quarantined, _ = select_test_cases(
+            catalog, test_case_instances, args, sessions)
+        test_cases += selected
+        quarantined += selected_quarantined
+
+    # pipelined instances run one test case at a time
+    instance_count = 1 if args.pipeline else len(args.ip_addr or [None])
+
+    def run_count_max(test_case):
+        if test_case in quarantined:
+            return args.quarantine_retry + 1
+        return args.retry + 1
+
+    estimates = autoptsplan.estimate(test_cases, sessions, run_count_max)
+
+    autoptsplan.print_plan(
+        test_cases, estimates, instance_count,
+        autoptsplan.simulate(test_cases, estimates, instance_count),
+        autoptsplan.simulate(test_cases, estimates, instance_count, True))
+
+    if quarantined:
+        print("\n%d flaky test cases quarantined, run last" % len(quarantined))
+
+
+def check_iuts(ptses, probes):
+    """Pre-flight check of the IUTs of the PTS instances, queried for their
+    capabilities in parallel. Only IUTs whose tester answered are pinged
+    before test cases, testers without the probe commands never answer."""
+    for probe in probes:
+        probe.start_query(ptstypes.IUT_PROBE_CAPABILITIES)
+
+    for pts, probe in zip(ptses, probes):
+        result = probe.finish_query()
+        if result is None:
+            continue
+
+        if result["ok"]:
+            print("(%r) IUT capabilities: %s" % (id(pts), result["result"]))
+        else:
+            print("(%r) IUT does not answer the %s command, it is not pinged "
+                  "before test cases" % (id(pts),
+                                         ptstypes.IUT_PROBE_CAPABILITIES))
+
+
+def create_event_bus(args):
+    """Returns (autoptsevents.EventBus, sinks to close) with the sinks given
+    by the options"""
+    bus = autoptsevents.EventBus()
+    sinks = []
+
+    if args.events_log:
+        sinks.append(autoptsevents.JSONLinesSink(args.events_log))
+
+    if args.events_sse is not None:
+        sinks.append(autoptsevents.SSEServer(args.events_sse))
+        print("Session events on http://127.0.0.1:%d/events" %
+              sinks[-1].server_address[1])
+
+    for sink in sinks + args.event_sink:
+        bus.subscribe(sink)
+
+    return bus, sinks
+
+
+def run_test_cases(ptses, test_case_instances, args):
+    """Runs a list of test cases in each workspace
+
+    Returns (status counts, results) of the session, list of them in the
+    order of workspaces if there are several
+
+    """
+    bus, sinks = create_event_bus(args)
+
+    sessions = []
+    scheduler = WorkspaceScheduler(sessions, bus.bind())
+
+    if args.resume:
+        for name in args.resume:
+            session_log_dir = os.path.join(SESSION_LOGS_DIR, name)
+            sessions.append(WorkspaceSession(
+                session_log_dir, load_session_plan(session_log_dir), args,
+                len(ptses), bus))
+
+    else:
+        now = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        history = load_selection_history(args)
+
+        for workspace in args.workspaces:
+            session_log_dir = create_session_log_dir(now)
+
+            # catalog is read from an instance with the workspace open
+            pts = next((p for p in ptses if p.workspace == workspace), None)
+            if pts is None:
+                pts = ptses[0]
+                scheduler.switch(pts, workspace)
+
+            catalog = get_test_case_catalog(pts, workspace)
+            test_cases, quarantined, flaky = select_test_cases(
+                catalog, test_case_instances, args, history)
+
+            plan = save_session_plan(session_log_dir, workspace, list(catalog),
+                                     test_cases, quarantined, args.iut_build)
+
+            for test_case in quarantined:
+                log("Quarantined %s: %r", test_case, flaky[test_case])
+
+            sessions.append(WorkspaceSession(session_log_dir, plan, args,
+                                             len(ptses), bus))
+
+    for session in sessions:
+        print("Session %s: %d of %d test cases to run%s" %
+              (session.name, len(session.pending), len(session.test_cases),
+               ", workspace %s" % session.workspace
+               if len(sessions) > 1 else ""))
+
+        if session.quarantined:
+            print("%d flaky test cases quarantined, run last with %d retries" %
+                  (len(session.quarantined), args.quarantine_retry))
+
+    print("Resume with --resume %s" % " ".join(s.name for s in sessions))
+
+    for session in sessions:
+        session.stats.events.publish(autoptsevents.SESSION_START,
+                                     workspace=session.workspace,
+                                     test_cases=len(session.test_cases),
+                                     pending=len(session.pending))
+
+    if args.coordinator:
+        from autoptscoordinator import CoordinatorWorker
+
+        if len(sessions) > 1:
+            sys.exit("Sessions shared with --coordinator have one workspace")
+
+        # Each PTS instance is a separate worker of the shared session
+        workers = [CoordinatorWorker(args.coordinator, "%s-%d" %
+                                     (socket.gethostname(), index))
+                   for index in range(len(ptses))]
+
+        for worker in workers:
+            worker.register()
+
+        workers[0].submit_test_cases(sessions[0].pending)
+        sessions[0].queues = [CoordinatedTestCaseQueue(worker)
+                              for worker in workers]
+
+    breakers = [CircuitBreaker(pts, args.breaker_threshold) for pts in ptses]
+    params = [autoptsparams.ParameterState(pts) for pts in ptses]
+
+    # overrides that could not be restored are refused before any test case
+    # runs with them
+    pending = set(tc for session in sessions for tc in session.pending)
+    try:
+        params[0].check(tc for tc in test_case_instances or ()
+                        if tc.name in pending)
+    except autoptsparams.ParameterError as error:
+        sys.exit(str(error))
+
+    if args.adaptive_timeouts:
+        timeouts = AdaptiveTimeouts(autoptshistory.load_durations(
+            args.history or [SESSION_LOGS_DIR], VERDICT_STATUSES))
+    else:
+        timeouts = AdaptiveTimeouts({})
+
+    # init_pts sets the default timeout
+    for pts in ptses:
+        timeouts.set_applied(pts, PTS_TIMEOUT)
+
+    probes = [LivenessProbe(pts) for pts in ptses]
+    if not args.no_iut_ping:
+        check_iuts(ptses, probes)
+
+    turns = None
+    if args.pipeline:
+        if args.iut_pool:
+            sys.exit("Pipelined PTS instances share one IUT, --iut-pool "
+                     "cannot be used")
+
+        if len(ptses) < 2:
+            print("Only one PTS instance, test cases are not pipelined")
+
+        turns = PipelineTurns()
+        for pts in ptses:
+            pts.turns = turns
+
+    health = PTSHealthCheck({}, enabled=False)
+    if args.pts_watchdog:
+        health = PTSHealthCheck(autoptshistory.load_durations(
+            args.history or [SESSION_LOGS_DIR], VERDICT_STATUSES))
+
+    # Every PTS instance takes next test case from the queue as soon as it is
+    # done with the previous one, the first instance runs in this thread
+    thread_list = []
+    for index, (pts, breaker, pts_params, probe) in \
+            list(enumerate(zip(ptses, breakers, params, probes)))[1:]:
+        thread = threading.Thread(target=run_test_cases_thread_entry,
+                                  args=(pts, index, scheduler,
+                                        test_case_instances, args, breaker,
+                                        timeouts, pts_params, health, probe))
+        thread.daemon = True
+        thread.start()
+        thread_list.append(thread)
+
+    run_test_cases_thread_entry(ptses[0], 0, scheduler, test_case_instances,
+                                args, breakers[0], timeouts, params[0], health,
+                                probes[0])
+
+    for thread in thread_list:
+        thread.join()
+
+    blocked = []
+
+    for session in sessions:
+        stats = session.stats
+
+        # Test cases are left only if IUTs of all PTS instances are dead
+        session_blocked = session.queues[0].drain()
+        for index, test_case in session_blocked:
+            stats.update(test_case, 0, BLOCKED)
+
+        blocked += session_blocked
+
+        stats.events.publish(autoptsevents.SESSION_END,
+                             statuses=stats.get_status_count())
+
+    # the recorders get the last verdicts from the bus
+    bus.close()
+    for sink in sinks:
+        sink.close()
+
+    for session in sessions:
+        stats = session.stats
+
+        if stats.recorder:
+            stats.recorder.close()
+
+        if len(sessions) > 1:
+            print("\nWorkspace %s, session %s" % (session.workspace,
+                                                 session.name))
+
+        stats.print_summary()
+
+        if session.quarantined:
+            results = stats.get_results()
+            print("\nQuarantined flaky test cases:\n")
+            for test_case in session.quarantined:
+                print("%s %s" % (test_case.ljust(stats.max_test_case_name + 3),
+                                 results.get(test_case, "")))
+
+    fetchers = [vars(pts).get("artifacts") for pts in ptses]
+    fetchers = [fetcher for fetcher in fetchers if fetcher is not None]
+    if fetchers:
+        print("\nFetching PTS logs ...")
+        for fetcher in fetchers:
+            fetcher.close()
+
+        failed = [tc for fetcher in fetchers for tc in fetcher.failed]
+        print("PTS logs: %d files, %d already fetched, %.1f MB in %.1f MB "
+              "compressed%s" %
+              (sum(f.file_count for f in fetchers),
+               sum(f.dedup_count for f in fetchers),
+               sum(f.size for f in fetchers) / 1e6,
+               sum(f.wire_size for f in fetchers) / 1e6,
+               ", not fetched for %d test cases" % len(failed)
+               if failed else ""))
+
+    if args.adaptive_timeouts:
+        timeouts.print_report()
+
+    health.print_report()
+
+    if turns is not None:
+        turns.print_report()
+
+    ping_count = sum(p.ping_count for p in probes)
+    if ping_count:
+        round_trips = [t for p in probes for t in p.round_trips]
+        print("\nIUT pings: %d, not answered %d, mean round trip %d ms" %
+              (ping_count, sum(p.failure_count for p in probes),
+               1000 * sum(round_trips) / max(1, len(round_trips))))
+
+    switch_count = sum(p.switch_count for p in params)
+    if switch_count:
+        print("\nPIXIT/PICS values switched for test cases: %d" % switch_count)
+
+    if scheduler.switch_count:
+        print("\nWorkspaces opened during the session: %d" %
+              scheduler.switch_count)
+
+    if args.iut_pool and args.iut_pool.retired:
+        print("\nIUT pool: %d of %d IUTs taken out: %s" %
+              (len(args.iut_pool.retired), len(args.iut_pool.iuts),
+               ", ".join(iut.name for iut in args.iut_pool.retired)))
+
+    if blocked:
+        # against a dead IUT every run times out, so all retries are used
+        expected_duration = sessions[0].stats.run_count_max * \
+            max(b.get_expected_duration() for b in breakers)
+        print("\nCircuit breaker: %d test cases blocked, about %d s saved" %
+              (len(blocked), len(blocked) * expected_duration))
+
+    results = [(session.stats.get_status_count(), session.stats.get_results())
+               for session in sessions]
+
+    return results[0] if len(results) == 1 else results
 
 
 class CliParser(argparse.ArgumentParser):
@@ -532,29 +1731,190 @@ class CliParser(argparse.ArgumentParser):
         self.add_argument("-l", "--local_addr", nargs="+", default=None,
                           help="Local IP address of PTS automation client")
 
-        self.add_argument("workspace",
+        self.add_argument("workspaces", nargs="+", metavar="workspace",
                           help="Path to PTS workspace file to use for "
                                "testing. It should have pqw6 extension. "
                                "The file should be located on the "
-                               "machine, where automation server is running.")
+                               "machine, where automation server is running. "
+                               "Test cases of several workspaces are run in "
+                               "one session, each PTS instance keeps using "
+                               "the workspace it has open while it has test "
+                               "cases left")
 
         self.add_argument("-a", "--bd-addr",
                           help="Bluetooth device address of the IUT")
 
+        self.add_argument("--iut-pool", type=autoptsiut.parse_pool,
+                          default=None,
+                          help="JSON file with IUTs tested in parallel, "
+                               "see autoptsiut.py. Each PTS server is bound "
+                               "to its own IUT, --bd-addr is not used. IUTs "
+                               "left are spares of IUTs found dead")
+
         self.add_argument("-d", "--debug-logs", dest="enable_max_logs",
                           action='store_true', default=False,
                           help="Enable the PTS maximum logging. Equivalent "
                                "to running test case in PTS GUI using "
                                "'Run (Debug Logs)'")
 
+        self.add_argument("--debug-logs-on-failure", action="store_true",
+                          default=False,
+                          help="Enable the PTS maximum logging, but keep "
+                               "the logs in memory of the server and fetch "
+                               "them only for test cases not passed, into "
+                               "%s of the test case log directory" %
+                               DEBUG_LOG_FILE)
+
+        self.add_argument("--fetch-logs", default=None,
+                          choices=(FETCH_LOGS_FAILED, FETCH_LOGS_ALL),
+                          help="Make PTS save test history logs and fetch "
+                               "them from the server into the log directory "
+                               "of the test case, for test cases not passed "
+                               "or all. Logs are fetched while next test "
+                               "cases run")
+
+        self.add_argument("--restart-pts", action='store_true', default=False,
+                          help="Restart PTS even if it is running with the "
+                               "workspace already open")
+
         self.add_argument("-c", "--test-cases", nargs='+', default=[],
+                          type=autoptsselect.parse_pattern,
                           help="Names of test cases to run. Groups of "
-                               "test cases can be specified by profile names")
+                               "test cases can be specified by profile names, "
+                               "globs (PBAP/*/BV-0?-C), regular expressions "
+                               "(re:PATTERN) or history selectors (@failed, "
+                               "@never-passed, @slower:SECONDS)")
 
         self.add_argument("-e", "--excluded", nargs='+', default=[],
-                          help="Names of test cases to exclude. Groups of "
-                               "test cases can be specified by profile names")
+                          type=autoptsselect.parse_pattern,
+                          help="Names of test cases to exclude, patterns as "
+                               "in --test-cases")
+
+        self.add_argument("--rerun-failed", action="store_true",
+                          default=False,
+                          help="Run test cases that did not pass in the last "
+                               "session of --history (logs by default) that "
+                               "ran them, same as -c @failed")
 
         self.add_argument("-r", "--retry", type=int, default=0,
                           help="Repeat test if failed. Parameter specifies "
                                "maximum repeat count per test")
+
+        self.add_argument("--results-db", default=RESULTS_DB,
+                          help="SQLite database every test case run is "
+                               "recorded in, see autoptsdb.py. Empty "
+                               "string disables it")
+
+        self.add_argument("--iut-build", default=None,
+                          help="Identifier of the IUT build under test, e.g. "
+                               "commit hash. Recorded in the results, flaky "
+                               "test cases are detected within a build")
+
+        self.add_argument("--quarantine", action="store_true", default=False,
+                          help="Run test cases found flaky in --history (logs "
+                               "by default) after all others, with "
+                               "--quarantine-retry retries instead of --retry")
+
+        self.add_argument("--quarantine-retry", type=int,
+                          default=QUARANTINE_RETRY,
+                          help="Repeat count of quarantined flaky test cases")
+
+        self.add_argument("--breaker-threshold", type=int,
+                          default=BREAKER_THRESHOLD,
+                          help="Number of consecutive test cases ending with "
+                               "a timeout after which the IUT is probed and "
+                               "if it is dead remaining test cases are "
+                               "blocked. 0 disables the circuit breaker")
+
+        self.add_argument("--no-iut-ping", action="store_true",
+                          default=False,
+                          help="Do not query the IUT over MQTT at session "
+                               "start and do not ping it before test cases. "
+                               "IUTs that answer the query are pinged and "
+                               "test cases are held while the IUT does not "
+                               "respond")
+
+        self.add_argument("--pts-watchdog", action="store_true",
+                          default=False,
+                          help="Recycle PTS between test cases when its "
+                               "memory, handles, CPU or slowing down test "
+                               "cases exceed the limits of the server, see "
+                               "ptswatchdog.py. Durations expected are taken "
+                               "from --history (logs by default)")
+
+        self.add_argument("--pipeline", action="store_true", default=False,
+                          help="The PTS servers test the same IUT: test "
+                               "cases run one at a time, the next one is "
+                               "prepared on another PTS instance while one "
+                               "runs, see autoptspipeline.py")
+
+        self.add_argument("--adaptive-timeouts", action="store_true",
+                          default=False,
+                          help="Derive RunTestCase timeout of each test case "
+                               "from its durations recorded in --history "
+                               "(logs by default) instead of using %d ms for "
+                               "all" % PTS_TIMEOUT)
+
+        self.add_argument("--shard", metavar="K/N", default=None,
+                          type=autoptsshard.parse_shard,
+                          help="Run only K-th of N parts of the selected test "
+                               "cases. Parts are balanced by durations if "
+                               "--history is given, all jobs should use the "
+                               "same history")
+
+        self.add_argument("--history", nargs="+", default=[],
+                          help="Results of previous sessions: session "
+                               "directories, results files or directories "
+                               "with sessions (logs by default, not used "
+                               "by --shard)")
+
+        self.add_argument("--resume", metavar="SESSION", nargs="+",
+                          default=None,
+                          help="Resume interrupted session, e.g. "
+                               "2019_01_31_10_00_00, all sessions printed at "
+                               "its start if it had several workspaces. Only "
+                               "test cases not run yet or with retries left "
+                               "are run, the summary covers the whole session")
+
+        self.add_argument("--plan", action="store_true", default=False,
+                          help="Only print estimated duration of the "
+                               "session with the given options, its "
+                               "critical path and the longest test cases. "
+                               "Test cases are taken from the catalog cached "
+                               "by previous sessions, durations and failure "
+                               "rates from --history (logs by default)")
+
+        self.add_argument("--events-log", default=None,
+                          help="Append events of the session (test case "
+                               "start, MMI, verdict, retry, recovery) to the "
+                               "file as JSON lines, see autoptsevents.py")
+
+        self.add_argument("--events-sse", metavar="PORT", type=int,
+                          default=None,
+                          help="Serve events of the session as server-sent "
+                               "events on http://127.0.0.1:PORT/events")
+
+        self.add_argument("--event-sink", metavar="MODULE:CALLABLE",
+                          type=autoptsevents.load_sink, action="append",
+                          default=[],
+                          help="Pass events of the session to the callable, "
+                               "called from its own thread. Events are "
+                               "dropped if it does not keep up")
+
+        self.add_argument("--rpc-transport", choices=ptsrpc.TRANSPORTS,
+                          default=ptsrpc.TRANSPORT_AUTO,
+                          help="Transport of calls to the PTS server: framed "
+                               "if the server offers it (auto), or forced")
+
+        self.add_argument("--callback", default=CALLBACK_AUTO,
+                          choices=(CALLBACK_AUTO, CALLBACK_STREAM,
+                                   CALLBACK_XMLRPC),
+                          help="How PTS logs reach the client: event stream "
+                               "opened by the client (auto if the server "
+                               "offers it), or callback server on the client "
+                               "ports the server connects to")
+
+        self.add_argument("--coordinator", default=None,
+                          help="Address (host:port) of the test coordinator. "
+                               "Test cases are then shared with all clients "
+                               "connected to the same coordinator")
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+"""Test coordinator shared by many auto PTS clients
+
+The coordinator holds the test case queue of a single test session. Client
+workers (one per PTS instance) register with it, lease test cases, report
+verdicts and send heartbeats. A worker that stops sending heartbeats is
+evicted and test cases leased by it go back to the queue. A verdict is
+accepted only for a valid lease, so a test case result is never recorded
+twice, even if an evicted worker comes back and reports late.
+
+Once all test cases of the session are done, the next client submitting test
+cases starts a new session, so the coordinator can be left running.
+
+Usage:
+
+    ./autoptscoordinator.py -p 65100
+
+    ./autoptsclient-maxwell.py [workspace] -i [server] -c PBAP \
+        --coordinator [coordinator host]:65100
+"""
+
+import sys
+import time
+import uuid
+import logging
+import argparse
+import threading
+import collections
+import xmlrpc.client
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer
+
+from config import COORDINATOR_PORT, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT
+
+log = logging.debug
+
+# lease_test_case replies
+LEASE_DONE = "DONE"  # nothing left to run, worker should exit
+LEASE_WAIT = "WAIT"  # all left test cases are leased, ask again later
+LEASE_UNKNOWN_WORKER = "UNKNOWN_WORKER"  # e.g. evicted, register again
+
+
+class TestCoordinator(object):
+    """Test case queue of a session with worker leases"""
+
+    def __init__(self, heartbeat_timeout=HEARTBEAT_TIMEOUT, clock=time.time):
+        """Constructor
+
+        heartbeat_timeout -- Seconds without heartbeat after which worker is
+                             evicted
+        clock -- Time source, for testing
+
+        """
+        self._heartbeat_timeout = heartbeat_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._test_cases = {}  # all test cases: submission index
+        self._pending = collections.deque()
+        self._leases = {}  # lease id: (worker id, test case name)
+        self._workers = {}  # worker id: {"name", "last_seen", "leases"}
+        self._results = collections.OrderedDict()  # test case name: result
+        self._session = 0  # number of the session, see submit_test_cases
+
+    def _is_finished(self):
+        """Returns True if all test cases of the session are done, must be
+        called with the lock held"""
+        return bool(self._test_cases) and not self._pending and \
+            not self._leases
+
+    def submit_test_cases(self, test_cases):
+        """Adds test cases to the session queue
+
+        Test cases already known to the session are ignored, so all clients
+        joining the session can submit their selection. If the session is
+        finished, a new one is started with the test cases.
+
+        Returns number of test cases added
+
+        """
+        with self._lock:
+            if self._is_finished():
+                log("Session %d finished, starting a new one", self._session)
+                self._test_cases.clear()
+                self._results.clear()
+                self._session += 1
+
+            added = []
+            for test_case in test_cases:
+                if test_case not in self._test_cases:
+                    self._test_cases[test_case] = len(self._test_cases)
+                    added.append(test_case)
+
+            self._pending.extend(added)
+
+        log("%s added %d", self.submit_test_cases.__name__, len(added))
+        return len(added)
+
+    def register_worker(self, name):
+        """Registers a worker, returns its id"""
+        worker_id = "%s-%s" % (name, uuid.uuid4().hex[:8])
+
+        with self._lock:
+            self._workers[worker_id] = {"name": name,
+                                        "last_seen": self._clock(),
+                                        "leases": set()}
+
+        log("%s %s", self.register_worker.__name__, worker_id)
+        return worker_id
+
+    def heartbeat(self, worker_id):
+        """Keeps the worker alive
+
+        Returns False if the worker is not registered (e.g. was evicted), it
+        should then register again
+
+        """
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                return False
+
+            worker["last_seen"] = self._clock()
+            return True
+
+    def lease_test_case(self, worker_id):
+        """Leases the next test case to the worker
+
+        Returns dict with "status": LEASE_DONE, LEASE_WAIT or
+        LEASE_UNKNOWN_WORKER, or with the "lease", "test_case", "index" and
+        "total" of the leased test case
+
+        """
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                log("%s unknown worker %s", self.lease_test_case.__name__,
+                    worker_id)
+                return {"status": LEASE_UNKNOWN_WORKER}
+
+            worker["last_seen"] = self._clock()
+
+            if not self._pending:
+                if self._leases:
+                    return {"status": LEASE_WAIT}
+
+                return {"status": LEASE_DONE}
+
+            test_case = self._pending.popleft()
+            lease_id = uuid.uuid4().hex
+
+            self._leases[lease_id] = (worker_id, test_case)
+            worker["leases"].add(lease_id)
+
+            return {"status": "", "lease": lease_id, "test_case": test_case,
+                    "index": self._test_cases[test_case],
+                    "total": len(self._test_cases)}
+
+    def report_verdict(self, worker_id, lease_id, status, duration, run_count):
+        """Records verdict of a leased test case
+
+        Returns False if the lease is no longer valid or the worker is not
+        registered (e.g. was evicted), the verdict is then dropped as the
+        test case has been given to another worker
+
+        """
+        with self._lock:
+            lease = self._leases.get(lease_id)
+            worker = self._workers.get(worker_id)
+            if lease is None or lease[0] != worker_id or worker is None:
+                log("%s stale lease %s of %s", self.report_verdict.__name__,
+                    lease_id, worker_id)
+                return False
+
+            del self._leases[lease_id]
+
+            worker["leases"].discard(lease_id)
+            worker["last_seen"] = self._clock()
+
+            self._results[lease[1]] = {"status": status,
+                                       "duration": duration,
+                                       "run_count": run_count,
+                                       "worker": worker["name"]}
+            return True
+
+    def unregister_worker(self, worker_id):
+        """Removes the worker, its leased test cases go back to the queue"""
+        with self._lock:
+            self._remove_worker(worker_id)
+
+    def _remove_worker(self, worker_id):
+        """Removes the worker, must be called with the lock held"""
+        worker = self._workers.pop(worker_id, None)
+        if worker is None:
+            return
+
+        # leased test cases are put in front to keep the order
+        for lease_id in worker["leases"]:
+            _, test_case = self._leases.pop(lease_id)
+            self._pending.appendleft(test_case)
+
+            log("Requeued %s of %s", test_case, worker_id)
+
+    def evict_expired(self):
+        """Evicts workers that did not send heartbeat in time
+
+        Returns list of evicted worker ids
+
+        """
+        with self._lock:
+            deadline = self._clock() - self._heartbeat_timeout
+            expired = [worker_id for worker_id, worker in self._workers.items()
+                       if worker["last_seen"] < deadline]
+
+            for worker_id in expired:
+                log("Evicting worker %s", worker_id)
+                self._remove_worker(worker_id)
+
+        return expired
+
+    def get_results(self):
+        """Returns dict of test case name: final status"""
+        with self._lock:
+            return dict((name, result["status"])
+                        for name, result in self._results.items())
+
+    def get_session_status(self):
+        """Returns number of the session and counts of its pending, leased
+        and done test cases and of workers"""
+        with self._lock:
+            return {"session": self._session,
+                    "pending": len(self._pending),
+                    "leased": len(self._leases),
+                    "done": len(self._results),
+                    "total": len(self._test_cases),
+                    "workers": len(self._workers)}
+
+
+class EvictionThread(threading.Thread):
+    """Periodically evicts workers that stopped sending heartbeats"""
+
+    def __init__(self, coordinator, interval=HEARTBEAT_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.coordinator = coordinator
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.coordinator.evict_expired()
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """XML-RPC server handling each worker request in a separate thread"""
+    daemon_threads = True
+
+
+class HeartbeatThread(threading.Thread):
+    """Sends heartbeats of a worker until stopped
+
+    Uses its own proxy, as xmlrpc.client.ServerProxy is not thread safe
+
+    """
+
+    def __init__(self, coordinator_url, worker_id, interval=HEARTBEAT_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.proxy = xmlrpc.client.ServerProxy(coordinator_url, allow_none=True)
+        self.worker_id = worker_id
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.evicted = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                if not self.proxy.heartbeat(self.worker_id):
+                    self.evicted.set()
+                    return
+
+            except Exception as error:
+                # keep trying, the coordinator evicts us if it lasts too long
+                logging.exception(repr(error))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class CoordinatorWorker(object):
+    """Client side of the coordinator protocol for a single PTS instance"""
+
+    def __init__(self, coordinator_addr, name):
+        """Constructor
+
+        coordinator_addr -- "host:port" of the coordinator
+        name -- Human readable worker name, e.g. PTS server address
+
+        """
+        host, _, port = coordinator_addr.rpartition(":")
+        self.url = "http://{}:{}/".format(host or coordinator_addr,
+                                          port if host else COORDINATOR_PORT)
+        self.name = name
+        self.proxy = xmlrpc.client.ServerProxy(self.url, allow_none=True)
+        self.worker_id = None
+        self.heartbeat_thread = None
+
+    def register(self):
+        """Registers the worker and starts sending heartbeats"""
+        self.worker_id = self.proxy.register_worker(self.name)
+
+        self.heartbeat_thread = HeartbeatThread(self.url, self.worker_id)
+        self.heartbeat_thread.start()
+
+        log("Registered worker %s at %s", self.worker_id, self.url)
+
+    def submit_test_cases(self, test_cases):
+        return self.proxy.submit_test_cases(list(test_cases))
+
+    def lease_test_case(self):
+        """Returns lease dict, waits while all pending test cases are leased
+        by other workers. Returns None once the session is done."""
+        while True:
+            lease = self.proxy.lease_test_case(self.worker_id)
+
+            # evicted, also before the heartbeat thread noticed
+            if lease["status"] == LEASE_UNKNOWN_WORKER:
+                log("Worker %s evicted, registering again", self.worker_id)
+                self.heartbeat_thread.stop()
+                self.register()
+                continue
+
+            if lease["status"] == LEASE_DONE:
+                return None
+
+            if lease["status"] != LEASE_WAIT:
+                return lease
+
+            time.sleep(1)
+
+    def report_verdict(self, lease, status, duration, run_count):
+        return self.proxy.report_verdict(self.worker_id, lease["lease"],
+                                         status, duration, run_count)
+
+    def unregister(self):
+        """Stops heartbeats and unregisters the worker"""
+        if self.heartbeat_thread:
+            self.heartbeat_thread.stop()
+
+        if self.worker_id:
+            self.proxy.unregister_worker(self.worker_id)
+            self.worker_id = None
+
+
+def parse_args():
+    """Parses command line arguments and options"""
+
+    arg_parser = argparse.ArgumentParser(description="PTS test coordinator")
+
+    arg_parser.add_argument("-p", "--port", type=int, default=COORDINATOR_PORT,
+                            help="TCP port to serve on")
+
+    arg_parser.add_argument("-t", "--heartbeat-timeout", type=float,
+                            default=HEARTBEAT_TIMEOUT,
+                            help="Seconds without heartbeat after which a "
+                                 "worker is evicted")
+
+    return arg_parser.parse_args()
+
+
+def main():
+    """Main."""
+
+    args = parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s : %(message)s",
+                        filename="autoptscoordinator.log",
+                        filemode='w',
+                        level=logging.DEBUG)
+
+    coordinator = TestCoordinator(args.heartbeat_timeout)
+    EvictionThread(coordinator).start()
+
+    print("Serving on port {} ...".format(args.port))
+
+    server = ThreadingXMLRPCServer(("", args.port), allow_none=True,
+                                   logRequests=False)
+    server.register_instance(coordinator)
+    server.register_introspection_functions()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+
+    except KeyboardInterrupt:  # Ctrl-C
+        sys.exit(14)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+
+"""Results history in a SQLite database
+
+Every run of a test case (including retries) is recorded by the client in
+logs/results.db, together with the final result of each test case of the
+session. Queries over months of nightly sessions are then answered from
+indexed tables instead of parsing results files:
+
+    ./autoptsdb.py pass-rate --by build --test PBAP/PCE
+    ./autoptsdb.py slowest -n 20
+    ./autoptsdb.py regressions --recent 3 --baseline 10 --factor 1.5
+    ./autoptsdb.py compare 1a2b3c 4d5e6f
+    ./autoptsdb.py import logs
+
+Schema:
+
+    sessions  name, started, iut_build, workspace
+    runs      every run: session, test case, attempt, status, duration
+    results   final status of each test case in each session
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import datetime
+import threading
+
+import autoptshistory
+import autoptsevents
+from autoptstimeouts import VERDICT_STATUSES
+
+log = logging.debug
+
+RESULTS_DB = os.path.join("logs", "results.db")
+
+# runs are written in one transaction once there are that many
+BATCH_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    started REAL NOT NULL,
+    iut_build TEXT,
+    workspace TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE INDEX IF NOT EXISTS sessions_iut_build ON sessions (iut_build);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    test_case TEXT NOT NULL,
+    project TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    verdict TEXT,
+    error_code TEXT,
+    duration REAL NOT NULL,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_test_case ON runs (test_case, session_id);
+CREATE INDEX IF NOT EXISTS runs_session ON runs (session_id);
+
+CREATE TABLE IF NOT EXISTS results (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    test_case TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL NOT NULL,
+    run_count INTEGER NOT NULL,
+    PRIMARY KEY (session_id, test_case)
+);
+CREATE INDEX IF NOT EXISTS results_test_case ON results (test_case);
+"""
+
+
+def connect(path=RESULTS_DB):
+    """Opens the database, creating the schema if needed"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+
+    return db
+
+
+def add_session(db, name, started, iut_build=None, workspace=None):
+    """Returns id of the session, added if it is not there yet (resume)"""
+    with db:
+        db.execute("INSERT OR IGNORE INTO sessions "
+                   "(name, started, iut_build, workspace) VALUES (?, ?, ?, ?)",
+                   (name, started, iut_build, workspace))
+
+    return db.execute("SELECT id FROM sessions WHERE name = ?",
+                      (name,)).fetchone()[0]
+
+
+def _run_row(session_id, test_case, attempt, status, duration, finished):
+    verdict = status if status in VERDICT_STATUSES else None
+    error_code = None if verdict else status
+
+    return (session_id, test_case, test_case.split("/")[0], attempt, status,
+            verdict, error_code, duration, finished)
+
+
+class ResultsRecorder(object):
+    """Records runs of a session in batches, thread safe"""
+
+    def __init__(self, path, session_name, iut_build=None, workspace=None,
+                 batch_size=BATCH_SIZE):
+        self._db = connect(path)
+        self._lock = threading.Lock()
+        self._batch_size = batch_size
+        self._runs = []
+        self._results = {}
+
+        self.session_name = session_name
+        self.session_id = add_session(self._db, session_name, time.time(),
+                                      iut_build, workspace)
+
+    def record(self, test_case, attempt, status, duration):
+        """Records a run, attempt counted from 1"""
+        with self._lock:
+            self._runs.append(_run_row(self.session_id, test_case, attempt,
+                                       status, duration, time.time()))
+
+            previous = self._results.get(test_case)
+            total = duration + (previous[3] if previous else 0)
+            self._results[test_case] = (self.session_id, test_case, status,
+                                        total, attempt)
+
+            if len(self._runs) >= self._batch_size:
+                self._flush()
+
+    def handle_event(self, event):
+        """autoptsevents sink, records verdicts of the session"""
+        if event.kind == autoptsevents.VERDICT and \
+                event.data.get("session") == self.session_name:
+            self.record(event.data["test_case"], event.data["run"],
+                        event.data["status"], event.data["duration"])
+
+    def _flush(self):
+        """Writes buffered rows in one transaction, with the lock held"""
+        if not self._runs:
+            return
+
+        with self._db:
+            self._db.executemany("INSERT INTO runs (session_id, test_case, "
+                                 "project, attempt, status, verdict, "
+                                 "error_code, duration, finished) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 self._runs)
+
+            # total duration of all attempts, also of the ones recorded
+            # before the session was resumed
+            self._db.executemany(
+                "INSERT INTO results (session_id, test_case, status, "
+                "duration, run_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (session_id, test_case) DO UPDATE SET "
+                "status = excluded.status, run_count = excluded.run_count, "
+                "duration = (SELECT SUM(duration) FROM runs WHERE "
+                "runs.session_id = excluded.session_id AND "
+                "runs.test_case = excluded.test_case)",
+                list(self._results.values()))
+
+        log("Recorded %d runs", len(self._runs))
+        self._runs = []
+        self._results = {}
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+def _session_start(name, results_file):
+    """Returns start time of the session named by the client after it, or
+    the results file time for sessions named otherwise"""
+    try:
+        started = datetime.datetime.strptime(name[:19], "%Y_%m_%d_%H_%M_%S")
+    except ValueError:
+        return os.path.getmtime(results_file)
+
+    return time.mktime(started.timetuple())
+
+
+def import_history(db, paths):
+    """Imports sessions from results files, returns number of sessions
+
+    Only final results are known, one run per test case is recorded.
+
+    """
+    count = 0
+
+    for results_file in autoptshistory.find_results_files(paths):
+        session_dir = os.path.dirname(os.path.abspath(results_file))
+        name = os.path.basename(session_dir)
+
+        if db.execute("SELECT 1 FROM sessions WHERE name = ?",
+                      (name,)).fetchone():
+            log("Session %s already imported", name)
+            continue
+
+        sessions = autoptshistory.load_results([results_file])
+        if not sessions:
+            continue
+
+        session = sessions[0]
+        builds = set(result["build"] for result in session.values())
+        started = _session_start(name, results_file)
+        session_id = add_session(db, name, started,
+                                 builds.pop() if len(builds) == 1 else None)
+
+        with db:
+            db.executemany("INSERT INTO runs (session_id, test_case, project, "
+                           "attempt, status, verdict, error_code, duration, "
+                           "finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [_run_row(session_id, tc, r["run_count"],
+                                     r["status"], r["duration"], started)
+                            for tc, r in session.items()])
+
+            db.executemany("INSERT INTO results (session_id, test_case, "
+                           "status, duration, run_count) "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           [(session_id, tc, r["status"], r["duration"],
+                             r["run_count"]) for tc, r in session.items()])
+
+        count += 1
+
+    return count
+
+
+def query_pass_rate(db, test_case=None, by="day", days=None):
+    """Returns list of (day or build, passed, total)"""
+    if by == "build":
+        group = "COALESCE(s.iut_build, '?')"
+    else:
+        group = "date(s.started, 'unixepoch', 'localtime')"
+
+    where = ["1"]
+    params = []
+
+    if test_case:
+        # prefix match, can use the test_case index
+        where.append("r.test_case >= ? AND r.test_case < ?")
+        params += [test_case, test_case + "\uffff"]
+
+    if days:
+        where.append("s.started >= ?")
+        params.append(time.time() - days * 24 * 3600)
+
+    return db.execute(
+        "SELECT %s AS grp, SUM(r.status = 'PASS'), COUNT(*) "
+        "FROM results r JOIN sessions s ON s.id = r.session_id "
+        "WHERE %s GROUP BY grp ORDER BY MIN(s.started)" %
+        (group, " AND ".join(where)), params).fetchall()
+
+
+def _last_session_ids(db, count, offset=0):
+    return [row[0] for row in db.execute(
+        "SELECT id FROM sessions ORDER BY started DESC LIMIT ? OFFSET ?",
+        (count, offset))]
+
+
+def _in(ids):
+    return "(%s)" % ", ".join(str(int(i)) for i in ids)
+
+
+def query_slowest(db, count=20, sessions=10):
+    """Returns list of (test case, mean duration, runs) of the slowest test
+    cases in the last sessions, durations of verdict runs only"""
+    ids = _last_session_ids(db, sessions)
+    if not ids:
+        return []
+
+    return db.execute(
+        "SELECT test_case, AVG(duration) AS mean, COUNT(*) FROM runs "
+        "WHERE session_id IN %s AND verdict IS NOT NULL "
+        "GROUP BY test_case ORDER BY mean DESC LIMIT ?" % _in(ids),
+        (count,)).fetchall()
+
+
+def query_regressions(db, recent=3, baseline=10, factor=1.5):
+    """Returns list of (test case, baseline mean, recent mean) of test cases
+    whose mean duration in the recent sessions grew over factor times the
+    mean of the baseline sessions before them"""
+    recent_ids = _last_session_ids(db, recent)
+    baseline_ids = _last_session_ids(db, baseline, recent)
+    if not recent_ids or not baseline_ids:
+        return []
+
+    mean = ("SELECT test_case, AVG(duration) AS mean FROM runs "
+            "WHERE session_id IN %s AND verdict IS NOT NULL "
+            "GROUP BY test_case")
+
+    return db.execute(
+        "SELECT b.test_case, b.mean, r.mean FROM (%s) b JOIN (%s) r "
+        "ON r.test_case = b.test_case WHERE r.mean > b.mean * ? "
+        "ORDER BY r.mean / b.mean DESC" %
+        (mean % _in(baseline_ids), mean % _in(recent_ids)),
+        (factor,)).fetchall()
+
+
+def query_compare(db, build_a, build_b):
+    """Returns list of (test case, status in build A, status in build B) of
+    test cases with different final status in the last session of each
+    build, missing status is None"""
+    def last_results(build):
+        row = db.execute("SELECT id FROM sessions WHERE iut_build = ? "
+                         "ORDER BY started DESC LIMIT 1", (build,)).fetchone()
+        if row is None:
+            raise ValueError("No session of build %s" % build)
+
+        return dict(db.execute("SELECT test_case, status FROM results "
+                               "WHERE session_id = ?", row))
+
+    a = last_results(build_a)
+    b = last_results(build_b)
+
+    return [(tc, a.get(tc), b.get(tc)) for tc in sorted(set(a) | set(b))
+            if a.get(tc) != b.get(tc)]
+
+
+def parse_args():
+    """Parses command line arguments and options"""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Query results history of the test sessions")
+
+    arg_parser.add_argument("--db", default=RESULTS_DB,
+                            help="Results database")
+
+    subparsers = arg_parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser = subparsers.add_parser("pass-rate", help="Pass rate over time")
+    parser.add_argument("--by", choices=("day", "build"), default="day")
+    parser.add_argument("--test", default=None,
+                        help="Test case name or prefix, e.g. PBAP/PCE")
+    parser.add_argument("--days", type=int, default=None,
+                        help="Only sessions of the last days")
+
+    parser = subparsers.add_parser("slowest", help="Slowest test cases")
+    parser.add_argument("-n", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=10,
+                        help="Number of last sessions to consider")
+
+    parser = subparsers.add_parser("regressions",
+                                   help="Test cases getting slower")
+    parser.add_argument("--recent", type=int, default=3,
+                        help="Number of last sessions compared")
+    parser.add_argument("--baseline", type=int, default=10,
+                        help="Number of sessions before them compared to")
+    parser.add_argument("--factor", type=float, default=1.5)
+
+    parser = subparsers.add_parser("compare",
+                                   help="Verdict changes between two builds")
+    parser.add_argument("build_a")
+    parser.add_argument("build_b")
+
+    parser = subparsers.add_parser("import",
+                                   help="Import sessions from results files")
+    parser.add_argument("paths", nargs="+",
+                        help="Session directories, results files or "
+                             "directories with sessions")
+
+    return arg_parser.parse_args()
+
+
+def main():
+    """Main."""
+    args = parse_args()
+    db = connect(args.db)
+
+    if args.command == "pass-rate":
+        for group, passed, total in query_pass_rate(db, args.test, args.by,
+                                                    args.days):
+            print("%-20s %6.1f%% %6d/%d" % (group, 100.0 * passed / total,
+                                            passed, total))
+
+    elif args.command == "slowest":
+        for test_case, mean, runs in query_slowest(db, args.n, args.sessions):
+            print("%-50s %10.1f s %6d runs" % (test_case, mean, runs))
+
+    elif args.command == "regressions":
+        for test_case, before, after in query_regressions(
+                db, args.recent, args.baseline, args.factor):
+            print("%-50s %10.1f s -> %.1f s" % (test_case, before, after))
+
+    elif args.command == "compare":
+        try:
+            changes = query_compare(db, args.build_a, args.build_b)
+        except ValueError as error:
+            sys.exit(str(error))
+
+        for test_case, status_a, status_b in changes:
+            print("%-50s %-16s %s" % (test_case, status_a or "-",
+                                      status_b or "-"))
+
+    elif args.command == "import":
+        print("Imported %d sessions" % import_history(db, args.paths))
+
+    db.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+
+    except KeyboardInterrupt:  # Ctrl-C
+        sys.exit(14)
@@ -0,0 +1,350 @@
+"""Live events of a test session
+
+The client publishes typed events to an in-process EventBus: session start
+and end, test case start, MMI answered, verdict of every run, retry and
+recovery of PTS or the IUT. Sinks subscribed to the bus, e.g. the results
+recorder, a dashboard or a chat notifier, receive them in their own thread.
+
+Publishing never waits for a sink. Each sink has a bounded queue, when it is
+full the oldest event (DROP_OLDEST) or the new one (DROP_NEWEST) is dropped
+and counted, so a slow sink loses events instead of delaying test cases.
+Durable sinks, e.g. the results recorder, are subscribed with DROP_NONE:
+their queue is not bounded and the bus waits for them when it is closed.
+
+Sinks are callables taking an Event. Besides the ones given to subscribe,
+sinks can be plugged in with --event-sink MODULE:CALLABLE, events are written
+as JSON lines with --events-log and served as server-sent events on
+http://127.0.0.1:PORT/events with --events-sse:
+
+    curl -N http://127.0.0.1:8000/events
+"""
+
+import json
+import time
+import logging
+import argparse
+import importlib
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import EVENT_BUS_CAPACITY, EVENT_BUS_CLOSE_TIMEOUT, \
+    EVENT_SSE_BACKLOG, EVENT_SSE_HEARTBEAT
+
+log = logging.debug
+
+# kinds of events, data of each kind
+SESSION_START = "session_start"  # workspace, test_cases, pending
+SESSION_END = "session_end"  # statuses: {status: count}
+TEST_START = "test_start"  # test_case, index, run, pts
+MMI = "mmi"  # test_case, project, wid, description, style, response
+VERDICT = "verdict"  # test_case, run, status, duration
+RETRY = "retry"  # test_case, run, status of the previous run
+RECOVERY = "recovery"  # action, reason, pts, test_case if any
+
+# actions of RECOVERY events
+RECOVERY_RECOVER_PTS = "recover_pts"  # after a failed RunTestCase
+RECOVERY_RECYCLE_PTS = "recycle_pts"  # by the PTS watchdog
+RECOVERY_HOLD = "hold"  # test case held, IUT does not respond
+RECOVERY_REPLACE_IUT = "replace_iut"  # dead IUT replaced by a spare
+
+# drop policies of full sink queues
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+DROP_NONE = "none"  # unbounded queue, flushed at close whatever it takes
+
+# time -- Seconds since the epoch
+# data -- Dict, also includes "session" name of events published by
+#         the session
+Event = collections.namedtuple("Event", "kind time data")
+
+
+def to_json(event):
+    """Returns the event as JSON object string"""
+    return json.dumps(dict(event.data, kind=event.kind, time=event.time))
+
+
+class SinkRunner(threading.Thread):
+    """Passes events to a sink from its own thread"""
+
+    def __init__(self, sink, capacity, drop, name, kinds=None):
+        threading.Thread.__init__(self, name="EventSink-%s" % name)
+        self.daemon = True
+
+        self.sink = sink
+        self.sink_name = name
+        self.capacity = capacity
+        self.drop = drop
+        self.kinds = kinds
+        self.dropped = 0
+
+        self._events = collections.deque()
+        self._closing = False
+        self._cond = threading.Condition()
+
+    def offer(self, event):
+        """Queues the event, never blocks"""
+        if self.kinds is not None and event.kind not in self.kinds:
+            return
+
+        with self._cond:
+            if self.drop != DROP_NONE and len(self._events) >= self.capacity:
+                self.dropped += 1
+                if self.drop == DROP_NEWEST:
+                    return
+
+                self._events.popleft()
+
+            self._events.append(event)
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._events or self._closing)
+                if not self._events:
+                    return
+
+                event = self._events.popleft()
+
+            try:
+                self.sink(event)
+
+            except Exception as error:
+                logging.exception("Event sink %s failed on %s: %r",
+                                  self.sink_name, event.kind, error)
+
+    def close(self, timeout):
+        """Stops once the queued events are passed to the sink, waits for
+        that up to timeout seconds unless the sink is durable"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+
+        self.join(None if self.drop == DROP_NONE else timeout)
+
+
+class EventBus(object):
+    """Passes published events to the subscribed sinks"""
+
+    def __init__(self):
+        self._runners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, sink, capacity=EVENT_BUS_CAPACITY, drop=DROP_OLDEST,
+                  name=None, kinds=None):
+        """Subscribes the sink, a callable taking Event, returns its
+        SinkRunner
+
+        kinds -- Kinds of events passed to the sink, all if None
+
+        """
+        runner = SinkRunner(sink, capacity, drop,
+                            name or getattr(sink, "__name__",
+                                            sink.__class__.__name__), kinds)
+        runner.start()
+
+        with self._lock:
+            self._runners = self._runners + [runner]
+
+        return runner
+
+    def publish(self, kind, **data):
+        """Publishes event of the kind, never blocks"""
+        runners = self._runners
+        if not runners:
+            return
+
+        event = Event(kind, time.time(), data)
+        for runner in runners:
+            runner.offer(event)
+
+    def bind(self, **context):
+        """Returns Publisher adding the context to the data of its events"""
+        return Publisher(self, context)
+
+    def close(self, timeout=EVENT_BUS_CLOSE_TIMEOUT):
+        """Waits up to timeout seconds in total for the sinks to process
+        the queued events, durable sinks are waited for until they do"""
+        deadline = time.time() + timeout
+
+        with self._lock:
+            runners, self._runners = self._runners, []
+
+        for runner in runners:
+            runner.close(max(0, deadline - time.time()))
+
+            if runner.is_alive():
+                logging.warning("Event sink %s did not finish",
+                                runner.sink_name)
+
+            if runner.dropped:
+                logging.warning("Event sink %s dropped %d events",
+                                runner.sink_name, runner.dropped)
+
+        return runners
+
+
+class Publisher(object):
+    """Publishes events of a session to the bus"""
+
+    def __init__(self, bus, context):
+        self.bus = bus
+        self.context = context
+
+    def publish(self, kind, **data):
+        data.update(self.context)
+        self.bus.publish(kind, **data)
+
+
+# publisher of sessions not sharing their events
+NO_EVENTS = EventBus().bind()
+
+
+class JSONLinesSink(object):
+    """Appends events to a file, one JSON object per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+
+    def __call__(self, event):
+        self._file.write(to_json(event) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class _SSEHandler(BaseHTTPRequestHandler):
+    """Streams events to a client of the SSEServer"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/events":
+            self.send_error(404)
+            return
+
+        last_id = self.headers.get("Last-Event-ID")
+        client = self.server.add_client(int(last_id) if last_id and
+                                        last_id.isdigit() else None)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        try:
+            while True:
+                events = self.server.get_events(client, EVENT_SSE_HEARTBEAT)
+                if events is None:
+                    return
+
+                if not events:
+                    self.wfile.write(b": heartbeat\n\n")
+
+                for seq, event in events:
+                    self.wfile.write(("id: %d\nevent: %s\ndata: %s\n\n" %
+                                      (seq, event.kind, to_json(event))
+                                      ).encode("utf-8"))
+
+                self.wfile.flush()
+
+        except OSError as error:
+            log("SSE client %s:%d: %r", self.client_address[0],
+                self.client_address[1], error)
+
+        finally:
+            self.server.remove_client(client)
+
+    def log_message(self, format, *args):
+        log(format, *args)
+
+
+class SSEServer(ThreadingHTTPServer):
+    """Event sink serving the events as server-sent events
+
+    Each HTTP client has its own bounded queue, the oldest events are
+    dropped for a client that does not keep up. Clients reconnecting with
+    Last-Event-ID get the events they missed, if still in the backlog.
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, host="127.0.0.1", capacity=EVENT_BUS_CAPACITY):
+        ThreadingHTTPServer.__init__(self, (host, port), _SSEHandler)
+        self.capacity = capacity
+        self._seq = 0
+        self._backlog = collections.deque(maxlen=EVENT_SSE_BACKLOG)
+        self._clients = []  # deques of (seq, event)
+        self._closed = False
+        self._cond = threading.Condition()
+
+        thread = threading.Thread(target=self.serve_forever,
+                                  name="SSEServer-%d" % port)
+        thread.daemon = True
+        thread.start()
+
+    def __call__(self, event):
+        with self._cond:
+            self._seq += 1
+            self._backlog.append((self._seq, event))
+
+            for client in self._clients:
+                client.append((self._seq, event))
+
+            self._cond.notify_all()
+
+    def add_client(self, last_id):
+        """Returns queue of a new client, with events after last_id"""
+        with self._cond:
+            client = collections.deque(maxlen=self.capacity)
+            if last_id is not None:
+                client.extend(entry for entry in self._backlog
+                              if entry[0] > last_id)
+
+            self._clients.append(client)
+            return client
+
+    def remove_client(self, client):
+        with self._cond:
+            self._clients.remove(client)
+
+    def get_events(self, client, timeout):
+        """Returns list of queued (seq, event), empty on timeout, None once
+        the server is closed"""
+        with self._cond:
+            self._cond.wait_for(lambda: client or self._closed, timeout)
+            if self._closed:
+                return None
+
+            events = list(client)
+            client.clear()
+            return events
+
+    def close(self):
+        """Ends the streams of the clients and stops serving"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        self.shutdown()
+        self.server_close()
+
+
+def load_sink(spec):
+    """argparse type of --event-sink, returns callable MODULE:CALLABLE"""
+    module_name, sep, name = spec.partition(":")
+    if not sep:
+        raise argparse.ArgumentTypeError("%s is not MODULE:CALLABLE" % spec)
+
+    try:
+        sink = getattr(importlib.import_module(module_name), name)
+
+    except (ImportError, AttributeError) as error:
+        raise argparse.ArgumentTypeError("cannot load %s: %s" % (spec, error))
+
+    if not callable(sink):
+        raise argparse.ArgumentTypeError("%s is not callable" % spec)
+
+    return sink
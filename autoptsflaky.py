@@ -0,0 +1,84 @@
+"""Detection of flaky test cases from results history
+
+A test case is flaky if its verdict flips between PASS and not PASS while
+the IUT build stays the same. Flips are counted between consecutive
+sessions of the same build (--iut-build, sessions without it are taken as
+one build) and within a session, when a test case passed only after
+retries. Verdict changes across builds are not counted, they are likely
+real regressions or fixes. Runs ending with errors other than a verdict
+(e.g. timeouts, BLOCKED) are not counted either.
+
+    score = flips / comparisons
+
+Test cases with score over the threshold, based on enough comparisons, are
+quarantined: they are run after all other test cases with their own retry
+budget, so retries of the main pass are spent on real regressions.
+"""
+
+import collections
+
+from autoptstimeouts import VERDICT_STATUSES
+from config import FLAKY_THRESHOLD, FLAKY_MIN_SAMPLES, FLAKY_WINDOW
+
+FlakyScore = collections.namedtuple("FlakyScore",
+                                    "score flips comparisons")
+
+
+def get_flaky_scores(sessions, window=FLAKY_WINDOW):
+    """Returns dict of test case name: FlakyScore
+
+    sessions -- Results history, see autoptshistory.load_results
+    window -- Number of the most recent runs of each test case scored
+
+    """
+    runs = collections.defaultdict(list)
+
+    for session in sessions:
+        for name, result in session.items():
+            if result["status"] in VERDICT_STATUSES:
+                runs[name].append(result)
+
+    scores = {}
+
+    for name, results in runs.items():
+        flips = 0
+        comparisons = 0
+        previous = None
+
+        for result in results[-window:]:
+            passed = result["status"] == "PASS"
+
+            # every retry is compared with the failed run before it
+            comparisons += result["run_count"] - 1
+            if passed and result["run_count"] > 1:
+                flips += 1
+
+            if previous is not None and \
+                    previous.get("build") == result.get("build"):
+                comparisons += 1
+                if passed != (previous["status"] == "PASS"):
+                    flips += 1
+
+            previous = result
+
+        scores[name] = FlakyScore(flips / comparisons if comparisons else 0.0,
+                                  flips, comparisons)
+
+    return scores
+
+
+def find_flaky(sessions, threshold=FLAKY_THRESHOLD,
+               min_samples=FLAKY_MIN_SAMPLES, window=FLAKY_WINDOW):
+    """Returns dict of test case name: FlakyScore of test cases to quarantine"""
+    return dict((name, score) for name, score in
+                get_flaky_scores(sessions, window).items()
+                if score.comparisons >= min_samples and
+                score.score >= threshold)
+
+
+def quarantine(test_cases, flaky):
+    """Returns (test cases, quarantined): test cases with the quarantined
+    ones moved to the end, keeping the order otherwise"""
+    quarantined = [tc for tc in test_cases if tc in flaky]
+    return [tc for tc in test_cases if tc not in flaky] + quarantined, \
+        quarantined
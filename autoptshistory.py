@@ -0,0 +1,129 @@
+"""Results of previous test sessions
+
+Sessions are stored by the client in logs/<session> directories, with the
+results of every test case in results.xml and the test cases selected for
+the session in plan.json. History paths given to the functions below can be
+results files, session directories or directories with sessions (e.g. logs).
+"""
+
+import os
+import glob
+import json
+import logging
+import collections
+import xml.etree.ElementTree as ET
+
+log = logging.debug
+
+RESULTS_FILE = "results.xml"
+PLAN_FILE = "plan.json"
+
+# attribute of the results element with the IUT build, see --iut-build
+BUILD_ATTRIBUTE = "iut_build"
+
+
+def write_file_durably(path, data):
+    """Replaces file content atomically and makes sure it hits the disk, so
+    the file is complete even if the process is killed while writing"""
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def save_session_plan(session_log_dir, workspace, projects, test_cases,
+                      quarantined=(), iut_build=None):
+    """Stores list of test cases selected for the session, returns the
+    plan"""
+    plan = {"workspace": workspace,
+            "projects": list(projects),
+            "test_cases": list(test_cases),
+            "quarantined": list(quarantined),
+            "iut_build": iut_build}
+
+    write_file_durably(os.path.join(session_log_dir, PLAN_FILE),
+                       json.dumps(plan, indent=1).encode("utf-8"))
+
+    return plan
+
+
+def load_session_plan(session_log_dir):
+    """Returns plan stored by save_session_plan"""
+    with open(os.path.join(session_log_dir, PLAN_FILE)) as f:
+        return json.load(f)
+
+
+def find_results_files(paths):
+    """Returns results files found in the given paths, oldest first"""
+    results_files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            results_file = os.path.join(path, RESULTS_FILE)
+            if os.path.isfile(results_file):
+                results_files.append(results_file)
+            else:
+                results_files += glob.glob(os.path.join(path, "*", RESULTS_FILE))
+        elif os.path.isfile(path):
+            results_files.append(path)
+        else:
+            log("History path %s not found", path)
+
+    # session directories are named by the start time
+    return sorted(results_files)
+
+
+def load_results(paths):
+    """Returns list of sessions, oldest first. Each session is a dict of
+    test case name: dict of "status", "duration", "run_count" and "build",
+    the IUT build the session was run against or None if not known"""
+    sessions = []
+
+    for results_file in find_results_files(paths):
+        try:
+            root = ET.parse(results_file).getroot()
+        except ET.ParseError:
+            logging.exception("Broken results file %s", results_file)
+            continue
+
+        build = root.attrib.get(BUILD_ATTRIBUTE)
+
+        session = collections.OrderedDict()
+        for elem in root.findall("./test_case"):
+            session[elem.attrib["name"]] = {
+                "status": elem.attrib["status"],
+                "duration": float(elem.attrib["duration"]),
+                "run_count": int(elem.attrib["run_count"]),
+                "build": build}
+
+        sessions.append(session)
+
+    return sessions
+
+
+def load_durations(paths, statuses=None):
+    """Returns dict of test case name: list of recorded durations in
+    seconds, oldest first
+
+    statuses -- If given, only durations of test cases that ended with one
+                of these statuses are returned
+
+    """
+    return get_durations(load_results(paths), statuses)
+
+
+def get_durations(sessions, statuses=None):
+    """Returns durations of test cases in the sessions returned by
+    load_results, see load_durations"""
+    durations = collections.defaultdict(list)
+
+    for session in sessions:
+        for name, result in session.items():
+            if statuses is None or result["status"] in statuses:
+                durations[name].append(result["duration"])
+
+    return dict(durations)
@@ -0,0 +1,102 @@
+"""Pool of IUTs tested in parallel by several PTS instances
+
+Each PTS dongle is paired with its own IUT tester. The pool file, given with
+--iut-pool, is a JSON list of the IUTs:
+
+    [
+        {"name": "maxwell-1", "bd_addr": "00:1B:DC:F2:1C:01",
+         "broker": "192.168.1.10", "namespace": "1"},
+        {"name": "maxwell-2", "bd_addr": "00:1B:DC:F2:1C:02",
+         "broker": "192.168.1.10:1884", "namespace": "2"}
+    ]
+
+broker -- "host[:port]" of the MQTT broker of the tester, MQTT_BROKER_IP by
+          default
+namespace -- Appended to the MQTT topics as "user/test/<namespace>", the
+             same way the server does for instance N by default. Empty for
+             the plain topics.
+
+Every PTS instance is bound to an IUT of the pool at startup, TSPX_bd_addr_iut
+is set to its address. IUTs not bound are spares: when the circuit breaker
+finds the IUT of an instance dead, the IUT is taken out of the pool and the
+instance continues with a spare, if there is one. Other instances are not
+affected either way.
+"""
+
+import json
+import argparse
+import threading
+import collections
+
+from config import MQTT_BROKER_IP, MQTT_REQUEST_TOPIC, MQTT_RESPONSE_TOPIC
+
+IUT = collections.namedtuple("IUT", "name bd_addr broker namespace")
+
+
+def get_mqtt_topics(namespace):
+    """Returns (request, response) MQTT topics of the namespace"""
+    if not namespace:
+        return MQTT_REQUEST_TOPIC, MQTT_RESPONSE_TOPIC
+
+    return ("%s/%s" % (MQTT_REQUEST_TOPIC, namespace),
+            "%s/%s" % (MQTT_RESPONSE_TOPIC, namespace))
+
+
+class IUTPool(object):
+    """IUTs available to the PTS instances of the client"""
+
+    def __init__(self, iuts):
+        self.iuts = list(iuts)
+        self.retired = []
+        self._free = list(self.iuts)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns a free IUT, None if there is none left"""
+        with self._lock:
+            if not self._free:
+                return None
+
+            return self._free.pop(0)
+
+    def release(self, iut):
+        """Returns the IUT to the pool"""
+        with self._lock:
+            self._free.append(iut)
+
+    def retire(self, iut):
+        """Takes the failed IUT out of the pool for the rest of the session"""
+        with self._lock:
+            self.retired.append(iut)
+
+    def replace(self, iut):
+        """Retires the failed IUT, returns a spare or None"""
+        self.retire(iut)
+        return self.acquire()
+
+
+def parse_pool(path):
+    """argparse type of --iut-pool, returns IUTPool of the pool file"""
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+
+    except (OSError, ValueError) as error:
+        raise argparse.ArgumentTypeError("cannot read IUT pool %s: %s" %
+                                         (path, error))
+
+    iuts = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or "bd_addr" not in entry:
+            raise argparse.ArgumentTypeError(
+                "IUT %d of %s has no bd_addr" % (index, path))
+
+        iuts.append(IUT(entry.get("name", entry["bd_addr"]),
+                        entry["bd_addr"],
+                        entry.get("broker", MQTT_BROKER_IP),
+                        str(entry.get("namespace", ""))))
+
+    if not iuts:
+        raise argparse.ArgumentTypeError("IUT pool %s is empty" % (path,))
+
+    return IUTPool(iuts)
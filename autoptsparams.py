@@ -0,0 +1,180 @@
+"""Per test case PIXIT and PICS overrides
+
+Test cases can override workspace PIXITs and PICS (TestCase pixits and
+pics). Before a test case is run only the difference between the values
+currently applied on the PTS instance and the ones the test case needs is
+sent to PTS. Overridden values are restored to the workspace values only
+when a later test case needs them, and test cases are ordered so that the
+number of switches in a session is small.
+
+PTS does not tell the values of a workspace, so only values set by the
+workspace setup of the project (e.g. set_pixits) can be overridden, others
+could not be restored for the following test cases and are refused with
+ParameterError.
+"""
+
+import logging
+import collections
+
+log = logging.debug
+
+PIXIT = "pixit"
+PICS = "pics"
+
+
+class ParameterError(Exception):
+    """Override of a PIXIT or PICS whose workspace value is unknown"""
+
+
+def get_overrides(test_case):
+    """Returns dict of (PIXIT or PICS, project, name): value of the test
+    case, empty if test case is None or does not override anything"""
+    overrides = {}
+
+    if test_case is None:
+        return overrides
+
+    for kind, values in ((PIXIT, test_case.pixits), (PICS, test_case.pics)):
+        for name, value in values.items():
+            overrides[(kind, test_case.project_name, name)] = value
+
+    return overrides
+
+
+def order_by_parameters(test_cases, test_case_instances):
+    """Returns test cases ordered to minimize PIXIT and PICS switches
+
+    Test cases with the same overrides are grouped keeping their order.
+    Groups start with test cases without overrides, the next group is the
+    one closest to the previous.
+
+    test_cases -- List of test case names
+    test_case_instances -- Iterable of TestCase instances
+
+    """
+    instances = dict((tc.name, tc) for tc in test_case_instances or ())
+
+    groups = collections.OrderedDict()
+    for test_case in test_cases:
+        signature = frozenset(get_overrides(instances.get(test_case)).items())
+        groups.setdefault(signature, []).append(test_case)
+
+    if len(groups) < 2:
+        return list(test_cases)
+
+    ordered = []
+    current = frozenset()
+
+    while groups:
+        # min returns the first of equally distant groups, keeping order
+        signature = min(groups, key=lambda sig: len(sig ^ current))
+        ordered += groups.pop(signature)
+        current = signature
+
+    return ordered
+
+
+class ParameterState(object):
+    """PIXITs and PICS applied on a PTS instance"""
+
+    def __init__(self, pts):
+        self._pts = pts
+        self._baseline = None  # workspace values, fetched on first override
+        self._applied = {}
+        self._overridden = set()  # keys that differ from the baseline
+
+        self.switch_count = 0
+
+    def _load_baseline(self):
+        """Fetches values applied by the workspace setup"""
+        baseline = {}
+
+        for kind, values in ((PIXIT, self._pts.get_applied_pixits()),
+                             (PICS, self._pts.get_applied_pics())):
+            for project_name, project_values in values.items():
+                for name, value in project_values.items():
+                    baseline[(kind, project_name, name)] = value
+
+        self._baseline = baseline
+        self._applied = dict(baseline)
+
+    def _check_baseline(self, overrides):
+        """Raises ParameterError if workspace value of any of the override
+        keys is unknown"""
+        unknown = sorted(set(key for key in overrides
+                             if key not in self._baseline))
+        if unknown:
+            raise ParameterError(
+                "Workspace value of %s is unknown, it must be set by the "
+                "workspace setup to be overridden" %
+                ", ".join("%s %s %s" % key for key in unknown))
+
+    def check(self, test_case_instances):
+        """Raises ParameterError if any of the test cases overrides a value
+        that could not be restored, before the session starts"""
+        overrides = {}
+        for test_case in test_case_instances or ():
+            overrides.update(get_overrides(test_case))
+
+        if not overrides:
+            return
+
+        if self._baseline is None:
+            self._load_baseline()
+
+        self._check_baseline(overrides)
+
+    def apply(self, test_case):
+        """Applies PIXITs and PICS the test case needs
+
+        Returns number of values sent to PTS, raises ParameterError if the
+        test case overrides a value whose workspace value is unknown
+
+        """
+        overrides = get_overrides(test_case)
+        if not overrides and not self._overridden:
+            return 0
+
+        if self._baseline is None:
+            self._load_baseline()
+
+        self._check_baseline(overrides)
+
+        required = dict(overrides)
+        for key in self._overridden:
+            if key not in required:
+                required[key] = self._baseline[key]
+
+        delta = dict((key, value) for key, value in required.items()
+                     if self._applied.get(key, object()) != value)
+        if not delta:
+            return 0
+
+        log("Switching %d PIXITs/PICS for %s: %s", len(delta), test_case,
+            delta)
+
+        for kind, update in ((PIXIT, self._pts.set_pixits_bulk),
+                             (PICS, self._pts.set_pics_bulk)):
+            values = collections.defaultdict(dict)
+            for (key_kind, project_name, name), value in delta.items():
+                if key_kind == kind:
+                    values[project_name][name] = value
+
+            if not values:
+                continue
+
+            result = update(dict(values))
+            for failed in result["errors"]:
+                project_name, name = failed.split("/", 1)
+                log("Failed to set %s %s %s: %s", kind, project_name, name,
+                    result["errors"][failed])
+                delta.pop((kind, project_name, name), None)
+                self._applied.pop((kind, project_name, name), None)
+
+        self._applied.update(delta)
+        self._overridden = set(key for key in self._applied
+                               if key not in self._baseline or
+                               self._applied[key] != self._baseline[key])
+        self.switch_count += len(delta)
+
+        return len(delta)
@@ -0,0 +1,79 @@
+"""Pipelined execution of test cases against a single IUT
+
+With several PTS instances attached to the same IUT host, test cases must not
+run at the same time, but everything around RunTestCase does not need the
+IUT: taking the next test case, opening its workspace, setting PIXITs and
+the call timeout, pinging the IUT, log setup, and after the run the results
+checkpoint, recovery of PTS and recycling. With --pipeline the instances
+take turns only for RunTestCase, so while one instance runs a test case the
+other one prepares the next, and it starts as soon as the IUT is free.
+
+Turns are given in the order the instances ask for them. A retry asks for a
+new turn, so the test case prepared meanwhile by the standby instance runs
+first.
+"""
+
+import time
+import threading
+
+
+class PipelineTurns(object):
+    """FIFO turns of the PTS instances sharing the IUT"""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._released_at = None
+        self._local = threading.local()
+
+        self.run_count = 0
+        self.ready_count = 0  # turns taken by an instance already waiting
+        self.idle_times = []  # IUT idle between runs, seconds
+
+    def acquire(self):
+        """Waits for the turn of the calling instance"""
+        start_time = self._clock()
+
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+
+            # prepared while the previous test case was still running
+            ready = self._serving != ticket
+
+            self._cond.wait_for(lambda: self._serving == ticket)
+            now = self._clock()
+
+            self.run_count += 1
+            if self._released_at is not None:
+                self.idle_times.append(now - self._released_at)
+                if ready:
+                    self.ready_count += 1
+
+        self._local.wait = now - start_time
+
+    def release(self):
+        """Gives the turn to the next instance"""
+        with self._cond:
+            self._released_at = self._clock()
+            self._serving += 1
+            self._cond.notify_all()
+
+    def take_wait(self):
+        """Returns seconds the calling instance waited for its last turn and
+        resets it, the wait is not part of the test case duration"""
+        wait = getattr(self._local, "wait", 0)
+        self._local.wait = 0
+        return wait
+
+    def print_report(self):
+        if not self.idle_times:
+            return
+
+        print("\nPipeline: %d runs, IUT idle between runs %d ms on average, "
+              "%.1f s in total, next test case ready in %d%% of them" %
+              (self.run_count, 1000 * sum(self.idle_times) /
+               len(self.idle_times), sum(self.idle_times),
+               100 * self.ready_count / len(self.idle_times)))
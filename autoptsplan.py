@@ -0,0 +1,192 @@
+"""Dry run planner: wall time estimate of a test session
+
+The selected test cases are resolved from the catalog cached by previous
+sessions, nothing is run and PTS is not started. Duration of each test case
+and its chance to fail are taken from the results history. The run is then
+simulated the way the client runs it: every PTS instance takes the next test
+case from the shared queue as soon as it is free, failed test cases are
+retried right away on the same instance.
+"""
+
+import os
+import json
+import heapq
+import collections
+
+from autoptstimeouts import VERDICT_STATUSES
+
+# catalog of test cases of each workspace: workspace: {project: [names]}
+CATALOG_FILE = os.path.join("logs", "catalog.json")
+
+# expected duration of test cases never run, if there is no history at all
+DEFAULT_DURATION = 60.0  # seconds
+
+# runs -- expected number of runs, with retries
+# max_runs -- number of runs if all of them fail
+# known -- duration is known from the history
+Estimate = collections.namedtuple("Estimate",
+                                  "duration fail_rate runs max_runs known")
+
+
+def save_catalog(workspace, catalog, path=CATALOG_FILE):
+    """Stores dict of project: test case names of the workspace"""
+    catalogs = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            catalogs = json.load(f)
+
+    catalogs[workspace] = catalog
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(catalogs, f)
+
+    os.replace(tmp_path, path)
+
+
+def load_catalog(workspace, path=CATALOG_FILE):
+    """Returns cached dict of project: test case names, None if the
+    workspace has not been cached"""
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        catalog = json.load(f).get(workspace)
+
+    if catalog is None:
+        return None
+
+    return collections.OrderedDict(catalog)
+
+
+def estimate(test_cases, sessions, run_count_max):
+    """Returns dict of test case name: Estimate
+
+    sessions -- Results history, see autoptshistory.load_results
+    run_count_max -- Callable returning how many times a test case can run
+
+    """
+    durations = collections.defaultdict(list)
+    first_runs = collections.defaultdict(int)
+    first_fails = collections.defaultdict(int)
+
+    for session in sessions:
+        for name, result in session.items():
+            if result["status"] not in VERDICT_STATUSES:
+                continue
+
+            durations[name].append(result["duration"])
+            first_runs[name] += 1
+
+            # passing after retries means the first run failed
+            if result["status"] != "PASS" or result["run_count"] > 1:
+                first_fails[name] += 1
+
+    means = dict((name, sum(values) / len(values))
+                 for name, values in durations.items())
+    known = sorted(means.values())
+    default = known[len(known) // 2] if known else DEFAULT_DURATION
+
+    estimates = {}
+    for name in test_cases:
+        fail_rate = first_fails[name] / first_runs[name] \
+            if first_runs[name] else 0.0
+
+        # runs until pass, each retry happens if all runs before failed
+        max_runs = run_count_max(name)
+        runs = sum(fail_rate ** i for i in range(max_runs))
+
+        estimates[name] = Estimate(means.get(name, default), fail_rate, runs,
+                                   max_runs, name in means)
+
+    return estimates
+
+
+def simulate(test_cases, estimates, instance_count, worst_case=False):
+    """Simulates the session, returns list of schedules of the instances:
+    list of (start, end, test case)
+
+    worst_case -- Every test case that ever failed uses all its runs
+
+    """
+    schedules = [[] for _ in range(instance_count)]
+    free = [(0.0, index) for index in range(instance_count)]
+
+    for name in test_cases:
+        est = estimates[name]
+        runs = est.max_runs if worst_case and est.fail_rate else est.runs
+
+        start, index = heapq.heappop(free)
+        end = start + est.duration * runs
+
+        schedules[index].append((start, end, name))
+        heapq.heappush(free, (end, index))
+
+    return schedules
+
+
+def get_makespan(schedules):
+    """Returns time the last instance is done"""
+    return max([schedule[-1][1] for schedule in schedules if schedule] or [0])
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+
+def print_plan(test_cases, estimates, instance_count, schedules,
+               worst_schedules, longest_count=10):
+    """Prints ETA, critical path and the longest test cases"""
+    eta = get_makespan(schedules)
+    total = sum(end - start for schedule in schedules
+                for start, end, _ in schedule)
+    unknown = [tc for tc in test_cases if not estimates[tc].known]
+
+    print("\nPlan: %d test cases on %d PTS instance(s)\n" %
+          (len(test_cases), instance_count))
+
+    print("ETA:             %s" % _format_duration(eta))
+    print("Worst case:      %s (all retries of failing test cases used)" %
+          _format_duration(get_makespan(worst_schedules)))
+    print("Total test time: %s" % _format_duration(total))
+    runs = sum(estimates[tc].runs for tc in test_cases)
+    print("Expected runs:   %.1f (%.1f retries)" %
+          (runs, runs - len(test_cases)))
+
+    if unknown:
+        print("No history:      %d test cases, median duration assumed" %
+              len(unknown))
+
+    print("\nInstance load:")
+    for index, schedule in enumerate(schedules):
+        busy = sum(end - start for start, end, _ in schedule)
+        print("  %d: %s, %d test cases" % (index, _format_duration(busy),
+                                           len(schedule)))
+
+    # the instance finishing last determines the ETA, its tail is the part
+    # of the session that cannot be shortened by other instances
+    critical = max(schedules, key=lambda s: s[-1][1] if s else 0)
+    others_done = max([s[-1][1] for s in schedules
+                       if s and s is not critical] or [0])
+    tail = [entry for entry in critical if entry[1] > others_done]
+
+    if tail:
+        print("\nCritical path (after the other instances are done):")
+        for start, end, name in tail:
+            print("  %s %-50s %s" % (_format_duration(start), name,
+                                     _format_duration(end - start)))
+
+    print("\nLongest test cases:")
+    longest = sorted(test_cases, key=lambda tc: -estimates[tc].duration *
+                     estimates[tc].runs)
+    for name in longest[:longest_count]:
+        est = estimates[name]
+        print("  %-50s %s  %.1f runs, fails %d%%" %
+              (name, _format_duration(est.duration * est.runs), est.runs,
+               est.fail_rate * 100))
@@ -0,0 +1,205 @@
+"""Selection of test cases by name patterns and results history
+
+Patterns given with --test-cases and --excluded can be:
+
+    PBAP/PCE/SSM            prefix of test case names, e.g. profile
+    PBAP/*/BV-0?-C          glob, if it contains * ? or [
+    re:^PBAP/.*/BI-         regular expression searched in the name
+    @failed                 not passed in the last session that ran it
+    @never-passed           in the history, but never passed
+    @slower:60              mean duration in the history over 60 seconds
+
+The patterns are compiled once. Prefixes and the literal part of globs are
+stored in a character trie, so a name is matched by walking its characters
+once, whatever the number of patterns. Only globs sharing the beginning of
+the name are then tried. Regular expressions are joined into one.
+"""
+
+import re
+import fnmatch
+import argparse
+import collections
+
+REGEX_PREFIX = "re:"
+HISTORY_PREFIX = "@"
+
+SELECTOR_FAILED = "failed"
+SELECTOR_NEVER_PASSED = "never-passed"
+SELECTOR_SLOWER = "slower"
+
+GLOB_CHARS = "*?["
+
+# trie node keys that are not characters
+_END = None
+_GLOBS = ""
+
+
+def _split_history_selector(pattern):
+    """Returns (selector name, argument) of "@name[:argument]" """
+    name, _, argument = pattern[len(HISTORY_PREFIX):].partition(":")
+    return name, argument
+
+
+def parse_pattern(value):
+    """argparse type of test case patterns, validates the pattern syntax"""
+    if value.startswith(REGEX_PREFIX):
+        try:
+            re.compile(value[len(REGEX_PREFIX):])
+        except re.error as error:
+            raise argparse.ArgumentTypeError("bad regular expression %r: %s"
+                                             % (value, error))
+
+    elif value.startswith(HISTORY_PREFIX):
+        name, argument = _split_history_selector(value)
+
+        if name == SELECTOR_SLOWER:
+            try:
+                float(argument)
+            except ValueError:
+                raise argparse.ArgumentTypeError(
+                    "%s needs seconds, e.g. @%s:60" % (value, SELECTOR_SLOWER))
+
+        elif name not in (SELECTOR_FAILED, SELECTOR_NEVER_PASSED) or argument:
+            raise argparse.ArgumentTypeError(
+                "unknown selector %r, known are @%s, @%s and @%s:SECONDS" %
+                (value, SELECTOR_FAILED, SELECTOR_NEVER_PASSED,
+                 SELECTOR_SLOWER))
+
+    return value
+
+
+class PatternSet(object):
+    """Compiled set of patterns, see module documentation"""
+
+    def __init__(self, patterns, sessions=None):
+        """Constructor
+
+        patterns -- Iterable of patterns
+        sessions -- Results history as returned by autoptshistory.load_results,
+                    required by the @ selectors
+
+        """
+        self._trie = {}
+        self._names = set()
+        regexes = []
+
+        for pattern in patterns:
+            if pattern.startswith(REGEX_PREFIX):
+                regexes.append("(?:%s)" % pattern[len(REGEX_PREFIX):])
+
+            elif pattern.startswith(HISTORY_PREFIX):
+                self._names.update(self._select_history(pattern,
+                                                        sessions or []))
+
+            elif any(c in pattern for c in GLOB_CHARS):
+                literal = re.split(r"[*?\[]", pattern, 1)[0]
+                regex = re.compile(fnmatch.translate(pattern))
+                self._add(literal).setdefault(_GLOBS, []).append(regex)
+
+            else:
+                self._add(pattern)[_END] = True
+
+        self._regex = re.compile("|".join(regexes)) if regexes else None
+        self.empty = not patterns
+
+    def _add(self, prefix):
+        """Returns trie node of the prefix, created if needed"""
+        node = self._trie
+        for c in prefix:
+            node = node.setdefault(c, {})
+
+        return node
+
+    @staticmethod
+    def _select_history(pattern, sessions):
+        """Returns set of test case names selected by the @ selector"""
+        name, argument = _split_history_selector(pattern)
+
+        if name == SELECTOR_FAILED:
+            # the last session of a workspace is not the last one of the
+            # history if several workspaces have been run together
+            last_status = {}
+            for session in sessions:
+                for tc, result in session.items():
+                    last_status[tc] = result["status"]
+
+            return set(tc for tc, status in last_status.items()
+                       if status != "PASS")
+
+        if name == SELECTOR_NEVER_PASSED:
+            seen = set()
+            passed = set()
+
+            for session in sessions:
+                for tc, result in session.items():
+                    seen.add(tc)
+                    if result["status"] == "PASS":
+                        passed.add(tc)
+
+            return seen - passed
+
+        if name == SELECTOR_SLOWER:
+            durations = collections.defaultdict(list)
+            for session in sessions:
+                for tc, result in session.items():
+                    durations[tc].append(result["duration"])
+
+            return set(tc for tc, values in durations.items()
+                       if sum(values) / len(values) > float(argument))
+
+        raise ValueError("Unknown selector %r" % (pattern,))
+
+    def matches(self, test_case_name):
+        """Returns True if any of the patterns matches the name"""
+        if test_case_name in self._names:
+            return True
+
+        node = self._trie
+        for c in test_case_name:
+            if _END in node:
+                return True
+
+            for regex in node.get(_GLOBS, ()):
+                if regex.match(test_case_name):
+                    return True
+
+            node = node.get(c)
+            if node is None:
+                break
+
+        else:
+            if _END in node or any(regex.match(test_case_name)
+                                   for regex in node.get(_GLOBS, ())):
+                return True
+
+        return bool(self._regex and self._regex.search(test_case_name))
+
+
+def uses_history(patterns):
+    """Returns True if any of the patterns selects by the results history"""
+    return any(p.startswith(HISTORY_PREFIX) for p in patterns)
+
+
+class TestCaseSelector(object):
+    """Selects test cases matching included and not excluded patterns,
+    all test cases are included if there are no included patterns"""
+
+    def __init__(self, included=(), excluded=(), sessions=None):
+        """Constructor
+
+        sessions -- Results history as returned by autoptshistory.load_results,
+                    used by @ selectors, see uses_history
+
+        """
+        self._included = PatternSet(included, sessions)
+        self._excluded = PatternSet(excluded, sessions)
+
+    def __call__(self, test_case_name):
+        if self._excluded.matches(test_case_name):
+            return False
+
+        return self._included.empty or self._included.matches(test_case_name)
+
+    def select(self, test_case_names):
+        """Returns selected test cases, keeping their order"""
+        return [tc for tc in test_case_names if self(tc)]
@@ -2,30 +2,54 @@ import os
 import wmi
 import sys
 import logging
+import argparse
 import xmlrpc.client
-import xmlrpc.server
+import pythoncom
 import winutils
 import ptscontrol
+import ptsmanager
 import paho.mqtt.client as mqtt
-from config import SERVER_PORT, MQTT_BROKER_IP
+from config import SERVER_PORT, CLIENT_PORT, MQTT_BROKER_IP, MQTT_BROKER_PORT, \
+    MQTT_REQUEST_TOPIC, MQTT_RESPONSE_TOPIC, FRAMED_RPC_PORT, \
+    EVENT_STREAM_PORT, ARTIFACT_PORT
 
 log = logging.debug
 
 
+def get_mqtt_topics(index):
+    """Returns (request, response) MQTT topics of the PTS instance
+
+    The first instance uses the plain topics, so single dongle setups keep
+    working with testers that are not aware of multiple instances.
+
+    """
+    if index == 0:
+        return MQTT_REQUEST_TOPIC, MQTT_RESPONSE_TOPIC
+
+    return ("%s/%d" % (MQTT_REQUEST_TOPIC, index),
+            "%s/%d" % (MQTT_RESPONSE_TOPIC, index))
+
+
 class PyPTSWithXmlRpcCallback(ptscontrol.PyPTS):
     """A child class that adds support of xmlrpc PTS callbacks to PyPTS"""
 
-    def __init__(self):
-        """Constructor"""
+    def __init__(self, index=0):
+        """Constructor
+
+        index -- Index of the PTS instance served by this process, selects
+                 the MQTT client id and topics
+
+        """
+
+        log("%s %d", self.__init__.__name__, index)
 
-        log("%s", self.__init__.__name__)
+        request_topic, response_topic = get_mqtt_topics(index)
+        self.mqtt_client_id = 'autoptsserver' if index == 0 else \
+            'autoptsserver-%d' % index
 
-        self.mqtt_client = mqtt.Client('autoptsserver')
-        self.mqtt_client.connect(MQTT_BROKER_IP)
-        self.mqtt_client.loop_start() # start loop to process received messages
-        self.mqtt_client.subscribe("test/user")
+        self.mqtt_client = self._connect_mqtt(MQTT_BROKER_IP, response_topic)
 
-        ptscontrol.PyPTS.__init__(self, self.mqtt_client)
+        ptscontrol.PyPTS.__init__(self, self.mqtt_client, request_topic)
 
         # address of the auto-pts client that started it's own xmlrpc server to
         # receive callback messages
@@ -38,6 +62,34 @@ class PyPTSWithXmlRpcCallback(ptscontrol.PyPTS):
         self.mqtt_client.disconnect()
         self.mqtt_client.loop_stop()
 
+    def _connect_mqtt(self, broker, response_topic):
+        """Returns MQTT client connected to the broker, "host[:port]" """
+        host, sep, port = broker.rpartition(":")
+        if not sep:
+            host, port = broker, MQTT_BROKER_PORT
+
+        mqtt_client = mqtt.Client(self.mqtt_client_id)
+        mqtt_client.connect(host, int(port))
+        mqtt_client.loop_start() # start loop to process received messages
+        mqtt_client.subscribe(response_topic)
+
+        return mqtt_client
+
+    def bind_iut(self, broker, request_topic, response_topic):
+        """Binds the instance to the IUT tester reached through the MQTT
+        broker and topics, see autoptsiut"""
+
+        log("%s %s %s %s", self.bind_iut.__name__, broker, request_topic,
+            response_topic)
+
+        # the client id is the same, so disconnect before the broker drops
+        # the older connection
+        self.mqtt_client.disconnect()
+        self.mqtt_client.loop_stop()
+
+        self.mqtt_client = self._connect_mqtt(broker, response_topic)
+        self.set_mqtt_client(self.mqtt_client, request_topic)
+
     def register_xmlrpc_ptscallback(self, client_address, client_port):
         """Registers client callback. xmlrpc proxy/client calls this method
         to register its callback
@@ -73,10 +125,59 @@ class PyPTSWithXmlRpcCallback(ptscontrol.PyPTS):
         self.client_xmlrpc_proxy = None
 
 
+def create_pts(index):
+    """PTS factory used by the manager, called from the instance thread"""
+    pythoncom.CoInitialize()
+
+    return PyPTSWithXmlRpcCallback(index)
+
+
+def parse_args():
+    """Parses command line arguments and options"""
+
+    arg_parser = argparse.ArgumentParser(description="PTS automation server")
+
+    arg_parser.add_argument("-n", "--instances", type=int, default=1,
+                            help="Number of PTS instances (dongles) to serve. "
+                                 "Instance N is served on port --port + N")
+
+    arg_parser.add_argument("-p", "--port", type=int, default=SERVER_PORT,
+                            help="XML-RPC port of instance 0, %d by default. "
+                                 "Ports %d and up are used by XML-RPC "
+                                 "callbacks of a client, instance ports must "
+                                 "not overlap them" %
+                                 (SERVER_PORT, CLIENT_PORT))
+
+    arg_parser.add_argument("--xmlrpc-only", action="store_true",
+                            help="Do not serve the framed RPC transport on "
+                                 "port %d + N" % (FRAMED_RPC_PORT,))
+
+    arg_parser.add_argument("--no-event-stream", action="store_true",
+                            help="Do not serve the callback event stream on "
+                                 "port %d + N, clients then have to accept "
+                                 "callback connections" % (EVENT_STREAM_PORT,))
+
+    arg_parser.add_argument("--no-artifacts", action="store_true",
+                            help="Do not serve the test history logs on "
+                                 "port %d + N" % (ARTIFACT_PORT,))
+
+    args = arg_parser.parse_args()
+
+    last_port = args.port + args.instances - 1
+    if args.port < CLIENT_PORT + args.instances and last_port >= CLIENT_PORT:
+        arg_parser.error("ports %d-%d overlap ports %d and up of XML-RPC "
+                         "callbacks of a client, use --port to move them" %
+                         (args.port, last_port, CLIENT_PORT))
+
+    return args
+
+
 def main():
     """Main."""
     winutils.exit_if_admin()
 
+    args = parse_args()
+
     script_name = os.path.basename(sys.argv[0])  # in case it is full path
     script_name_no_ext = os.path.splitext(script_name)[0]
 
@@ -92,16 +193,41 @@ def main():
     for iface in c.Win32_NetworkAdapterConfiguration(IPEnabled=True):
         print("Local IP address: %s DNS %r" % (iface.IPAddress, iface.DNSDomain))
 
-    print("Starting PTS ...")
-    pts = PyPTSWithXmlRpcCallback()
-    print("OK")
-
-    print("Serving on port {} ...".format(SERVER_PORT))
-
-    server = xmlrpc.server.SimpleXMLRPCServer(("", SERVER_PORT), allow_none=True)
-    server.register_instance(pts)
-    server.register_introspection_functions()
-    server.serve_forever()
+    print("Starting %d PTS instance(s) ..." % args.instances)
+    manager = ptsmanager.PTSManager(
+        args.instances, create_pts, base_port=args.port,
+        framed_base_port=None if args.xmlrpc_only else FRAMED_RPC_PORT,
+        stream_base_port=None if args.no_event_stream else EVENT_STREAM_PORT,
+        artifact_base_port=None if args.no_artifacts else ARTIFACT_PORT)
+    failed = manager.start()
+
+    for instance in manager.instances:
+        if instance in failed:
+            print("PTS instance %d failed: %r" % (instance.index, instance.error))
+        else:
+            print("PTS instance %d serving on port %d, MQTT topics %s %s" %
+                  ((instance.index, instance.port) +
+                   get_mqtt_topics(instance.index)))
+
+            if instance.framed_server:
+                print("PTS instance %d framed RPC on port %d" %
+                      (instance.index, instance.framed_port))
+
+            if instance.stream_server:
+                print("PTS instance %d event stream on port %d" %
+                      (instance.index, instance.stream_port))
+
+            if instance.artifact_server:
+                print("PTS instance %d test history logs on port %d" %
+                      (instance.index, instance.artifact_port))
+
+    if len(failed) == len(manager.instances):
+        sys.exit("No PTS instance started")
+
+    try:
+        manager.wait()
+    except KeyboardInterrupt:
+        manager.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""Deterministic split of test cases between parallel test jobs
+
+Every job selects the same test cases and runs only its own shard of them:
+
+    ./autoptsclient-maxwell.py [workspace] -i [server] --shard 1/3
+    ./autoptsclient-maxwell.py [workspace] -i [server] --shard 2/3
+    ./autoptsclient-maxwell.py [workspace] -i [server] --shard 3/3
+
+Without history test cases are assigned by a hash of their name, so the
+assignment is stable across runs. With --history (the same for all jobs)
+test cases are balanced by their recorded durations, so that shards finish
+at about the same time.
+
+Results of the shards are merged into a single summary with:
+
+    ./autoptsshard.py logs/<session of shard 1> logs/<session of shard 2> ...
+"""
+
+import os
+import sys
+import zlib
+import argparse
+import xml.etree.ElementTree as ET
+
+import autoptshistory
+
+
+def parse_shard(value):
+    """argparse type of --shard: "K/N" -> (K, N), K counted from 1"""
+    try:
+        index, count = [int(x) for x in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard should be K/N, e.g. 1/3")
+
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard K/N requires 1 <= K <= N")
+
+    return index, count
+
+
+def hash_shard(test_case, count):
+    """Returns shard of the test case, from 0, stable across runs and hosts"""
+    return zlib.crc32(test_case.encode("utf-8")) % count
+
+
+def balance_shards(test_cases, count, durations):
+    """Assigns test cases to shards balancing their expected duration
+
+    Longest test case first to the least loaded shard. Test cases without
+    history are expected to take median of the known durations.
+
+    Returns list of shards, each is a set of test cases
+
+    """
+    expected = {}
+    for test_case, values in durations.items():
+        expected[test_case] = sum(values) / len(values)
+
+    known = sorted(expected[tc] for tc in test_cases if tc in expected)
+    default = known[len(known) // 2] if known else 1.0
+
+    shards = [set() for _ in range(count)]
+    loads = [0.0] * count
+
+    # ties are broken by name and shard index to stay deterministic
+    for test_case in sorted(set(test_cases),
+                            key=lambda tc: (-expected.get(tc, default), tc)):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        shards[shard].add(test_case)
+        loads[shard] += expected.get(test_case, default)
+
+    return shards
+
+
+def shard_test_cases(test_cases, shard, durations=None):
+    """Returns test cases of the shard, keeping their order
+
+    shard -- (K, N) as returned by parse_shard
+    durations -- Dict of test case name: list of durations, see
+                 autoptshistory.load_durations. Hash is used if empty.
+
+    """
+    index, count = shard
+
+    if durations:
+        own = balance_shards(test_cases, count, durations)[index - 1]
+        return [tc for tc in test_cases if tc in own]
+
+    return [tc for tc in test_cases if hash_shard(tc, count) == index - 1]
+
+
+def merge_results(session_dirs, output):
+    """Merges results of the shard sessions into the output results file
+
+    Returns (projects, test cases) of all the shards
+
+    """
+    projects = []
+    test_cases = []
+    root = ET.Element("results")
+
+    for session_dir in session_dirs:
+        plan = autoptshistory.load_session_plan(session_dir)
+        projects += [p for p in plan["projects"] if p not in projects]
+        test_cases += plan["test_cases"]
+
+        results_file = os.path.join(session_dir, autoptshistory.RESULTS_FILE)
+        shard_root = ET.parse(results_file).getroot()
+
+        # all shards run against the same IUT build
+        build = shard_root.attrib.get(autoptshistory.BUILD_ATTRIBUTE)
+        if build is not None:
+            root.attrib[autoptshistory.BUILD_ATTRIBUTE] = build
+
+        for elem in shard_root.findall("./test_case"):
+            root.append(elem)
+
+    autoptshistory.write_file_durably(output, ET.tostring(root))
+
+    return projects, test_cases
+
+
+def parse_args():
+    """Parses command line arguments and options"""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Merge results of test sessions run as shards")
+
+    arg_parser.add_argument("sessions", nargs="+",
+                            help="Session directories of the shards, "
+                                 "e.g. logs/2019_01_31_10_00_00")
+
+    arg_parser.add_argument("-o", "--output", default="results.xml",
+                            help="Merged results file")
+
+    return arg_parser.parse_args()
+
+
+def main():
+    """Main."""
+    import autoptsclient_common as autoptsclient
+
+    args = parse_args()
+
+    projects, test_cases = merge_results(args.sessions, args.output)
+
+    stats = autoptsclient.TestCaseRunStats(projects, test_cases, 0,
+                                           args.output)
+    stats.print_summary()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+
+    except KeyboardInterrupt:  # Ctrl-C
+        sys.exit(14)
@@ -0,0 +1,100 @@
+"""Per test case RunTestCase timeouts derived from recorded durations
+
+PTS_TIMEOUT is long enough for the slowest test case, so a test case that
+normally takes seconds hangs for minutes when the IUT stops responding.
+With history of the test case its timeout is the 99th percentile of the
+recorded durations multiplied by ADAPTIVE_TIMEOUT_FACTOR, clamped to
+ADAPTIVE_TIMEOUT_MIN and ADAPTIVE_TIMEOUT_MAX. Test cases without history
+use PTS_TIMEOUT.
+"""
+
+import math
+import logging
+import threading
+
+import ptsprojects.ptstypes as ptstypes
+from config import PTS_TIMEOUT, ADAPTIVE_TIMEOUT_FACTOR, \
+    ADAPTIVE_TIMEOUT_MIN, ADAPTIVE_TIMEOUT_MAX
+
+log = logging.debug
+
+# Statuses of runs whose duration is representative, timed out runs are not
+VERDICT_STATUSES = ("PASS", "FAIL", "INCONC")
+
+TIMEOUT_STATUS = ptstypes.PTSCONTROL_E_STRING[
+    ptstypes.PTSCONTROL_E_TESTCASE_TIMEOUT]
+
+
+def percentile(values, percent):
+    """Returns the percentile of values, nearest rank method"""
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+
+    return values[max(rank, 1) - 1]
+
+
+class AdaptiveTimeouts(object):
+    """RunTestCase timeouts of test cases and the hang time they saved"""
+
+    def __init__(self, durations, factor=ADAPTIVE_TIMEOUT_FACTOR,
+                 min_timeout=ADAPTIVE_TIMEOUT_MIN,
+                 max_timeout=ADAPTIVE_TIMEOUT_MAX,
+                 default_timeout=PTS_TIMEOUT):
+        """Constructor
+
+        durations -- Dict of test case name: list of durations in seconds
+        factor -- Multiplier of the 99th percentile of durations
+        min_timeout, max_timeout -- Timeout limits in milliseconds
+        default_timeout -- Timeout of test cases without history
+
+        """
+        self._default_timeout = default_timeout
+        self._timeouts = {}
+
+        for test_case, values in durations.items():
+            if not values:
+                continue
+
+            timeout = int(percentile(values, 99) * 1000 * factor)
+            self._timeouts[test_case] = \
+                max(min_timeout, min(max_timeout, timeout))
+
+        # timeout currently set on each PTS instance
+        self._applied = {}
+
+        self._lock = threading.Lock()
+        self.timed_out_runs = 0
+        self.saved_time = 0.0  # seconds
+
+    def get(self, test_case):
+        """Returns RunTestCase timeout of the test case in milliseconds"""
+        return self._timeouts.get(test_case, self._default_timeout)
+
+    def apply(self, pts, timeout):
+        """Sets the timeout on the PTS instance, if it is not set already"""
+        if self._applied.get(id(pts)) == timeout:
+            return
+
+        log("Setting PTS call timeout %d ms", timeout)
+        pts.set_call_timeout(timeout)
+        self._applied[id(pts)] = timeout
+
+    def set_applied(self, pts, timeout):
+        """Records timeout already set on the PTS instance, None if unknown"""
+        self._applied[id(pts)] = timeout
+
+    def record(self, status, timeout):
+        """Accounts hang time removed if the run timed out earlier than it
+        would with the default timeout"""
+        if status != TIMEOUT_STATUS:
+            return
+
+        with self._lock:
+            self.timed_out_runs += 1
+            self.saved_time += max(0, self._default_timeout - timeout) / 1000.0
+
+    def print_report(self):
+        """Prints how much hang time adaptive timeouts removed"""
+        print("\nAdaptive timeouts: %d of test cases with history, "
+              "%d timed out runs, %d s of hang time removed" %
+              (len(self._timeouts), self.timed_out_runs, self.saved_time))
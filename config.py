@@ -3,7 +3,85 @@
 SERVER_PORT = 65000
 CLIENT_PORT = 65001
 
+# Framed RPC transport of PTS instance N, see ptsrpc
+FRAMED_RPC_PORT = 65200
+
+# Callback event stream of PTS instance N, see ptsstream
+EVENT_STREAM_PORT = 65300
+EVENT_STREAM_CAPACITY = 100000 # events kept for a disconnected client
+EVENT_STREAM_WINDOW = 1000 # events sent and not acknowledged yet
+EVENT_STREAM_HEARTBEAT = 10 # seconds
+
+# Live session events, see autoptsevents
+EVENT_BUS_CAPACITY = 1000 # events queued for each sink
+EVENT_BUS_CLOSE_TIMEOUT = 10 # seconds for the sinks to finish
+EVENT_SSE_BACKLOG = 1000 # events replayed to reconnecting SSE clients
+EVENT_SSE_HEARTBEAT = 15 # seconds
+
+# Test history logs of PTS instance N, see ptsartifacts
+ARTIFACT_PORT = 65400
+ARTIFACT_CHUNK_SIZE = 256 * 1024 # bytes
+ARTIFACT_COMPRESSION = 6 # zlib level
+ARTIFACT_RETRIES = 3
+ARTIFACT_TIMEOUT = 30 # seconds
+
 PTS_TIMEOUT = 180000 # milliseconds
 MQTT_TIMEOUT = 30 # seconds
 
 MQTT_BROKER_IP = '127.0.0.1'
+MQTT_BROKER_PORT = 1883
+
+# Topics of the first PTS instance, next instances append "/<index>"
+MQTT_REQUEST_TOPIC = 'user/test'
+MQTT_RESPONSE_TOPIC = 'test/user'
+
+COORDINATOR_PORT = 65100
+HEARTBEAT_INTERVAL = 10 # seconds
+HEARTBEAT_TIMEOUT = 30 # seconds, worker is evicted after that
+
+# Circuit breaker: consecutive timeouts after which the IUT is probed
+BREAKER_THRESHOLD = 3
+BREAKER_PROBE_COUNT = 6
+BREAKER_PROBE_INTERVAL = 10 # seconds
+IUT_PROBE_TIMEOUT = 2 # seconds
+
+# IUT liveness ping before test cases, overlapped with the PTS setup
+IUT_PING_TIMEOUT = 0.5 # seconds
+IUT_PING_INTERVAL = 0 # seconds since the last response, 0 before each test
+
+# Adaptive RunTestCase timeout: p99 of recorded durations * factor, clamped
+ADAPTIVE_TIMEOUT_FACTOR = 3
+ADAPTIVE_TIMEOUT_MIN = 30000 # milliseconds
+ADAPTIVE_TIMEOUT_MAX = PTS_TIMEOUT
+
+# Per WID implicit send deadlines: learned from response times of the IUT,
+# p99 * factor clamped to MIN and MQTT_TIMEOUT, once there are MIN_SAMPLES.
+# Overrides, in seconds, are keyed by (project, wid) or wid,
+# e.g. {("PBAP", 21): 60, 22: 5}
+MQTT_WID_TIMEOUTS = {}
+MQTT_WID_TIMEOUT_FACTOR = 5
+MQTT_WID_TIMEOUT_MIN = 3 # seconds
+MQTT_WID_MIN_SAMPLES = 5
+
+# Flaky test cases: share of pass/fail flips within an IUT build over the
+# last WINDOW runs, scored once there are MIN_SAMPLES comparisons
+FLAKY_THRESHOLD = 0.3
+FLAKY_MIN_SAMPLES = 3
+FLAKY_WINDOW = 20
+QUARANTINE_RETRY = 2
+
+# PTS process watchdog: PTS is recycled between test cases if a limit is
+# exceeded, 0 disables the limit, see ptswatchdog
+WATCHDOG_MAX_MEMORY = 1536 << 20 # bytes
+WATCHDOG_MAX_HANDLES = 10000
+WATCHDOG_MAX_CPU = 0 # percent of one core
+WATCHDOG_MAX_TESTS = 0
+WATCHDOG_SLOWDOWN = 2.0
+WATCHDOG_WINDOW = 10 # test cases
+
+# Server memory logs of the current and last test cases, see ptslogbuffer
+LOG_BUFFER_MAX_BYTES = 64 << 20 # bytes
+LOG_BUFFER_TEST_CASES = 4
+
+# Implicit send auto-responder rules, see ptsimplicitsend.ImplicitSendRules
+IMPLICIT_SEND_RULES_FILE = 'implicit_send_rules.json'
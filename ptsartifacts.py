@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+
+"""Streaming of PTS test history logs to the client
+
+With save_test_history_log enabled PTS writes the logs of every test case run
+into the workspace folder on the server host. The server streams them to the
+client over a persistent connection to port ARTIFACT_PORT + N, without
+touching PTS, so logs of a test case are transferred while the next one runs.
+
+Protocol, frames as in ptsrpc, requests and replies are JSON:
+
+    client: {"op": "time"}
+    server: {"time"}                                  clock of the server
+    client: {"op": "list", "workspace", "test_case", "since"}
+    server: {"files": [[path, size, mtime, sha256], ...]}
+    client: {"op": "get", "workspace", "path", "sha256", "offset"}
+    server: {"size", "sha256", "offset"}
+    server: zlib stream of the file from offset, in chunks
+    server: empty frame                               end of the file
+
+Errors are replied as {"error"}. Files are listed relative to the folder of
+the workspace, which must have been opened by PTS, with "/" separators. Logs
+of a test case are the files modified since the given time whose path
+contains the test case name with "/" replaced by "_", as PTS names its test
+history folders, all files modified since then if no test case is given.
+
+The client keeps the files in a store named by their SHA-256, a file already
+in the store is not transferred again, and links them into the log
+directory of the test case. Interrupted transfers are resumed from the
+partial file kept in the store, offset is ignored if the file has changed.
+
+A whole session can be fetched by hand:
+
+    ./ptsartifacts.py 192.168.1.103 [workspace] --since 600 -o logs/fetched
+"""
+
+import os
+import sys
+import time
+import zlib
+import queue
+import shutil
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+import socketserver
+
+import ptsrpc
+from config import ARTIFACT_PORT, ARTIFACT_CHUNK_SIZE, ARTIFACT_COMPRESSION, \
+    ARTIFACT_RETRIES, ARTIFACT_TIMEOUT
+
+log = logging.debug
+
+# seconds subtracted from "since", covers clock offset error and coarse
+# file system timestamps
+CLOCK_MARGIN = 2
+RETRY_DELAY = 1  # seconds, doubled after each failed attempt
+
+_dumps, _loads = ptsrpc.CODECS["json"]
+
+
+class ArtifactError(Exception):
+    """Request refused by the server or transferred file corrupted"""
+
+
+def get_log_name(test_case):
+    """Returns test case name as it appears in PTS log paths"""
+    return test_case.replace("/", "_")
+
+
+def get_file_hash(path, size=None):
+    """Returns SHA-256 hex digest of the first size bytes of the file"""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        while size is None or size > 0:
+            chunk = f.read(ARTIFACT_CHUNK_SIZE if size is None else
+                           min(size, ARTIFACT_CHUNK_SIZE))
+            if not chunk:
+                break
+
+            digest.update(chunk)
+            if size is not None:
+                size -= len(chunk)
+
+    return digest.hexdigest()
+
+
+class ArtifactStore(object):
+    """Test history logs in the folders of the workspaces opened by PTS"""
+
+    def __init__(self, get_workspaces):
+        """Constructor
+
+        get_workspaces -- Callable returning paths of workspaces opened by
+                          PTS, only their folders are served
+
+        """
+        self._get_workspaces = get_workspaces
+        self._hashes = {}  # path: (size, mtime, sha256)
+        self._lock = threading.Lock()
+
+    def _get_root(self, workspace):
+        if workspace not in self._get_workspaces():
+            raise ArtifactError("Workspace %s has not been opened" %
+                                (workspace,))
+
+        return os.path.realpath(os.path.dirname(workspace))
+
+    def _get_path(self, workspace, path):
+        """Returns local path of file listed relative to the workspace"""
+        root = self._get_root(workspace)
+        local_path = os.path.realpath(os.path.join(root, *path.split("/")))
+
+        if os.path.commonpath([root, local_path]) != root:
+            raise ArtifactError("%s is outside of the workspace folder" %
+                                (path,))
+
+        return local_path
+
+    def get_hash(self, path, stat):
+        """Returns SHA-256 of the file, cached while it is not modified"""
+        with self._lock:
+            cached = self._hashes.get(path)
+
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime):
+            return cached[2]
+
+        sha256 = get_file_hash(path, stat.st_size)
+
+        with self._lock:
+            self._hashes[path] = (stat.st_size, stat.st_mtime, sha256)
+
+        return sha256
+
+    def list(self, workspace, test_case, since):
+        """Returns list of [path, size, mtime, sha256] of the logs of the test
+        case modified since the given time, see module documentation"""
+        root = self._get_root(workspace)
+        name = get_log_name(test_case) if test_case else None
+        files = []
+
+        for directory, _, file_names in os.walk(root):
+            for file_name in file_names:
+                local_path = os.path.join(directory, file_name)
+                path = os.path.relpath(local_path, root).replace(os.sep, "/")
+
+                if name is not None and name not in path:
+                    continue
+
+                try:
+                    stat = os.stat(local_path)
+                    if stat.st_mtime < since:
+                        continue
+
+                    files.append([path, stat.st_size, stat.st_mtime,
+                                  self.get_hash(local_path, stat)])
+
+                except OSError as error:
+                    # removed meanwhile
+                    log("Artifact %s: %r", local_path, error)
+
+        return sorted(files)
+
+    def open(self, workspace, path, sha256, offset):
+        """Returns (file object at the offset, size, sha256, offset), offset
+        is 0 if the content is not the sha256 one anymore"""
+        local_path = self._get_path(workspace, path)
+
+        f = open(local_path, "rb")
+        try:
+            stat = os.fstat(f.fileno())
+            current = self.get_hash(local_path, stat)
+
+            if current != sha256 or offset > stat.st_size:
+                offset = 0
+
+            f.seek(offset)
+
+        except Exception:
+            f.close()
+            raise
+
+        return f, stat.st_size, current, offset
+
+
+class _ArtifactHandler(socketserver.BaseRequestHandler):
+    """Serves requests of one client connection"""
+
+    def handle(self):
+        sock = self.request
+
+        try:
+            while True:
+                payload = ptsrpc.recv_frame(sock)
+                if payload is None:
+                    return
+
+                self._serve(sock, _loads(payload))
+
+        except (OSError, ValueError, ptsrpc.ProtocolError) as error:
+            log("Artifact client %s:%d: %r", self.client_address[0],
+                self.client_address[1], error)
+
+    def _serve(self, sock, request):
+        store = self.server.store
+        op = request.get("op")
+        f = None
+
+        # errors of the request are replied, the connection is kept
+        try:
+            if op == "time":
+                reply = {"time": time.time()}
+
+            elif op == "list":
+                reply = {"files": store.list(request["workspace"],
+                                             request.get("test_case"),
+                                             request.get("since", 0))}
+
+            elif op == "get":
+                f, size, sha256, offset = store.open(
+                    request["workspace"], request["path"],
+                    request.get("sha256"), request.get("offset", 0))
+                reply = {"size": size, "sha256": sha256, "offset": offset}
+
+            else:
+                raise ArtifactError("Unknown operation %r" % (op,))
+
+        except (ArtifactError, KeyError, OSError) as error:
+            log("Artifact request %r: %r", request, error)
+            reply = {"error": str(error)}
+
+        ptsrpc.send_frame(sock, _dumps(reply))
+
+        if f is not None:
+            with f:
+                self._send_file(sock, f, size - offset)
+
+    def _send_file(self, sock, f, size):
+        """Sends size bytes of the file compressed, then the end frame"""
+        compressor = zlib.compressobj(ARTIFACT_COMPRESSION)
+
+        while size > 0:
+            chunk = f.read(min(size, ARTIFACT_CHUNK_SIZE))
+            if not chunk:
+                break  # truncated meanwhile, the client sees wrong hash
+
+            size -= len(chunk)
+            data = compressor.compress(chunk) + \
+                compressor.flush(zlib.Z_SYNC_FLUSH)
+            ptsrpc.send_frame(sock, data)
+
+        ptsrpc.send_frame(sock, compressor.flush())
+        ptsrpc.send_frame(sock, b"")
+
+
+class ArtifactServer(socketserver.ThreadingTCPServer):
+    """Serves test history logs of a PTS instance"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, get_workspaces, port):
+        socketserver.ThreadingTCPServer.__init__(self, ("", port),
+                                                 _ArtifactHandler)
+        self.store = ArtifactStore(get_workspaces)
+
+
+class ArtifactFetcher(threading.Thread):
+    """Fetches logs of test cases from an ArtifactServer in the background,
+    one request at a time, see module documentation"""
+
+    def __init__(self, host, port, store_dir, retries=ARTIFACT_RETRIES):
+        """Constructor
+
+        store_dir -- Directory of files named by their SHA-256, shared by
+                     fetchers
+        retries -- Attempts after a failed fetch, transfers are resumed
+
+        """
+        threading.Thread.__init__(self, name="ArtifactFetcher-%s:%d" %
+                                  (host, port))
+        self.daemon = True
+
+        self.address = (host, port)
+        self.store_dir = store_dir
+        self.retries = retries
+
+        self.file_count = 0
+        self.dedup_count = 0
+        self.size = 0  # bytes of fetched files
+        self.wire_size = 0  # compressed bytes received
+        self.failed = []  # test cases whose logs were not fetched
+
+        self._jobs = queue.Queue()
+        self._socket = None
+        self._clock_offset = 0
+
+    def fetch(self, workspace, test_case, since, dest_dir):
+        """Queues fetch of the logs of the test case, returns at once
+
+        test_case -- Test case name, None for all logs
+        since -- Local time the test case started
+        dest_dir -- Directory the files are placed in
+
+        """
+        self._jobs.put((workspace, test_case, since, dest_dir))
+
+    def close(self):
+        """Waits until the queued logs are fetched"""
+        self._jobs.put(None)
+        self.join()
+
+    def run(self):
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    return
+
+                self._run_job(job)
+
+        finally:
+            self._disconnect()
+
+    def _run_job(self, job):
+        delay = RETRY_DELAY
+
+        for attempt in range(self.retries + 1):
+            try:
+                self._fetch(*job)
+                return
+
+            except (OSError, ValueError, ptsrpc.ProtocolError,
+                    ArtifactError) as error:
+                log("Fetching logs of %s, attempt %d: %r", job[1], attempt,
+                    error)
+                self._disconnect()
+                last_error = error
+
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+
+        logging.warning("Logs of %s not fetched: %r", job[1], last_error)
+        self.failed.append(job[1])
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, ptsrpc.CONNECT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(ARTIFACT_TIMEOUT)
+        self._socket = sock
+
+        # "since" is compared with the file times on the server
+        start_time = time.time()
+        server_time = self._request({"op": "time"})["time"]
+        self._clock_offset = server_time - (start_time + time.time()) / 2
+
+        log("Artifact server %s:%d clock offset %.3f s", self.address[0],
+            self.address[1], self._clock_offset)
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _request(self, request):
+        if self._socket is None:
+            self._connect()
+
+        ptsrpc.send_frame(self._socket, _dumps(request))
+
+        payload = ptsrpc.recv_frame(self._socket)
+        if payload is None:
+            raise ptsrpc.ProtocolError("Connection closed")
+
+        reply = _loads(payload)
+        if "error" in reply:
+            raise ArtifactError(reply["error"])
+
+        return reply
+
+    def _fetch(self, workspace, test_case, since, dest_dir):
+        if self._socket is None:
+            self._connect()
+
+        reply = self._request({"op": "list", "workspace": workspace,
+                               "test_case": test_case,
+                               "since": since + self._clock_offset -
+                               CLOCK_MARGIN if since else 0})
+
+        for path, size, mtime, sha256 in reply["files"]:
+            target = os.path.join(dest_dir, *path.split("/"))
+            if os.path.exists(target):
+                continue  # placed by the failed attempt
+
+            stored = os.path.join(self.store_dir, sha256)
+            if os.path.exists(stored):
+                self.dedup_count += 1
+            else:
+                stored = self._download(workspace, path, sha256)
+
+            directory = os.path.dirname(target)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            try:
+                os.link(stored, target)
+            except OSError:
+                shutil.copyfile(stored, target)
+
+            self.file_count += 1
+            self.size += size
+
+        log("Fetched %d logs of %s into %s", len(reply["files"]), test_case,
+            dest_dir)
+
+    def _get_part_path(self, sha256):
+        # fetchers of other servers may download the same file
+        return os.path.join(self.store_dir, "%s.%s_%d.part" %
+                            ((sha256,) + self.address))
+
+    def _download(self, workspace, path, sha256):
+        """Downloads file into the store, returns its path there"""
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+
+        part_path = self._get_part_path(sha256)
+        offset = os.path.getsize(part_path) \
+            if os.path.exists(part_path) else 0
+
+        reply = self._request({"op": "get", "workspace": workspace,
+                               "path": path, "sha256": sha256,
+                               "offset": offset})
+
+        # content has changed since the list
+        if reply["sha256"] != sha256:
+            sha256 = reply["sha256"]
+            part_path = self._get_part_path(sha256)
+
+        decompressor = zlib.decompressobj()
+
+        with open(part_path, "r+b" if reply["offset"] else "wb") as f:
+            f.seek(reply["offset"])
+            f.truncate()
+
+            while True:
+                payload = ptsrpc.recv_frame(self._socket)
+                if payload is None:
+                    raise ptsrpc.ProtocolError("Connection closed")
+                if not payload:
+                    break
+
+                self.wire_size += len(payload)
+                f.write(decompressor.decompress(payload))
+
+        if get_file_hash(part_path) != sha256:
+            os.remove(part_path)
+            raise ArtifactError("%s corrupted in transfer" % (path,))
+
+        stored = os.path.join(self.store_dir, sha256)
+        os.replace(part_path, stored)
+
+        return stored
+
+
+def parse_args():
+    """Parses command line arguments and options"""
+    arg_parser = argparse.ArgumentParser(
+        description="Fetch PTS test history logs from the auto PTS server")
+
+    arg_parser.add_argument("server", help="host[:port] of the log server, "
+                                           "port %d by default" %
+                                           (ARTIFACT_PORT,))
+    arg_parser.add_argument("workspace", help="Path of the workspace on the "
+                                              "server")
+    arg_parser.add_argument("-t", "--test-case",
+                            help="Fetch logs of the test case only")
+    arg_parser.add_argument("--since", type=float, default=0,
+                            help="Fetch logs of the last SINCE seconds")
+    arg_parser.add_argument("-o", "--output", default="logs",
+                            help="Directory to place the logs in")
+    arg_parser.add_argument("--store", default=os.path.join("logs",
+                                                            "artifacts"),
+                            help="Directory of fetched files by hash")
+
+    return arg_parser.parse_args()
+
+
+def main():
+    """Fetches the logs of a session or a test case"""
+    args = parse_args()
+
+    host, sep, port = args.server.rpartition(":")
+    if not sep:
+        host, port = args.server, ARTIFACT_PORT
+
+    fetcher = ArtifactFetcher(host, int(port), args.store)
+    fetcher.start()
+    fetcher.fetch(args.workspace, args.test_case,
+                  time.time() - args.since if args.since else 0, args.output)
+    fetcher.close()
+
+    print("%d files, %d already fetched, %d bytes received" %
+          (fetcher.file_count, fetcher.dedup_count, fetcher.wire_size))
+
+    if fetcher.failed:
+        sys.exit("Fetch failed, see the log")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -15,10 +15,15 @@ import win32com.server.connect
 import win32com.server.util
 import pythoncom
 import ptsprojects.ptstypes as ptstypes
+from ptsimplicitsend import WidDeadlines, ImplicitSendRules
+from ptsstream import EventStream
+from ptswatchdog import Watchdog, ProcessStats
+from ptslogbuffer import LogBuffer
 import ctypes
 import json
+import threading
 import paho.mqtt.client as mqtt
-from config import MQTT_TIMEOUT
+from config import MQTT_REQUEST_TOPIC
 
 log = logging.debug
 
@@ -29,6 +34,10 @@ logtype_whitelist = [ptstypes.PTS_LOGTYPE_START_TEST,
 
 PTS_WORKSPACE_FILE_EXT = ".pqw6"
 
+# PTS.exe PID is found by comparing process lists before and after starting
+# PTS, so instances of one server process have to start PTS one at a time
+_pts_start_lock = threading.Lock()
+
 
 class PTSLogger(win32com.server.connect.ConnectableServer):
     """PTS control client logger callback implementation"""
@@ -37,12 +46,19 @@ class PTSLogger(win32com.server.connect.ConnectableServer):
     _reg_progid_ = "autopts.PTSLogger"
     _public_methods_ = ['Log'] + win32com.server.connect.ConnectableServer._public_methods_
 
-    def __init__(self):
-        """"Constructor"""
+    def __init__(self, log_buffer):
+        """"Constructor
+
+        log_buffer -- ptslogbuffer.LogBuffer the lines are kept in while
+                      maximum logging is enabled without push
+
+        """
         super(PTSLogger, self).__init__()
 
         self._callback = None
         self._maximum_logging = False
+        self._push = True
+        self._log_buffer = log_buffer
         self._test_case_name = None
 
     def set_callback(self, callback):
@@ -53,14 +69,23 @@ class PTSLogger(win32com.server.connect.ConnectableServer):
         """Unset the callback"""
         self._callback = None
 
-    def enable_maximum_logging(self, enable):
-        """Enable/disable maximum logging"""
+    def enable_maximum_logging(self, enable, push=True):
+        """Enable/disable maximum logging, with push False all lines are
+        kept in the log buffer and only the whitelisted ones are pushed"""
         self._maximum_logging = enable
+        self._push = push
+
+    def _is_buffered(self):
+        """Returns True if the lines are kept in the log buffer"""
+        return self._maximum_logging and not self._push
 
     def set_test_case_name(self, test_case_name):
         """Required to identify multiple instances on client side"""
         self._test_case_name = test_case_name
 
+        if self._is_buffered():
+            self._log_buffer.start_test_case(test_case_name)
+
     def Log(self, log_type, logtype_string, log_time, log_message):
         """Implements:
 
@@ -72,6 +97,15 @@ class PTSLogger(win32com.server.connect.ConnectableServer):
         };
         """
 
+        # debug lines not pushed are kept only in the buffer, the client
+        # fetches them if needed
+        if self._is_buffered():
+            self._log_buffer.append(log_type, logtype_string, log_time,
+                                    log_message)
+
+            if log_type not in logtype_whitelist:
+                return
+
         logger = logging.getLogger(self.__class__.__name__)
         log = logger.info
 
@@ -94,15 +128,32 @@ class PTSSender(win32com.server.connect.ConnectableServer):
     _reg_progid_ = "autopts.PTSSender"
     _public_methods_ = ['OnImplicitSend'] + win32com.server.connect.ConnectableServer._public_methods_
 
-    def __init__(self, mqtt_client, bd_addr):
+    def __init__(self, mqtt_client, bd_addr, mqtt_topic=MQTT_REQUEST_TOPIC,
+                 wid_deadlines=None, rules=None):
         """"Constructor"""
         super(PTSSender, self).__init__()
 
+        self._rules = rules
+
         self._callback = None
         self._mqtt_response = None
+        self._mqtt_response_event = threading.Event()
+        # id of the outstanding request, echoed by the tester in responses
+        self._request_id = 0
+        self._request_lock = threading.Lock()
+        self._wid_deadlines = wid_deadlines or WidDeadlines()
         self._mqtt_client = mqtt_client
         self._mqtt_client.on_message = self.on_implicit_send_response
+        self._mqtt_topic = mqtt_topic
         self._bd_addr = bd_addr
+        self._no_response_count = 0
+        self._probe_start_time = 0
+
+    def set_mqtt_client(self, mqtt_client, mqtt_topic):
+        """Sets MQTT client and topic used to reach the IUT tester"""
+        self._mqtt_client = mqtt_client
+        self._mqtt_client.on_message = self.on_implicit_send_response
+        self._mqtt_topic = mqtt_topic
 
     def set_callback(self, callback):
         """Sets the callback"""
@@ -121,7 +172,31 @@ class PTSSender(win32com.server.connect.ConnectableServer):
         # the result is a Python dictionary:
         result = command["parameters"]["result"]
         log("MQTT response result: %s" % result)
-        self._mqtt_response = result
+
+        # late responses to timed out requests must not answer the next one,
+        # responses without id are of testers not echoing it
+        with self._request_lock:
+            response_id = command.get("id")
+            if response_id is not None and response_id != self._request_id:
+                log("MQTT response to request %r dropped, waiting for %d",
+                    response_id, self._request_id)
+                return
+
+            self._mqtt_response = result
+            self._mqtt_response_event.set()
+
+    def _publish_request(self, command):
+        """Sends command to the IUT tester with id of a new request, the
+        responses echoing ids of the previous ones are dropped from now on"""
+        with self._request_lock:
+            self._request_id += 1
+            command["id"] = self._request_id
+            self._mqtt_response = None
+            self._mqtt_response_event.clear()
+
+        message = json.dumps(command)
+        log("MQTT request: %s" % message)
+        self._mqtt_client.publish(self._mqtt_topic, message)
 
     def OnImplicitSend(self, project_name, wid, test_case, description, style):
         """Implements:
@@ -149,6 +224,18 @@ class PTSSender(win32com.server.connect.ConnectableServer):
         log("description: %s %s" % (description, type(description)))
         log("style: %s 0x%x", ptstypes.MMI_STYLE_STRING[style], style)
 
+        if self._rules is not None:
+            response = self._rules.match(project_name, wid, test_case,
+                                         description, style)
+            if response is not None:
+                log("Response from implicit send rules: %r", response)
+                log("END OnImplicitSend:")
+                log("*" * 20)
+
+                self._notify_mmi(project_name, wid, test_case, description,
+                                 style, response)
+                return self._response_variant(response)
+
         # a Python object (dict):
         command = {
             "command": "ImplicitSend",
@@ -163,33 +250,23 @@ class PTSSender(win32com.server.connect.ConnectableServer):
             "response_required": "true"
         }
 
-        # convert into JSON:
-        message = json.dumps(command)
-
-        # the result is a JSON string:
-        log("MQTT request: %s" % message)
-
-        self._mqtt_response = None
-        self._mqtt_client.publish('user/test', message)
+        deadline = self._wid_deadlines.get(project_name, wid)
 
-        timer = 0
+        start_time = time.time()
+        self._publish_request(command)
 
         try:
-            log("Wait for MQTT response")
+            log("Wait for MQTT response, deadline %.1f sec", deadline)
 
-            while not self._mqtt_response:
-                # XXX: Ask for response every second
-                timer = timer + 1
-                # XXX: Timeout MQTT_TIMEOUT seconds
-                if timer > MQTT_TIMEOUT:
-                    self._mqtt_response = "Cancel"
-                    break
+            if self._mqtt_response_event.wait(deadline):
+                self._wid_deadlines.record(project_name, wid,
+                                           time.time() - start_time)
+            else:
+                self._mqtt_response = "Cancel"
+                self._no_response_count += 1
 
-                log("Rechecking MQTT response...")
-                time.sleep(1)
-
-            log("MQTT response returned after %d sec, respose: %r",
-                timer, self._mqtt_response)
+            log("MQTT response returned after %.3f sec, respose: %r",
+                time.time() - start_time, self._mqtt_response)
 
         except Exception as e:
             log("Caught exception")
@@ -197,38 +274,111 @@ class PTSSender(win32com.server.connect.ConnectableServer):
             # exit does not work, cause app is blocked in PTS.RunTestCase?
             sys.exit("Exception in OnImplicitSend")
 
-        if self._mqtt_response:
+        log("END OnImplicitSend:")
+        log("*" * 20)
+
+        self._notify_mmi(project_name, wid, test_case, description, style,
+                         self._mqtt_response)
+        return self._response_variant(self._mqtt_response)
+
+    def _notify_mmi(self, project_name, wid, test_case, description, style,
+                    response):
+        """Pushes the answered implicit send to the event stream. The
+        XML-RPC client callback only receives logs."""
+        callback = self._callback
+        if isinstance(callback, EventStream):
+            callback.mmi(project_name, wid, test_case, description, style,
+                         response)
+
+    @staticmethod
+    def _response_variant(response):
+        """Returns the OnImplicitSend return value for the response"""
+        if response:
             is_present = 1
         else:
             is_present = 0
 
         # Stringify response
-        self._mqtt_response = str(self._mqtt_response)
-        rsp_len = str(len(self._mqtt_response))
+        response = str(response)
+        rsp_len = str(len(response))
         is_present = str(is_present)
 
-        log("END OnImplicitSend:")
-        log("*" * 20)
-
         return win32com.client.VARIANT(pythoncom.VT_ARRAY | pythoncom.VT_BSTR,
-                                       [self._mqtt_response, rsp_len, is_present])
+                                       [response, rsp_len, is_present])
 
+    def get_no_response_count(self):
+        """Returns number of implicit sends the IUT tester did not respond to"""
+        return self._no_response_count
 
-def parse_ptscontrol_error(err):
+    def start_probe(self, command=ptstypes.IUT_PROBE_PING):
+        """Sends command to the IUT tester without waiting for the response
+
+        The tester responds to "Ping" and "Capabilities" the same way as to
+        the implicit send, with the result in the parameters.
+
+        """
+        command = {
+            "command": command,
+            "parameters": {
+                "address": self._bd_addr,
+            },
+            "response_required": "true"
+        }
+
+        self._probe_start_time = time.time()
+        self._publish_request(command)
+
+    def get_probe_result(self, timeout):
+        """Waits for response to start_probe up to timeout seconds since it
+        was sent
+
+        Returns dict: "ok" True if the tester responded, its "result" and
+        round trip "time" in seconds
+
+        """
+        remaining = self._probe_start_time + timeout - time.time()
+        ok = self._mqtt_response_event.wait(max(0, remaining))
+        rtt = time.time() - self._probe_start_time
+
+        if ok:
+            log("IUT probe response after %.3f sec: %r", rtt,
+                self._mqtt_response)
+        else:
+            log("IUT probe timed out after %s sec", timeout)
+
+        return {"ok": ok, "result": self._mqtt_response if ok else None,
+                "time": rtt}
+
+    def probe(self, timeout):
+        """Pings the IUT tester
+
+        Returns True if the tester responded within timeout seconds
+
+        """
+        self.start_probe(ptstypes.IUT_PROBE_PING)
+        return self.get_probe_result(timeout)["ok"]
+
+
+def get_ptscontrol_error_string(err):
+    """Returns PTSCONTROL_E_STRING of the COM error"""
     try:
         _, source, description, _, _, hresult = err.excepinfo
 
         ptscontrol_e = ctypes.c_uint32(hresult).value
-        ptscontrol_e_string = ptstypes.PTSCONTROL_E_STRING[ptscontrol_e]
-
-        logging.exception(ptscontrol_e_string)
-
-        return ptscontrol_e_string
+        return ptstypes.PTSCONTROL_E_STRING[ptscontrol_e]
 
     except Exception:
         raise Exception(err)
 
 
+def parse_ptscontrol_error(err):
+    ptscontrol_e_string = get_ptscontrol_error_string(err)
+
+    logging.exception(ptscontrol_e_string)
+
+    return ptscontrol_e_string
+
+
 class PyPTS:
     """PTS control interface.
 
@@ -240,11 +390,32 @@ class PyPTS:
 
     """
 
-    def __init__(self, mqtt_client):
-        """Constructor"""
+    def __init__(self, mqtt_client, mqtt_topic=MQTT_REQUEST_TOPIC):
+        """Constructor
+
+        mqtt_client -- MQTT client used to reach the IUT tester
+        mqtt_topic -- Topic the implicit send requests are published to
+
+        """
         log("%s", self.__init__.__name__)
 
         self._mqtt_client = mqtt_client
+        self._mqtt_topic = mqtt_topic
+        # learned deadlines and rules are kept when PTS is restarted
+        self._wid_deadlines = WidDeadlines()
+        self._implicit_send_rules = ImplicitSendRules()
+        self._watchdog = Watchdog(self._get_process_stats)
+        self._log_buffer = LogBuffer()
+        # folders of these workspaces are served by ptsartifacts
+        self._opened_workspaces = []
+
+        # settings restored when PTS is recycled
+        self._callback = None
+        self._call_timeout = None
+        self._maximum_logging = False
+        self._push_logs = True
+        self._save_test_history_log = False
+
         self._init_attributes()
 
         # This is done to have valid _pts in case client does not restart_pts
@@ -273,19 +444,32 @@ class PyPTS:
         # avoided to contact PTS. These attributes should not change anyway.
         self.__bd_addr = None
         self._pts_projects = {}
+        self._workspace_path = None
+
+        # Values of PIXITs and PICS set since the workspace has been opened:
+        # project name: {name: value}
+        self._pixit_cache = {}
+        self._pics_cache = {}
+
+        # True once a value of the caches has been changed, e.g. by a test
+        # case override, so the caches no longer hold the workspace setup
+        self._values_overridden = False
 
     def recover_pts(self, workspace_path, pts_timeout):
         """Recovers PTS from errors occured during RunTestCase call.
 
         The errors include timeout set by SetPTSCallTimeout. The only way to
-        correctly recover is to restore PTS settings.
+        correctly recover is to restore PTS settings: the workspace is
+        reopened with the PIXITs and PICS set since it has been opened, so
+        the retry runs with the same values as the failed run.
 
         """
 
         log("%s timeout=%d %s", self.recover_pts.__name__, pts_timeout, workspace_path)
 
-        self.open_workspace(workspace_path)
-        self.set_call_timeout(pts_timeout)
+        pixits, pics = self._get_applied_values()
+        self._call_timeout = pts_timeout
+        self._restore_settings(workspace_path, pixits, pics)
 
     def restart_pts(self):
         """Restarts PTS
@@ -309,20 +493,21 @@ class PyPTS:
 
         log("%s", self.start_pts.__name__)
 
-        # Get PTS process list before running new PTS daemon
-        c = wmi.WMI()
-        pts_ps_list_pre = []
-        pts_ps_list_post = []
+        with _pts_start_lock:
+            # Get PTS process list before running new PTS daemon
+            c = wmi.WMI()
+            pts_ps_list_pre = []
+            pts_ps_list_post = []
 
-        for ps in c.Win32_Process(name="PTS.exe"):
-            pts_ps_list_pre.append(ps)
+            for ps in c.Win32_Process(name="PTS.exe"):
+                pts_ps_list_pre.append(ps)
 
-        self._pts = win32com.client.Dispatch('ProfileTuningSuite_6.PTSControlServer')
+            self._pts = win32com.client.Dispatch('ProfileTuningSuite_6.PTSControlServer')
 
-        # Get PTS process list after running new PTS daemon to get PID of
-        # new instance
-        for ps in c.Win32_Process(name="PTS.exe"):
-            pts_ps_list_post.append(ps)
+            # Get PTS process list after running new PTS daemon to get PID of
+            # new instance
+            for ps in c.Win32_Process(name="PTS.exe"):
+                pts_ps_list_post.append(ps)
 
         pts_ps_list = list(set(pts_ps_list_post) - set(pts_ps_list_pre))
         if not pts_ps_list:
@@ -333,12 +518,16 @@ class PyPTS:
 
         log("Started new PTS daemon with pid: %d" % self._pts_proc.ProcessId)
 
+        self._watchdog.reset()
+
         # cached frequently used PTS attributes: due to optimisation reasons it
         # is avoided to contact PTS. These attributes should not change anyway.
         self.__bd_addr = None
 
-        self._pts_logger = PTSLogger()
-        self._pts_sender = PTSSender(self._mqtt_client, self.bd_addr())
+        self._pts_logger = PTSLogger(self._log_buffer)
+        self._pts_sender = PTSSender(self._mqtt_client, self.bd_addr(),
+                                     self._mqtt_topic, self._wid_deadlines,
+                                     self._implicit_send_rules)
 
         self._com_logger = win32com.client.dynamic.Dispatch(
             win32com.server.util.wrap(self._pts_logger))
@@ -352,6 +541,96 @@ class PyPTS:
         log("PTS Bluetooth Address: %s", self.get_bluetooth_address())
         log("PTS BD_ADDR: %s" % self.bd_addr())
 
+    def _get_process_stats(self):
+        """Returns ptswatchdog.ProcessStats of the PTS process"""
+        proc = wmi.WMI().Win32_Process(ProcessId=self._pts_proc.ProcessId)[0]
+
+        # times are in 100 ns units
+        return ProcessStats(
+            (int(proc.KernelModeTime) + int(proc.UserModeTime)) / 1e7,
+            int(proc.WorkingSetSize), int(proc.HandleCount))
+
+    def check_health(self, duration, expected_duration=0):
+        """Records test case run in the watchdog, see ptswatchdog
+
+        Called between test cases. Returns reason to recycle PTS, empty
+        string if PTS is healthy.
+
+        """
+        try:
+            reason = self._watchdog.record_test(duration, expected_duration)
+
+        except Exception as error:
+            # PTS process is gone, the next test case recovers it
+            logging.exception(repr(error))
+            return ""
+
+        log("%s %r: %s", self.check_health.__name__,
+            self._watchdog.get_report(), reason)
+
+        return reason or ""
+
+    def get_health_report(self):
+        """Returns dict of values watched by the watchdog"""
+        return self._watchdog.get_report()
+
+    def _get_applied_values(self):
+        """Returns copies of PIXITs and PICS set since the workspace has
+        been opened"""
+        return (dict((project, dict(values)) for project, values in
+                     self._pixit_cache.items()),
+                dict((project, dict(values)) for project, values in
+                     self._pics_cache.items()))
+
+    def _restore_settings(self, workspace_path, pixits, pics):
+        """Opens the workspace, sets the PIXITs, PICS and the call timeout"""
+        values_overridden = self._values_overridden
+
+        self.open_workspace(workspace_path)
+        self.set_pixits_bulk(pixits)
+        self.set_pics_bulk(pics)
+
+        self._values_overridden = values_overridden
+
+        if self._call_timeout is not None:
+            self.set_call_timeout(self._call_timeout)
+
+    def recycle_pts(self):
+        """Restarts PTS, restoring the open workspace, PIXITs and PICS set
+        since it has been opened, call timeout, logging, saving of test
+        history logs and callback"""
+
+        log("%s", self.recycle_pts.__name__)
+
+        workspace_path = self._workspace_path
+        pixits, pics = self._get_applied_values()
+
+        self.restart_pts()
+
+        if workspace_path:
+            self._restore_settings(workspace_path, pixits, pics)
+        elif self._call_timeout is not None:
+            self.set_call_timeout(self._call_timeout)
+
+        if self._maximum_logging:
+            self.enable_maximum_logging(True, self._push_logs)
+
+        if self._save_test_history_log:
+            self.save_test_history_log(True)
+
+        if self._callback is not None:
+            self.register_ptscallback(self._callback)
+
+    def switch_workspace(self, workspace_path):
+        """Opens another workspace keeping PIXITs and PICS set since the
+        current one has been opened, e.g. IUT address, and the call timeout.
+        Values of projects missing in the workspace are skipped."""
+
+        log("%s %s", self.switch_workspace.__name__, workspace_path)
+
+        pixits, pics = self._get_applied_values()
+        self._restore_settings(workspace_path, pixits, pics)
+
     def stop_pts(self):
         """Stops PTS"""
 
@@ -392,8 +671,45 @@ class PyPTS:
 
         log("Open workspace: %s", workspace_path)
 
+        self._workspace_path = None
         self._pts.OpenWorkspace(workspace_path)
         self._cache_test_cases()
+        self._workspace_path = workspace_path
+
+        if workspace_path not in self._opened_workspaces:
+            self._opened_workspaces.append(workspace_path)
+
+        self._pixit_cache.clear()
+        self._pics_cache.clear()
+        self._values_overridden = False
+
+    def get_opened_workspaces(self):
+        """Returns paths of the workspaces opened since the server started"""
+
+        return list(self._opened_workspaces)
+
+    def is_workspace_open(self, workspace_path):
+        """Returns True if PTS is running and responding with the workspace
+        open and only the workspace setup values applied, so the client can
+        skip restarting PTS"""
+
+        if self._pts is None or self._workspace_path != workspace_path:
+            return False
+
+        # e.g. left by test case overrides of the previous client, they
+        # would become the workspace values of the next one
+        if self._values_overridden:
+            log("PIXITs or PICS changed since the workspace has been opened")
+            return False
+
+        try:
+            self._pts.GetPTSVersion()
+
+        except Exception as error:
+            log("PTS does not respond: %r", error)
+            return False
+
+        return True
 
     def _cache_test_cases(self):
         """Cache test cases"""
@@ -528,11 +844,7 @@ class PyPTS:
         log("%s %s %s %s", self.set_pics.__name__, project_name,
             entry_name, bool_value)
 
-        try:
-            self._pts.UpdatePics(project_name, entry_name, bool_value)
-
-        except pythoncom.com_error as e:
-            parse_ptscontrol_error(e)
+        self.set_pics_bulk({project_name: {entry_name: bool_value}})
 
     def set_pixit(self, project_name, param_name, param_value):
         """Set PIXIT
@@ -552,11 +864,7 @@ class PyPTS:
         log("%s %s %s %s", self.set_pixit.__name__, project_name,
             param_name, param_value)
 
-        try:
-            self._pts.UpdatePixitParam(project_name, param_name, param_value)
-
-        except pythoncom.com_error as e:
-            parse_ptscontrol_error(e)
+        self.set_pixits_bulk({project_name: {param_name: param_value}})
 
     def update_pixit_param(self, project_name, param_name, new_param_value):
         """Updates PIXIT
@@ -574,24 +882,139 @@ class PyPTS:
         log("%s %s %s %s", self.update_pixit_param.__name__, project_name,
             param_name, new_param_value)
 
-        try:
-            self._pts.UpdatePixitParam(project_name, param_name, new_param_value)
+        self.set_pixits_bulk({project_name: {param_name: new_param_value}})
 
-        except pythoncom.com_error as e:
-            parse_ptscontrol_error(e)
+    def _update_bulk(self, update, cache, not_changed_error, values):
+        """Applies {project: {name: value}} skipping values already set
+
+        update -- PTS method updating single value
+        cache -- Values already set, updated with the applied ones
+        not_changed_error -- Error PTS returns if the value did not change,
+                             it is not an error here
+
+        Returns dict with number of "changed" and "skipped" values and
+        "errors": {"project/name": error}
+
+        """
+        result = {"changed": 0, "skipped": 0, "errors": {}}
+
+        if ptstypes.ALL_PROJECTS in values:
+            values = dict(values)
+            all_projects_values = values.pop(ptstypes.ALL_PROJECTS)
+
+            # kept for projects of the next workspace, see switch_workspace
+            cache.setdefault(ptstypes.ALL_PROJECTS, {}).update(
+                all_projects_values)
+
+            for project_name in self._pts_projects:
+                project_values = dict(all_projects_values)
+                project_values.update(values.get(project_name, {}))
+                values[project_name] = project_values
+
+        for project_name, project_values in values.items():
+            project_cache = cache.setdefault(project_name, {})
+
+            for name, value in project_values.items():
+                if name in project_cache:
+                    if project_cache[name] == value:
+                        result["skipped"] += 1
+                        continue
+
+                    self._values_overridden = True
+
+                try:
+                    update(project_name, name, value)
+                    result["changed"] += 1
+
+                except pythoncom.com_error as e:
+                    error = get_ptscontrol_error_string(e)
+                    if error != not_changed_error:
+                        log("Update of %s %s failed: %s", project_name, name,
+                            error)
+                        result["errors"]["%s/%s" % (project_name, name)] = error
+                        continue
+
+                    result["skipped"] += 1
+
+                project_cache[name] = value
+
+        return result
+
+    def set_pixits_bulk(self, pixits):
+        """Sets PIXITs of many projects at once
 
-    def enable_maximum_logging(self, enable):
-        """Enables/disables the maximum logging."""
+        pixits -- Dict of project name: {PIXIT param name: value}, values
+                  of ptstypes.ALL_PROJECTS are set in all projects
 
-        log("%s %s", self.enable_maximum_logging.__name__, enable)
+        Only values that differ from the ones set since the workspace was
+        opened are sent to PTS.
+
+        Returns dict with number of "changed" and "skipped" PIXITs and
+        "errors": {"project/param": error}
+
+        """
+        log("%s %s", self.set_pixits_bulk.__name__, pixits)
+
+        return self._update_bulk(self._pts.UpdatePixitParam, self._pixit_cache,
+                                 "PTSCONTROL_E_PIXIT_PARAM_NOT_CHANGED", pixits)
+
+    def set_pics_bulk(self, pics):
+        """Sets PICS of many projects at once
+
+        pics -- Dict of project name: {PICS entry name: bool value}
+
+        See set_pixits_bulk for details
+
+        """
+        log("%s %s", self.set_pics_bulk.__name__, pics)
+
+        return self._update_bulk(self._pts.UpdatePics, self._pics_cache,
+                                 "PTSCONTROL_E_PICS_ENTRY_NOT_CHANGED", pics)
+
+    def get_applied_pixits(self):
+        """Returns PIXITs set since the workspace has been opened as dict of
+        project name: {PIXIT param name: value}, values set for all projects
+        are also under ptstypes.ALL_PROJECTS"""
+
+        return self._pixit_cache
+
+    def get_applied_pics(self):
+        """Returns PICS set since the workspace has been opened as dict of
+        project name: {PICS entry name: value}"""
+
+        return self._pics_cache
+
+    def enable_maximum_logging(self, enable, push=True):
+        """Enables/disables the maximum logging.
+
+        push -- If False, only start, end, error and verdict lines are sent
+                to the callback, all lines are kept in the log buffer, see
+                get_test_case_log
+
+        """
+
+        log("%s %s %s", self.enable_maximum_logging.__name__, enable, push)
+        self._maximum_logging = enable
+        self._push_logs = push
         self._pts.EnableMaximumLogging(enable)
-        self._pts_logger.enable_maximum_logging(enable)
+        self._pts_logger.enable_maximum_logging(enable, push)
+
+    def get_test_case_log(self, test_case_name):
+        """Returns dict with "lines" [log type, log type string, time,
+        message] of the last run of the test case and number of "dropped"
+        lines, None if its logs are not kept, see enable_maximum_logging
+        and ptslogbuffer"""
+
+        log("%s %s", self.get_test_case_log.__name__, test_case_name)
+
+        return self._log_buffer.get(test_case_name)
 
     def set_call_timeout(self, timeout):
         """Sets a timeout period in milliseconds for the RunTestCase() calls
         to PTS."""
 
         # timeout 0 = no timeout
+        self._call_timeout = timeout
         self._pts.SetPTSCallTimeout(timeout)
 
     def save_test_history_log(self, save):
@@ -603,6 +1026,7 @@ class PyPTS:
         """
 
         log("%s %s", self.save_test_history_log.__name__, save)
+        self._save_test_history_log = save
         self._pts.SaveTestHistoryLog(save)
 
     def get_bluetooth_address(self):
@@ -624,12 +1048,74 @@ class PyPTS:
 
         return self._pts.GetPTSVersion()
 
+    def get_mqtt_no_response_count(self):
+        """Returns number of implicit sends the IUT tester did not respond to
+        since PTS has been started"""
+
+        return self._pts_sender.get_no_response_count()
+
+    def get_wid_deadlines(self):
+        """Returns dict of "project/wid": current MQTT response deadline in
+        seconds"""
+
+        return self._wid_deadlines.get_deadlines()
+
+    def reload_implicit_send_rules(self):
+        """Reloads the implicit send rules file, it is also reloaded
+        automatically when it changes. Returns True if rules were loaded."""
+
+        log("%s", self.reload_implicit_send_rules.__name__)
+
+        return self._implicit_send_rules.reload()
+
+    def get_implicit_send_rule_stats(self):
+        """Returns dict of test case name: {"hits", "misses"} of the implicit
+        send rules. Hits are the MQTT round trips removed."""
+
+        return self._implicit_send_rules.get_stats()
+
+    def probe_iut(self, timeout):
+        """Returns True if the IUT tester responds to ping over MQTT within
+        timeout seconds"""
+
+        log("%s %s", self.probe_iut.__name__, timeout)
+
+        return self._pts_sender.probe(timeout)
+
+    def start_iut_probe(self, command=ptstypes.IUT_PROBE_PING):
+        """Sends "Ping" or "Capabilities" command to the IUT tester over MQTT
+        and returns at once, so the round trip overlaps next calls. The
+        response is read with get_iut_probe_result."""
+
+        log("%s %s", self.start_iut_probe.__name__, command)
+
+        self._pts_sender.start_probe(command)
+
+    def get_iut_probe_result(self, timeout):
+        """Returns dict with "ok", "result" and "time" of the command sent by
+        start_iut_probe, waiting up to timeout seconds since it was sent"""
+
+        return self._pts_sender.get_probe_result(timeout)
+
+    def set_mqtt_client(self, mqtt_client, mqtt_topic):
+        """Sets MQTT client and topic used to reach the IUT tester, also for
+        the running PTS"""
+
+        log("%s %s", self.set_mqtt_client.__name__, mqtt_topic)
+
+        self._mqtt_client = mqtt_client
+        self._mqtt_topic = mqtt_topic
+
+        if self._pts_sender:
+            self._pts_sender.set_mqtt_client(mqtt_client, mqtt_topic)
+
     def register_ptscallback(self, callback):
         """Registers testcase.PTSCallback instance to be used as PTS log and
         implicit send callback"""
 
         log("%s %s", self.register_ptscallback.__name__, callback)
 
+        self._callback = callback
         self._pts_logger.set_callback(callback)
         self._pts_sender.set_callback(callback)
 
@@ -638,6 +1124,7 @@ class PyPTS:
 
         log("%s", self.unregister_ptscallback.__name__)
 
+        self._callback = None
         self._pts_logger.unset_callback()
         self._pts_sender.unset_callback()
 
@@ -0,0 +1,243 @@
+"""Platform independent helpers of the PTS implicit send callback"""
+
+import os
+import re
+import math
+import json
+import time
+import logging
+import threading
+import collections
+
+import ptsprojects.ptstypes as ptstypes
+from config import MQTT_TIMEOUT, MQTT_WID_TIMEOUTS, MQTT_WID_TIMEOUT_FACTOR, \
+    MQTT_WID_TIMEOUT_MIN, MQTT_WID_MIN_SAMPLES, IMPLICIT_SEND_RULES_FILE
+
+log = logging.debug
+
+
+class WidDeadlines(object):
+    """Deadlines of the IUT tester MQTT responses per (project, WID)
+
+    Some WIDs, like confirmations, are answered in milliseconds by a healthy
+    IUT, others wait for a user action. Deadline of a WID is learned from
+    the observed response times, so a fast WID that goes silent fails the
+    test case early instead of waiting for MQTT_TIMEOUT.
+
+    """
+
+    def __init__(self, default=MQTT_TIMEOUT, overrides=MQTT_WID_TIMEOUTS,
+                 factor=MQTT_WID_TIMEOUT_FACTOR,
+                 min_deadline=MQTT_WID_TIMEOUT_MIN,
+                 min_samples=MQTT_WID_MIN_SAMPLES, max_samples=100):
+        """Constructor
+
+        default -- Deadline in seconds of WIDs without enough samples
+        overrides -- Dict of (project, wid) or wid: deadline in seconds
+        factor -- Multiplier of 99th percentile of the response times
+        min_deadline -- Lower limit of learned deadline in seconds
+        min_samples -- Samples needed before the learned deadline is used
+        max_samples -- Only that many latest response times are kept
+
+        """
+        self._default = default
+        self._overrides = dict(overrides)
+        self._factor = factor
+        self._min_deadline = min_deadline
+        self._min_samples = min_samples
+        self._max_samples = max_samples
+
+        self._lock = threading.Lock()
+        self._samples = {}  # (project, wid): deque of response times
+
+    def get(self, project_name, wid):
+        """Returns deadline of the WID response in seconds"""
+        key = (project_name, wid)
+
+        if key in self._overrides:
+            return self._overrides[key]
+
+        if wid in self._overrides:
+            return self._overrides[wid]
+
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+
+        if len(samples) < self._min_samples:
+            return self._default
+
+        p99 = samples[int(math.ceil(0.99 * len(samples))) - 1]
+
+        return min(self._default, max(self._min_deadline, p99 * self._factor))
+
+    def record(self, project_name, wid, response_time):
+        """Records time in seconds the IUT took to respond to the WID"""
+        key = (project_name, wid)
+
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = collections.deque(maxlen=self._max_samples)
+
+            self._samples[key].append(response_time)
+
+    def get_deadlines(self):
+        """Returns dict of "project/wid": current deadline, for reporting"""
+        with self._lock:
+            keys = list(self._samples.keys())
+
+        return dict(("%s/%d" % key, self.get(*key)) for key in keys)
+
+
+class ImplicitSendRules(object):
+    """Rules answering implicit sends locally, without the MQTT round trip
+
+    Rules are read from a JSON file with a list of objects:
+
+        [
+            {"wid": 21, "project": "PBAP", "response": "OK"},
+            {"style": "MMI_Style_Ok", "description": "press OK",
+             "response": "OK"}
+        ]
+
+    "response" is required. "project", "wid", "style" (name or value) and
+    "description" (regular expression searched in the description) are
+    optional, a missing one matches anything. The first matching rule in
+    file order wins. Rules are indexed by WID, so only rules of the WID and
+    rules without WID are checked. The file is reloaded when it changes.
+
+    """
+
+    def __init__(self, path=IMPLICIT_SEND_RULES_FILE, check_interval=1.0):
+        """Constructor
+
+        path -- Rules file, no rules are used while it does not exist
+        check_interval -- Seconds between checks if the file changed
+
+        """
+        self._path = path
+        self._check_interval = check_interval
+        self._mtime = None
+        self._last_check = 0
+
+        self._lock = threading.Lock()
+        self._by_wid = {}  # wid: list of (order, rule)
+        self._any_wid = []  # list of (order, rule)
+
+        self._hits = collections.defaultdict(int)  # test case: count
+        self._misses = collections.defaultdict(int)
+
+        self.reload()
+
+    @staticmethod
+    def _compile(order, rule):
+        """Returns rule with the style resolved and description compiled"""
+        if "response" not in rule:
+            raise ValueError("Rule %d has no response" % order)
+
+        compiled = dict(rule)
+
+        style = rule.get("style")
+        if isinstance(style, str):
+            styles = dict((v, k) for k, v in ptstypes.MMI_STYLE_STRING.items())
+            compiled["style"] = styles[style]
+
+        if rule.get("description") is not None:
+            compiled["description"] = re.compile(rule["description"])
+
+        return compiled
+
+    def reload(self):
+        """Reads the rules file, the old rules are kept if it is broken
+
+        Returns True if rules were loaded
+
+        """
+        try:
+            mtime = os.path.getmtime(self._path)
+        except OSError:
+            log("No implicit send rules file %s", self._path)
+            self._mtime = None
+            self._set_rules([])
+            return False
+
+        # a broken file is reported once, not on every check
+        self._mtime = mtime
+
+        try:
+            with open(self._path) as f:
+                rules = [self._compile(order, rule)
+                         for order, rule in enumerate(json.load(f))]
+
+        except Exception as error:
+            logging.exception("Broken implicit send rules %s: %r",
+                              self._path, error)
+            return False
+
+        self._set_rules(rules)
+
+        log("Loaded %d implicit send rules from %s", len(rules), self._path)
+        return True
+
+    def _set_rules(self, rules):
+        """Rebuilds the WID index"""
+        by_wid = collections.defaultdict(list)
+        any_wid = []
+
+        for order, rule in enumerate(rules):
+            if rule.get("wid") is None:
+                any_wid.append((order, rule))
+            else:
+                by_wid[rule["wid"]].append((order, rule))
+
+        with self._lock:
+            self._by_wid = dict(by_wid)
+            self._any_wid = any_wid
+
+    def _reload_if_changed(self):
+        """Reloads the rules if the file changed, checked once in a while"""
+        now = time.time()
+        if now - self._last_check < self._check_interval:
+            return
+
+        self._last_check = now
+
+        try:
+            mtime = os.path.getmtime(self._path)
+        except OSError:
+            mtime = None
+
+        if mtime != self._mtime:
+            self.reload()
+
+    def match(self, project_name, wid, test_case, description, style):
+        """Returns response of the first matching rule or None"""
+        self._reload_if_changed()
+
+        with self._lock:
+            candidates = self._by_wid.get(wid, [])
+            if self._any_wid:
+                candidates = sorted(candidates + self._any_wid)
+
+        for _, rule in candidates:
+            if rule.get("project") not in (None, project_name):
+                continue
+
+            if rule.get("style") not in (None, style):
+                continue
+
+            if rule.get("description") is not None and \
+                    not rule["description"].search(description):
+                continue
+
+            self._hits[test_case] += 1
+            return rule["response"]
+
+        self._misses[test_case] += 1
+        return None
+
+    def get_stats(self):
+        """Returns dict of test case: {"hits", "misses"}, hits are MQTT round
+        trips removed"""
+        return dict((tc, {"hits": self._hits.get(tc, 0),
+                          "misses": self._misses.get(tc, 0)})
+                    for tc in set(self._hits) | set(self._misses))
@@ -0,0 +1,94 @@
+"""In-memory logs of the last test cases run by a PTS instance
+
+With the PTS maximum logging every log line is normally pushed to the
+client, although the debug lines are read only for failing test cases. The
+LogBuffer keeps all lines of the current and the last few test cases in
+memory instead, the client fetches them when a test case did not pass.
+
+The buffer is bounded by the number of test cases and by memory: the logs
+of the oldest test cases are evicted first, if the current test case alone
+exceeds the limit its oldest lines are dropped and counted.
+"""
+
+import threading
+import collections
+
+from config import LOG_BUFFER_MAX_BYTES, LOG_BUFFER_TEST_CASES
+
+# memory taken by a line besides its strings, roughly
+LINE_OVERHEAD = 200  # bytes
+
+
+class _TestCaseLog(object):
+    def __init__(self, test_case_name):
+        self.test_case_name = test_case_name
+        self.lines = collections.deque()
+        self.size = 0
+        self.dropped = 0
+
+
+class LogBuffer(object):
+    """Log lines of the last test cases, thread safe"""
+
+    def __init__(self, max_bytes=LOG_BUFFER_MAX_BYTES,
+                 max_test_cases=LOG_BUFFER_TEST_CASES):
+        self.max_bytes = max_bytes
+        self.max_test_cases = max_test_cases
+
+        self._logs = collections.deque()  # _TestCaseLog, current last
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def start_test_case(self, test_case_name):
+        """Starts logs of the test case, lines are added to them until the
+        next one starts"""
+        with self._lock:
+            self._logs.append(_TestCaseLog(test_case_name))
+
+            while len(self._logs) > self.max_test_cases:
+                self._size -= self._logs.popleft().size
+
+    def append(self, log_type, logtype_string, log_time, log_message):
+        """Adds line to the logs of the current test case"""
+        line = (log_type, logtype_string, log_time, log_message)
+        size = len(logtype_string) + len(log_time) + len(log_message) + \
+            LINE_OVERHEAD
+
+        with self._lock:
+            if not self._logs:
+                self._logs.append(_TestCaseLog(None))
+
+            current = self._logs[-1]
+            current.lines.append(line)
+            current.size += size
+            self._size += size
+
+            while self._size > self.max_bytes and len(self._logs) > 1:
+                self._size -= self._logs.popleft().size
+
+            while self._size > self.max_bytes and current.lines:
+                dropped = current.lines.popleft()
+                dropped_size = len(dropped[1]) + len(dropped[2]) + \
+                    len(dropped[3]) + LINE_OVERHEAD
+
+                current.size -= dropped_size
+                self._size -= dropped_size
+                current.dropped += 1
+
+    def get(self, test_case_name):
+        """Returns dict with "lines" [log type, log type string, time,
+        message] of the last run of the test case and number of "dropped"
+        lines, None if they are not kept anymore"""
+        with self._lock:
+            for test_case_log in reversed(self._logs):
+                if test_case_log.test_case_name == test_case_name:
+                    return {"lines": [list(line) for line in
+                                      test_case_log.lines],
+                            "dropped": test_case_log.dropped}
+
+        return None
+
+    def get_size(self):
+        """Returns memory taken by the lines, roughly, in bytes"""
+        with self._lock:
+            return self._size
@@ -0,0 +1,325 @@
+"""Manager of several PTS instances served from one autoptsserver process
+
+Every PTS dongle attached to the host is driven by its own PyPTS instance.
+Each instance lives in its own worker thread that creates the PTS COM object
+and serves it over XML-RPC on a separate port: SERVER_PORT + instance index.
+Optionally the same methods are served over the compact framed transport of
+ptsrpc, from the same thread, PTS callback events are pushed to the client
+over the ptsstream event stream and test history logs are streamed by
+ptsartifacts.
+
+This module has no Windows dependencies, the PyPTS instances are created by
+the factory passed to the manager, so it can be exercised with a stub.
+"""
+
+import logging
+import threading
+from xmlrpc.server import SimpleXMLRPCServer
+
+import ptsrpc
+import ptsstream
+import ptsartifacts
+from config import SERVER_PORT
+
+log = logging.debug
+
+
+def create_xmlrpc_server(port):
+    """Default server factory: XML-RPC server listening on all interfaces"""
+    return SimpleXMLRPCServer(("", port), allow_none=True)
+
+
+class PTSInstance(threading.Thread):
+    """Worker thread that owns one PTS instance and its XML-RPC server
+
+    The PTS instance is created, served and stopped in this thread, so the
+    COM object is never used from a thread other than the one created it.
+
+    """
+
+    def __init__(self, index, port, pts_factory, server_factory,
+                 framed_port=None, stream_port=None, artifact_port=None):
+        """Constructor
+
+        index -- Index of the instance within the manager
+        port -- TCP port to serve the instance on, 0 to pick a free one
+        framed_port -- TCP port of the framed transport, 0 to pick a free
+                       one, None to serve XML-RPC only
+        stream_port -- TCP port of the callback event stream, 0 to pick a
+                       free one, None to call back the client over XML-RPC
+        artifact_port -- TCP port of the test history logs, 0 to pick a
+                         free one, None not to serve them
+        pts_factory -- Callable that takes the index and returns PyPTS
+        server_factory -- Callable that takes the port and returns a
+                          SimpleXMLRPCServer like object
+
+        """
+        threading.Thread.__init__(self, name="PTSInstance-%d" % index)
+        self.daemon = True
+
+        self.index = index
+        self.port = port
+        self.framed_port = framed_port
+        self.stream_port = stream_port
+        self.pts = None
+        self.server = None
+        self.framed_server = None
+        self.event_stream = None
+        self.stream_server = None
+        self.artifact_port = artifact_port
+        self.artifact_server = None
+        self.error = None
+        self.ready = threading.Event()
+
+        self._pts_factory = pts_factory
+        self._server_factory = server_factory
+
+    def run(self):
+        """Creates the PTS instance and serves it until stopped"""
+        log("%s.%s index=%d port=%d", self.__class__.__name__,
+            self.run.__name__, self.index, self.port)
+
+        try:
+            self.pts = self._pts_factory(self.index)
+            self.server = self._server_factory(self.port)
+            self.server.register_instance(self.pts)
+            self.server.register_introspection_functions()
+            self.server.register_multicall_functions()
+            self.port = self.server.server_address[1]
+
+            if self.framed_port is not None:
+                self.framed_server = ptsrpc.FramedRPCServer(self.server,
+                                                            self.framed_port)
+                self.server.register_function(
+                    self.framed_server.get_transport_info,
+                    ptsrpc.TRANSPORT_INFO_METHOD)
+                self.framed_port = self.framed_server.server_address[1]
+
+            if self.stream_port is not None:
+                self._start_event_stream()
+
+            if self.artifact_port is not None:
+                self._start_artifact_server()
+
+        except Exception as error:
+            logging.exception("PTS instance %d failed to start", self.index)
+            self.error = error
+            return
+
+        finally:
+            self.ready.set()
+
+        log("PTS instance %d serving on port %d", self.index, self.port)
+
+        try:
+            if self.framed_server:
+                self.framed_server.serve_forever([self.server])
+            else:
+                self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if self.framed_server:
+                self.framed_server.server_close()
+            if self.stream_server:
+                self.stream_server.shutdown()
+                self.stream_server.server_close()
+            if self.artifact_server:
+                self.artifact_server.shutdown()
+                self.artifact_server.server_close()
+            self._stop_pts()
+
+    def _start_event_stream(self):
+        """Starts serving the callback event stream in a separate thread"""
+        self.event_stream = ptsstream.EventStream()
+        self.stream_server = ptsstream.EventStreamServer(self.event_stream,
+                                                         self.stream_port)
+        self.stream_port = self.stream_server.server_address[1]
+
+        thread = threading.Thread(target=self.stream_server.serve_forever,
+                                  name="EventStream-%d" % self.index)
+        thread.daemon = True
+        thread.start()
+
+        self.server.register_function(self.register_event_stream)
+        self.server.register_function(self.get_event_stream_seq)
+
+    def register_event_stream(self):
+        """Makes the event stream the PTS callback, called by the client
+        after PTS (re)start instead of register_xmlrpc_ptscallback
+
+        Returns dict with the stream "port", "stream" id and "seq" of the
+        last event pushed before, which the client should not receive
+
+        """
+        self.pts.register_ptscallback(self.event_stream)
+
+        return {"port": self.stream_port,
+                "stream": self.event_stream.stream_id,
+                "seq": self.event_stream.get_last_seq()}
+
+    def get_event_stream_seq(self):
+        """Returns number of the last event pushed to the stream, the client
+        waits for it before reading the test case verdict"""
+        return self.event_stream.get_last_seq()
+
+    def _start_artifact_server(self):
+        """Starts serving the test history logs in a separate thread, files
+        are read without PTS, so they are sent while test cases run"""
+        self.artifact_server = ptsartifacts.ArtifactServer(
+            lambda: self.pts.get_opened_workspaces(), self.artifact_port)
+        self.artifact_port = self.artifact_server.server_address[1]
+
+        thread = threading.Thread(target=self.artifact_server.serve_forever,
+                                  name="ArtifactServer-%d" % self.index)
+        thread.daemon = True
+        thread.start()
+
+        self.server.register_function(self.get_artifact_port)
+
+    def get_artifact_port(self):
+        """Returns port of the test history logs, see ptsartifacts"""
+        return self.artifact_port
+
+    def _stop_pts(self):
+        """Terminates PTS owned by this instance"""
+        try:
+            self.pts.stop_pts()
+        except Exception as error:
+            logging.exception(repr(error))
+
+    def stop(self, timeout=None):
+        """Stops serving and waits for the worker thread to finish"""
+        log("%s.%s index=%d", self.__class__.__name__, self.stop.__name__,
+            self.index)
+
+        if self.is_serving():
+            if self.framed_server:
+                self.framed_server.shutdown()
+            else:
+                self.server.shutdown()
+
+        if self.ident is not None:
+            self.join(timeout)
+
+    def is_serving(self):
+        """Returns True if the instance started and is serving requests"""
+        return self.ready.is_set() and self.error is None and self.is_alive()
+
+
+class PTSManager(object):
+    """Starts, restarts and stops N PTS instances"""
+
+    def __init__(self, instance_count, pts_factory, base_port=SERVER_PORT,
+                 server_factory=create_xmlrpc_server, framed_base_port=None,
+                 stream_base_port=None, artifact_base_port=None):
+        """Constructor
+
+        instance_count -- Number of PTS instances (dongles) to manage
+        pts_factory -- Callable that takes the instance index and returns
+                       PyPTS instance, it is called from the worker thread
+        base_port -- Port of the first instance, instance N uses
+                     base_port + N. If 0 every instance picks a free port.
+        server_factory -- Callable that takes the port and returns a
+                          SimpleXMLRPCServer like object
+        framed_base_port -- Port of the framed transport of the first
+                            instance, instance N uses framed_base_port + N.
+                            If 0 every instance picks a free port, if None
+                            only XML-RPC is served.
+        stream_base_port -- Port of the event stream of the first instance,
+                            same as framed_base_port
+        artifact_base_port -- Port of the test history logs of the first
+                              instance, same as framed_base_port
+
+        """
+        log("%s.%s count=%d base_port=%d", self.__class__.__name__,
+            self.__init__.__name__, instance_count, base_port)
+
+        self._pts_factory = pts_factory
+        self._server_factory = server_factory
+        self._base_port = base_port
+        self._framed_base_port = framed_base_port
+        self._stream_base_port = stream_base_port
+        self._artifact_base_port = artifact_base_port
+        self._lock = threading.Lock()
+
+        self.instances = [self._create_instance(index)
+                          for index in range(instance_count)]
+
+    def _create_instance(self, index):
+        """Creates worker thread of instance with the given index"""
+        port = self._base_port + index if self._base_port else 0
+
+        framed_port = self._framed_base_port
+        if framed_port:
+            framed_port += index
+
+        stream_port = self._stream_base_port
+        if stream_port:
+            stream_port += index
+
+        artifact_port = self._artifact_base_port
+        if artifact_port:
+            artifact_port += index
+
+        return PTSInstance(index, port, self._pts_factory,
+                           self._server_factory, framed_port, stream_port,
+                           artifact_port)
+
+    def start(self, timeout=None):
+        """Starts all instances and waits until each started or failed
+
+        Returns list of instances that failed to start
+
+        """
+        for instance in self.instances:
+            instance.start()
+
+        for instance in self.instances:
+            instance.ready.wait(timeout)
+
+        return [instance for instance in self.instances
+                if not instance.is_serving()]
+
+    def restart(self, index, timeout=None):
+        """Stops instance with the given index and starts a fresh one on the
+        same port without affecting the other instances
+
+        Returns the new instance
+
+        """
+        log("%s index=%d", self.restart.__name__, index)
+
+        with self._lock:
+            old_instance = self.instances[index]
+            old_instance.stop(timeout)
+
+            instance = self._create_instance(index)
+            if not self._base_port:
+                instance.port = old_instance.port
+            if self._framed_base_port == 0:
+                instance.framed_port = old_instance.framed_port
+            if self._stream_base_port == 0:
+                instance.stream_port = old_instance.stream_port
+            if self._artifact_base_port == 0:
+                instance.artifact_port = old_instance.artifact_port
+
+            self.instances[index] = instance
+
+        instance.start()
+        instance.ready.wait(timeout)
+
+        return instance
+
+    def stop(self, timeout=None):
+        """Stops all instances"""
+        log("%s", self.stop.__name__)
+
+        with self._lock:
+            for instance in self.instances:
+                instance.stop(timeout)
+
+    def wait(self):
+        """Blocks until all instances finished serving"""
+        for instance in self.instances:
+            while instance.is_alive():
+                instance.join(1.0)
@@ -12,28 +12,32 @@ def set_pixits(pts):
 
     pts -- Instance of PyPTS"""
 
-    # Set PBAP common PIXIT values
-    # pts.set_pixit("PBAP", "TSPX_auth_password", "0000")
-    # pts.set_pixit("PBAP", "TSPX_auth_user_id", "PTS")
-    # pts.set_pixit("PBAP", "TSPX_security_enabled", "TRUE")
-    # pts.set_pixit("PBAP", "TSPX_bd_addr_iut", "589EC6082D87")
-    # pts.set_pixit("PBAP", "TSPX_pin_code", "0000")
-    # pts.set_pixit("PBAP", "TSPX_time_guard", "6000000")
-    # pts.set_pixit("PBAP", "TSPX_use_implicit_send", "TRUE")
-    # pts.set_pixit("PBAP", "TSPX_client_class_of_device", "100204")
-    # pts.set_pixit("PBAP", "TSPX_server_class_of_device", "100204")
-    # pts.set_pixit("PBAP", "TSPX_PSE_vCardSelector", "0000000000000001")
-    # pts.set_pixit("PBAP", "TSPX_delete_link_key", "FALSE")
-    # pts.set_pixit("PBAP", "TSPX_PBAP_rfcomm_channel", "1")
-    # pts.set_pixit("PBAP", "TSPX_telecom_folder_path", "telecom")
-    # pts.set_pixit("PBAP", "TSPX_secure_simple_pairing_pass_key_confirmation", "FALSE")
-    # pts.set_pixit("PBAP", "TSPX_SPP_rfcomm_channel", "03")
-    # pts.set_pixit("PBAP", "TSPX_l2cap_psm", "1005")
-    # pts.set_pixit("PBAP", "TSPX_rfcomm_channel", "2")
-    # pts.set_pixit("PBAP", "TSPX_no_confirmations", "FALSE")
-    # pts.set_pixit("PBAP", "TSPX_Automation", "FALSE")
-    # pts.set_pixit("PBAP", "TSPX_search_criteria", "PTS")
-    # pts.set_pixit("PBAP", "TSPX_PullVCardEntry_invalid_value", "F1984D696B612048C3A46B6B696E656E")
+    # PBAP common PIXIT values, all are applied in a single call
+    pixits = {
+        # "TSPX_auth_password": "0000",
+        # "TSPX_auth_user_id": "PTS",
+        # "TSPX_security_enabled": "TRUE",
+        # "TSPX_bd_addr_iut": "589EC6082D87",
+        # "TSPX_pin_code": "0000",
+        # "TSPX_time_guard": "6000000",
+        # "TSPX_use_implicit_send": "TRUE",
+        # "TSPX_client_class_of_device": "100204",
+        # "TSPX_server_class_of_device": "100204",
+        # "TSPX_PSE_vCardSelector": "0000000000000001",
+        # "TSPX_delete_link_key": "FALSE",
+        # "TSPX_PBAP_rfcomm_channel": "1",
+        # "TSPX_telecom_folder_path": "telecom",
+        # "TSPX_secure_simple_pairing_pass_key_confirmation": "FALSE",
+        # "TSPX_SPP_rfcomm_channel": "03",
+        # "TSPX_l2cap_psm": "1005",
+        # "TSPX_rfcomm_channel": "2",
+        # "TSPX_no_confirmations": "FALSE",
+        # "TSPX_Automation": "FALSE",
+        # "TSPX_search_criteria": "PTS",
+        # "TSPX_PullVCardEntry_invalid_value": "F1984D696B612048C3A46B6B696E656E",
+    }
+
+    pts.set_pixits_bulk({"PBAP": pixits})
 
 
 def test_cases():
@@ -27,6 +27,13 @@ PTS_LOGTYPE_STRING = [
     "PTS_LOGTYPE_EVENT_SUMMARY"
 ]
 
+# Project name that stands for all projects of the workspace in bulk calls
+ALL_PROJECTS = "*"
+
+# Commands of the MQTT tester protocol answered by the IUT between test cases
+IUT_PROBE_PING = "Ping"
+IUT_PROBE_CAPABILITIES = "Capabilities"
+
 """PTS MMI styles"""
 MMI_Style_Ok_Cancel1 =     0x11041 # Simple prompt           | OK, Cancel buttons      | Default: OK
 MMI_Style_Ok_Cancel2 =     0x11141 # Simple prompt           | Cancel button           | Default: Cancel
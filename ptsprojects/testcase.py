@@ -40,14 +40,23 @@ class TestCase(PTSCallback):
     def copy(self):
         """Copy constructor"""
         return TestCase(self.project_name, self.name, self.ptsproject_name,
-                        self.log_filename, self.log_dir)
+                        self.log_filename, self.log_dir, self.pixits, self.pics)
 
     def __init__(self, project_name, test_case_name,
-                 ptsproject_name=None, log_filename=None, log_dir=None):
-        """TestCase constructor"""
+                 ptsproject_name=None, log_filename=None, log_dir=None,
+                 pixits=None, pics=None):
+        """TestCase constructor
+
+        pixits -- Dict of PIXIT param name: value of the test case project
+                  that differ from the workspace values for this test case
+        pics -- Dict of PICS entry name: bool value, same as pixits
+
+        """
 
         self.project_name = project_name
         self.name = test_case_name
+        self.pixits = dict(pixits or {})
+        self.pics = dict(pics or {})
         # a.k.a. final verdict
         self.status = "init"
         self.state = None
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+
+"""Compact framed RPC transport for the PyPTS RPC surface
+
+XML-RPC encodes every control call and log callback as verbose XML and opens
+a new HTTP connection for each of them. This module serves the same methods
+(the dispatcher of the XML-RPC server is reused, including system.multicall)
+over one persistent TCP connection. Each frame is a 4 byte big endian length
+followed by the payload encoded with msgpack, if installed, or compact JSON.
+
+The transport is negotiated at connect time: the client asks the XML-RPC
+server for the framed port and codecs, connects and sends the codecs it
+supports, the server picks the first one it supports as well. Servers
+without the framed transport are used over plain XML-RPC.
+
+Requests are handled in the thread calling FramedRPCServer.serve_forever,
+together with requests of the given XML-RPC servers, so PTS COM objects are
+only used from the thread that created them.
+
+Throughput of the transports is compared with:
+
+    ./ptsrpc.py --calls 2000 --test-cases 2000
+"""
+
+import sys
+import json
+import time
+import socket
+import select
+import struct
+import logging
+import argparse
+import functools
+import selectors
+import threading
+import collections
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCServer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.debug
+
+# XML-RPC method returning ports and codecs of the framed transport
+TRANSPORT_INFO_METHOD = "get_rpc_transports"
+
+# Values of the client --rpc-transport option
+TRANSPORT_AUTO = "auto"
+TRANSPORT_XMLRPC = "xmlrpc"
+TRANSPORT_FRAMED = "framed"
+TRANSPORTS = (TRANSPORT_AUTO, TRANSPORT_XMLRPC, TRANSPORT_FRAMED)
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+FRAME_TIMEOUT = 30  # seconds to receive the rest of a started frame
+CONNECT_TIMEOUT = 5  # seconds
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(data):
+    return json.loads(data.decode("utf-8"))
+
+
+# codec name: (encode, decode), in order of preference
+CODECS = collections.OrderedDict()
+
+if msgpack is not None:
+    CODECS["msgpack"] = (functools.partial(msgpack.packb, use_bin_type=True),
+                         functools.partial(msgpack.unpackb, raw=False))
+
+CODECS["json"] = (_json_dumps, _json_loads)
+
+
+class ProtocolError(Exception):
+    """Malformed frame or failed transport negotiation"""
+
+
+def _recv_exactly(sock, size):
+    """Receives size bytes, returns None if the peer closed the connection
+    before the first byte"""
+    chunks = []
+
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            if chunks:
+                raise ProtocolError("Connection closed in the middle of frame")
+            return None
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def send_frame(sock, payload):
+    """Sends payload bytes as a single frame"""
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_frame(sock):
+    """Returns payload of the next frame, None if the connection is closed"""
+    header = _recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError("Frame of %d bytes is too big" % size)
+
+    payload = _recv_exactly(sock, size)
+    if payload is None:
+        raise ProtocolError("Connection closed in the middle of frame")
+
+    return payload
+
+
+class FramedRPCServer(object):
+    """Serves methods of an XML-RPC dispatcher over framed connections"""
+
+    def __init__(self, dispatcher, port, codecs=None,
+                 frame_timeout=FRAME_TIMEOUT):
+        """Constructor
+
+        dispatcher -- SimpleXMLRPCServer (or SimpleXMLRPCDispatcher) with
+                      the registered instance and functions
+        port -- TCP port to listen on, 0 to pick a free one
+        codecs -- Names of the supported codecs in order of preference,
+                  all available by default
+
+        """
+        self.dispatcher = dispatcher
+        self.codecs = [codec for codec in (codecs or CODECS)
+                       if codec in CODECS]
+        self.frame_timeout = frame_timeout
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(("", port))
+        self.socket.listen(5)
+        self.server_address = self.socket.getsockname()
+
+        self._wakeup_socket, self._wakeup_trigger = socket.socketpair()
+        self._connections = {}  # socket: negotiated codec
+        self._shutdown_request = False
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    def get_transport_info(self):
+        """Returns dict of transport name: {"port", "codecs"}"""
+        return {TRANSPORT_FRAMED: {"port": self.server_address[1],
+                                   "codecs": self.codecs}}
+
+    def serve_forever(self, servers=()):
+        """Handles requests until shutdown is called
+
+        servers -- socketserver servers, e.g. SimpleXMLRPCServer, whose
+                   requests are handled in this thread as well
+
+        """
+        self._stopped.clear()
+        self._shutdown_request = False
+
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.socket, selectors.EVENT_READ,
+                                  functools.partial(self._accept, selector))
+                selector.register(self._wakeup_socket, selectors.EVENT_READ,
+                                  None)
+
+                for server in servers:
+                    selector.register(server, selectors.EVENT_READ,
+                                      server.handle_request)
+
+                while not self._shutdown_request:
+                    for key, _ in selector.select():
+                        if key.data is None:
+                            self._wakeup_socket.recv(1024)
+                        else:
+                            key.data()
+
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stops serve_forever loop and waits until it returns"""
+        self._shutdown_request = True
+        self._wakeup_trigger.send(b"\0")
+        self._stopped.wait()
+
+    def server_close(self):
+        """Closes the listening socket and all client connections"""
+        for conn in list(self._connections):
+            conn.close()
+
+        self._connections.clear()
+        self.socket.close()
+        self._wakeup_socket.close()
+        self._wakeup_trigger.close()
+
+    def _accept(self, selector):
+        conn, addr = self.socket.accept()
+        conn.settimeout(self.frame_timeout)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        log("Framed RPC connection from %s:%d", *addr[:2])
+
+        self._connections[conn] = None
+        selector.register(conn, selectors.EVENT_READ,
+                          functools.partial(self._handle, selector, conn))
+
+    def _close(self, selector, conn):
+        selector.unregister(conn)
+        self._connections.pop(conn, None)
+        conn.close()
+
+    def _handle(self, selector, conn):
+        """Handles the next frame of the connection"""
+        try:
+            payload = recv_frame(conn)
+            if payload is None:
+                self._close(selector, conn)
+                return
+
+            codec = self._connections[conn]
+            if codec is None:
+                self._negotiate(conn, payload)
+            else:
+                send_frame(conn, self._handle_request(codec, payload))
+
+        except (OSError, ProtocolError) as error:
+            log("Framed RPC connection closed: %r", error)
+            self._close(selector, conn)
+
+    def _negotiate(self, conn, payload):
+        """Picks the codec from the client handshake"""
+        client_codecs = _json_loads(payload).get("codecs", [])
+        codec = next((c for c in client_codecs if c in self.codecs), None)
+
+        if codec is None:
+            send_frame(conn, _json_dumps(
+                {"error": "No common codec in %r" % (client_codecs,)}))
+            raise ProtocolError("No common codec in %r" % (client_codecs,))
+
+        log("Framed RPC codec %s", codec)
+        self._connections[conn] = codec
+        send_frame(conn, _json_dumps({"codec": codec}))
+
+    def _handle_request(self, codec, payload):
+        """Returns encoded response to the encoded [method, params]"""
+        encode, decode = CODECS[codec]
+
+        try:
+            method, params = decode(payload)
+            return encode([0, self.dispatcher._dispatch(method, params)])
+
+        except xmlrpc.client.Fault as fault:
+            return encode([1, [fault.faultCode, fault.faultString]])
+
+        except Exception:
+            # same fault string as SimpleXMLRPCServer reports
+            exc_type, exc_value, _ = sys.exc_info()
+            return encode([1, [1, "%s:%s" % (exc_type, exc_value)]])
+
+
+class _Method(object):
+    """Callable RPC method name, supports nested names: proxy.system.x()"""
+
+    def __init__(self, send, name):
+        self.__send = send
+        self.__name = name
+
+    def __getattr__(self, name):
+        return _Method(self.__send, "%s.%s" % (self.__name, name))
+
+    def __call__(self, *args):
+        return self.__send(self.__name, args)
+
+
+class FramedServerProxy(object):
+    """Drop-in replacement of xmlrpc.client.ServerProxy using the framed
+    transport. Calls are serialized over one persistent connection, which is
+    reopened if it is lost between calls. Failed calls raise
+    xmlrpc.client.Fault like with XML-RPC."""
+
+    def __init__(self, host, port, codecs=None):
+        self.__address = (host, port)
+        self.__codecs = list(codecs or CODECS)
+        self.__lock = threading.Lock()
+        self.__socket = None
+        self.__codec = None
+
+        with self.__lock:
+            self.__connect()
+
+    def __connect(self):
+        sock = socket.create_connection(self.__address, CONNECT_TIMEOUT)
+
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_frame(sock, _json_dumps({"codecs": self.__codecs}))
+
+            payload = recv_frame(sock)
+            if payload is None:
+                raise ProtocolError("Connection closed during negotiation")
+
+            reply = _json_loads(payload)
+            if "codec" not in reply:
+                raise ProtocolError(reply.get("error", repr(reply)))
+
+        except Exception:
+            sock.close()
+            raise
+
+        # calls like RunTestCase can block for PTS_TIMEOUT
+        sock.settimeout(None)
+
+        self.__socket = sock
+        self.__codec = reply["codec"]
+
+    def __close(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+    def __is_stale(self):
+        """Returns True if the idle connection has been closed by the server,
+        e.g. restarted. Nothing is expected to be read between calls."""
+        readable, _, _ = select.select([self.__socket], [], [], 0)
+        return bool(readable)
+
+    def __request(self, method, params):
+        with self.__lock:
+            if self.__socket is not None and self.__is_stale():
+                log("Framed RPC connection to %s:%d lost, reconnecting",
+                    *self.__address)
+                self.__close()
+
+            if self.__socket is None:
+                self.__connect()
+
+            encode, decode = CODECS[self.__codec]
+
+            try:
+                send_frame(self.__socket, encode([method, list(params)]))
+                payload = recv_frame(self.__socket)
+                if payload is None:
+                    raise ProtocolError("Connection closed by server")
+
+            except Exception:
+                self.__close()
+                raise
+
+        is_fault, value = decode(payload)
+        if is_fault:
+            raise xmlrpc.client.Fault(*value)
+
+        return value
+
+    def __repr__(self):
+        return "<%s for %s:%d using %s>" % (
+            self.__class__.__name__, self.__address[0], self.__address[1],
+            self.__codec)
+
+    def __call__(self, attr):
+        """proxy("close")() closes the connection, like with ServerProxy"""
+        if attr == "close":
+            return self.__close
+
+        raise AttributeError("Attribute %r not found" % (attr,))
+
+    def __getattr__(self, name):
+        return _Method(self.__request, name)
+
+
+def connect(host, port, transport=TRANSPORT_AUTO):
+    """Returns proxy of the PTS server at host:port
+
+    transport -- TRANSPORT_AUTO uses the framed transport if the server
+                 offers it and XML-RPC otherwise, TRANSPORT_XMLRPC and
+                 TRANSPORT_FRAMED force the transport
+
+    """
+    xmlrpc_proxy = xmlrpc.client.ServerProxy(
+        "http://{}:{}/".format(host, port), allow_none=True)
+
+    if transport == TRANSPORT_XMLRPC:
+        return xmlrpc_proxy
+
+    try:
+        info = getattr(xmlrpc_proxy, TRANSPORT_INFO_METHOD)()[TRANSPORT_FRAMED]
+        proxy = FramedServerProxy(host, info["port"], info["codecs"])
+
+    except (xmlrpc.client.Error, OSError, ProtocolError, KeyError) as error:
+        if transport == TRANSPORT_FRAMED:
+            raise
+
+        log("Framed transport to %s:%d not available, using XML-RPC: %r",
+            host, port, error)
+        return xmlrpc_proxy
+
+    log("Connected to %s:%d: %r", host, port, proxy)
+    return proxy
+
+
+class _BenchmarkService(object):
+    """Methods shaped like the PyPTS catalog and log callback traffic"""
+
+    def __init__(self, test_case_count):
+        self.test_cases = ["PBAP/PCE/SSM/BV-%02d-C-%d" % (i % 100, i)
+                           for i in range(test_case_count)]
+
+    def get_test_case_list(self, project):
+        return self.test_cases
+
+    def log(self, log_type, logger_name, log_time, log_message):
+        return None
+
+
+def _benchmark(proxy, calls, catalog_calls):
+    """Returns (log calls per second, seconds per catalog fetch)"""
+    start_time = time.time()
+    for i in range(calls):
+        proxy.log(1, "PBAP/PCE/SSM/BV-02-C", "10:00:00.000",
+                  "SDP service search attribute request %d" % i)
+    log_rate = calls / (time.time() - start_time)
+
+    start_time = time.time()
+    for _ in range(catalog_calls):
+        proxy.get_test_case_list("PBAP")
+    catalog_time = (time.time() - start_time) / catalog_calls
+
+    return log_rate, catalog_time
+
+
+def parse_args():
+    """Parses command line arguments and options"""
+
+    arg_parser = argparse.ArgumentParser(
+        description="Compare throughput of the RPC transports on localhost")
+
+    arg_parser.add_argument("--calls", type=int, default=2000,
+                            help="Number of log like calls per transport")
+
+    arg_parser.add_argument("--test-cases", type=int, default=2000,
+                            help="Size of the test case catalog")
+
+    arg_parser.add_argument("--catalog-calls", type=int, default=20,
+                            help="Number of catalog fetches per transport")
+
+    return arg_parser.parse_args()
+
+
+def main():
+    """Main."""
+    args = parse_args()
+
+    service = _BenchmarkService(args.test_cases)
+
+    server = SimpleXMLRPCServer(("127.0.0.1", 0), allow_none=True,
+                                logRequests=False)
+    server.register_instance(service)
+    server.register_multicall_functions()
+
+    framed_server = FramedRPCServer(server, 0)
+    server.register_function(framed_server.get_transport_info,
+                             TRANSPORT_INFO_METHOD)
+
+    thread = threading.Thread(target=framed_server.serve_forever,
+                              args=([server],))
+    thread.daemon = True
+    thread.start()
+
+    host, port = server.server_address
+    catalog_xml = xmlrpc.client.dumps((service.test_cases,),
+                                      methodresponse=True).encode("utf-8")
+
+    proxies = [("xmlrpc", len(catalog_xml), connect(host, port,
+                                                     TRANSPORT_XMLRPC))]
+    for codec, (encode, _) in CODECS.items():
+        proxies.append(("framed " + codec, len(encode([0, service.test_cases])),
+                        FramedServerProxy(host, framed_server.server_address[1],
+                                          [codec])))
+
+    print("%-16s %12s %14s %14s" % ("transport", "log calls/s",
+                                    "catalog ms", "catalog bytes"))
+
+    for name, catalog_size, proxy in proxies:
+        log_rate, catalog_time = _benchmark(proxy, args.calls,
+                                            args.catalog_calls)
+        print("%-16s %12.0f %14.2f %14d" % (name, log_rate,
+                                            catalog_time * 1000, catalog_size))
+
+    if msgpack is None:
+        print("msgpack is not installed, framed transport uses JSON")
+
+    framed_server.shutdown()
+    framed_server.server_close()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+
+    except KeyboardInterrupt:  # Ctrl-C
+        sys.exit(14)
@@ -0,0 +1,393 @@
+"""Server push stream of PTS callback events
+
+Instead of dialing back to an XML-RPC server hosted by the client for every
+log line, the server queues log, verdict and MMI events of a PTS instance in
+an EventStream and the client keeps one outbound connection open to receive
+them, so it can run behind NAT or a firewall.
+
+Protocol, frames as in ptsrpc:
+
+    client: {"stream", "since", "window", "codecs"}   hello, JSON
+    server: {"stream", "codec", "first", "dropped"}   JSON
+    server: [[seq, kind, data], ...]                  events, codec
+    client: {"ack": seq}                              JSON
+
+Events are numbered from 1 and sent in order, in batches. At most "window"
+sent events are not acknowledged yet, acknowledged events are released.
+After a reconnect the server replays events after "since", the last event
+processed by the client. A client with another stream id starts after the
+last pushed event, so it never gets events left by a previous client. An
+empty batch is sent as heartbeat when idle.
+
+The PTS callbacks only append to the stream, they never wait for the client.
+If the client does not read the stream, the oldest events are dropped once
+the capacity is reached.
+"""
+
+import uuid
+import socket
+import logging
+import itertools
+import threading
+import collections
+import socketserver
+
+import ptsrpc
+import ptsprojects.ptstypes as ptstypes
+from config import EVENT_STREAM_CAPACITY, EVENT_STREAM_WINDOW, \
+    EVENT_STREAM_HEARTBEAT
+
+log = logging.debug
+
+EVENT_LOG = "log"
+EVENT_VERDICT = "verdict"
+EVENT_MMI = "mmi"
+
+RECONNECT_DELAY_MIN = 0.1  # seconds
+RECONNECT_DELAY_MAX = 5
+
+
+class EventStream(object):
+    """Sequenced events of a PTS instance, used as PyPTS callback"""
+
+    def __init__(self, capacity=EVENT_STREAM_CAPACITY):
+        self.stream_id = uuid.uuid4().hex
+        self._capacity = capacity
+        self._events = collections.deque()  # [seq, kind, data] not acked
+        self._last_seq = 0
+        self._acked_seq = 0
+        self._dropped = 0
+        self._subscriber = 0
+        self._cond = threading.Condition()
+
+    def log(self, log_type, logtype_string, log_time, log_message,
+            test_case_name):
+        """PTS log callback, see autoptsclient_common.ClientCallback"""
+        if log_type == ptstypes.PTS_LOGTYPE_FINAL_VERDICT:
+            kind = EVENT_VERDICT
+        else:
+            kind = EVENT_LOG
+
+        self.push(kind, [log_type, logtype_string, log_time, log_message,
+                         test_case_name])
+
+    def mmi(self, project_name, wid, test_case_name, description, style,
+            response):
+        """Implicit send callback, called after the response is known"""
+        self.push(EVENT_MMI, [project_name, wid, test_case_name, description,
+                              style, response])
+
+    def push(self, kind, data):
+        """Appends event, never blocks"""
+        with self._cond:
+            self._last_seq += 1
+            self._events.append([self._last_seq, kind, data])
+
+            if len(self._events) > self._capacity:
+                self._events.popleft()
+                self._dropped += 1
+
+            self._cond.notify_all()
+
+    def get_last_seq(self):
+        """Returns number of the last pushed event"""
+        with self._cond:
+            return self._last_seq
+
+    def ack(self, seq):
+        """Releases events up to seq processed by the client"""
+        with self._cond:
+            self._acked_seq = max(self._acked_seq, seq)
+
+            while self._events and self._events[0][0] <= seq:
+                self._events.popleft()
+
+            self._cond.notify_all()
+
+    def subscribe(self, since):
+        """Replaces the current subscriber, which processed events up to
+        since. Returns (subscriber id, first event available, dropped)."""
+        with self._cond:
+            self._subscriber += 1
+            self._acked_seq = since
+
+            while self._events and self._events[0][0] <= since:
+                self._events.popleft()
+
+            self._cond.notify_all()
+
+            first = self._events[0][0] if self._events else self._last_seq + 1
+            return self._subscriber, first, self._dropped
+
+    def unsubscribe(self, subscriber):
+        """Stops get_events of the subscriber"""
+        with self._cond:
+            if self._subscriber == subscriber:
+                self._subscriber += 1
+                self._cond.notify_all()
+
+    def get_events(self, subscriber, after_seq, window, timeout):
+        """Waits for events after after_seq allowed by the window
+
+        Returns list of events, empty on timeout, None if the subscriber
+        has been replaced
+
+        """
+        def available():
+            return self._last_seq > after_seq and \
+                after_seq - self._acked_seq < window
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._subscriber != subscriber or
+                                available(), timeout)
+
+            if self._subscriber != subscriber:
+                return None
+
+            if not self._events or not available():
+                return []
+
+            start = max(0, after_seq + 1 - self._events[0][0])
+            count = window - (after_seq - self._acked_seq)
+
+            return list(itertools.islice(self._events, start, start + count))
+
+
+class _EventStreamHandler(socketserver.BaseRequestHandler):
+    """Serves the stream to one client connection"""
+
+    def handle(self):
+        stream = self.server.event_stream
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        payload = ptsrpc.recv_frame(sock)
+        if payload is None:
+            return
+
+        hello = ptsrpc.CODECS["json"][1](payload)
+        codec = next((c for c in hello.get("codecs", ["json"])
+                      if c in ptsrpc.CODECS), "json")
+
+        # events of another stream, e.g. before the instance restart, or
+        # left unacked by a previous client are not replayed
+        since = hello.get("since", 0)
+        if hello.get("stream") != stream.stream_id:
+            since = stream.get_last_seq()
+
+        subscriber, first, dropped = stream.subscribe(since)
+
+        log("Event stream subscriber %d from %s:%d since %d",
+            subscriber, self.client_address[0], self.client_address[1], since)
+
+        ptsrpc.send_frame(sock, ptsrpc.CODECS["json"][0](
+            {"stream": stream.stream_id, "codec": codec, "first": first,
+             "dropped": dropped}))
+
+        sender = threading.Thread(
+            target=self._send_events,
+            args=(stream, subscriber, since, hello.get("window",
+                                                       EVENT_STREAM_WINDOW),
+                  ptsrpc.CODECS[codec][0]))
+        sender.daemon = True
+        sender.start()
+
+        try:
+            while True:
+                payload = ptsrpc.recv_frame(sock)
+                if payload is None:
+                    break
+
+                stream.ack(ptsrpc.CODECS["json"][1](payload)["ack"])
+
+        except (OSError, ptsrpc.ProtocolError) as error:
+            log("Event stream subscriber %d: %r", subscriber, error)
+
+        finally:
+            stream.unsubscribe(subscriber)
+            sender.join()
+
+    def _send_events(self, stream, subscriber, after_seq, window, encode):
+        """Sends events to the client until the subscriber is replaced"""
+        try:
+            while True:
+                events = stream.get_events(subscriber, after_seq, window,
+                                           EVENT_STREAM_HEARTBEAT)
+                if events is None:
+                    log("Event stream subscriber %d replaced", subscriber)
+                    break
+
+                ptsrpc.send_frame(self.request, encode(events))
+
+                if events:
+                    after_seq = events[-1][0]
+
+        except OSError as error:
+            log("Event stream subscriber %d: %r", subscriber, error)
+            stream.unsubscribe(subscriber)
+
+        # unblocks the ack reader
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class EventStreamServer(socketserver.ThreadingTCPServer):
+    """Serves an EventStream, the subscriber connected last gets events"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, event_stream, port):
+        socketserver.ThreadingTCPServer.__init__(self, ("", port),
+                                                 _EventStreamHandler)
+        self.event_stream = event_stream
+
+
+class EventStreamClient(threading.Thread):
+    """Receives the event stream of a PTS instance and passes the events to
+    the callback, reconnecting and resuming after connection loss"""
+
+    def __init__(self, host, port, stream_id, callback, last_seq=0,
+                 window=EVENT_STREAM_WINDOW):
+        """Constructor
+
+        host, port -- Address of the EventStreamServer
+        stream_id -- Stream id returned by register_event_stream
+        callback -- Object with log and mmi methods, see ClientCallback
+        last_seq -- Last event of the stream not meant for this client, as
+                    returned by register_event_stream
+
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.address = (host, port)
+        self.stream_id = stream_id
+        self.callback = callback
+        self.window = window
+
+        self.last_seq = last_seq
+        self.lost_count = 0
+        self.connected = threading.Event()
+
+        self._socket = None
+        self._delay = RECONNECT_DELAY_MIN
+        self._stop_event = threading.Event()
+        self._seq_cond = threading.Condition()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._receive()
+
+            except (OSError, ValueError, ptsrpc.ProtocolError) as error:
+                log("Event stream %s:%d: %r", self.address[0],
+                    self.address[1], error)
+
+            if self._stop_event.wait(self._delay):
+                break
+
+            self._delay = min(self._delay * 2, RECONNECT_DELAY_MAX)
+
+    def _receive(self):
+        """Connects, receives events until the connection is lost"""
+        sock = socket.create_connection(self.address, ptsrpc.CONNECT_TIMEOUT)
+        self._socket = sock
+
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(EVENT_STREAM_HEARTBEAT * 3)
+
+            dumps, loads = ptsrpc.CODECS["json"]
+            ptsrpc.send_frame(sock, dumps({"stream": self.stream_id,
+                                           "since": self.last_seq,
+                                           "window": self.window,
+                                           "codecs": list(ptsrpc.CODECS)}))
+
+            payload = ptsrpc.recv_frame(sock)
+            if payload is None:
+                return
+
+            reply = loads(payload)
+            self._resume(reply)
+            decode = ptsrpc.CODECS[reply["codec"]][1]
+
+            self._delay = RECONNECT_DELAY_MIN
+            self.connected.set()
+
+            while not self._stop_event.is_set():
+                payload = ptsrpc.recv_frame(sock)
+                if payload is None:
+                    return
+
+                events = decode(payload)
+                if not events:
+                    continue  # heartbeat
+
+                for seq, kind, data in events:
+                    if seq > self.last_seq + 1:
+                        self._lost(seq - self.last_seq - 1)
+
+                    if seq > self.last_seq:
+                        self._dispatch(kind, data)
+                        self._set_last_seq(seq)
+
+                ptsrpc.send_frame(sock, dumps({"ack": self.last_seq}))
+
+        finally:
+            self.connected.clear()
+            self._socket = None
+            sock.close()
+
+    def _resume(self, reply):
+        """Checks the reply to hello for a new stream"""
+        log("Event stream %s resumed after %d, first %d, dropped %d",
+            reply["stream"], self.last_seq, reply["first"], reply["dropped"])
+
+        if reply["stream"] != self.stream_id:
+            log("Event stream %s replaced by %s", self.stream_id,
+                reply["stream"])
+            self.stream_id = reply["stream"]
+            self._set_last_seq(reply["first"] - 1)
+
+    def _lost(self, count):
+        """Records events dropped by the server before they were sent"""
+        logging.warning("%d events lost from stream %s", count,
+                        self.stream_id)
+        self.lost_count += count
+
+    def _set_last_seq(self, seq):
+        with self._seq_cond:
+            self.last_seq = seq
+            self._seq_cond.notify_all()
+
+    def _dispatch(self, kind, data):
+        """Passes the event to the callback"""
+        if kind in (EVENT_LOG, EVENT_VERDICT):
+            self.callback.log(*data)
+        elif kind == EVENT_MMI:
+            self.callback.mmi(*data)
+        else:
+            log("Unknown event kind %r", kind)
+
+    def wait_for(self, seq, timeout):
+        """Waits until events up to seq are passed to the callback
+
+        Returns False on timeout
+
+        """
+        with self._seq_cond:
+            return self._seq_cond.wait_for(lambda: self.last_seq >= seq,
+                                           timeout)
+
+    def stop(self):
+        """Stops receiving"""
+        self._stop_event.set()
+
+        sock = self._socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
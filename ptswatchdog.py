@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""Health watchdog of the PTS process
+
+Long sessions degrade PTS.exe: it gets slower, leaks memory and handles and
+eventually fails with COM errors that cost a full recovery. The watchdog
+samples the process after every test case and tells when PTS should be
+recycled, i.e. restarted between test cases with its state restored, which
+is much cheaper than recovering from a crash. PTS is recycled when:
+
+    memory or handle count of the process exceeds the limit
+    CPU use during the test cases exceeds the limit
+    test cases got slower: mean of durations relative to the expected ones
+    over the last WINDOW test cases is SLOWDOWN times the mean of the first
+    WINDOW test cases after PTS start
+    MAX_TESTS test cases have been run since PTS start
+
+Limits of 0 are disabled. Process stats come from a callable, so the policy
+does not depend on Windows. ProcStatsSource reads them on Linux, run this
+module with a PID to watch any process with the default policy.
+"""
+
+import os
+import sys
+import time
+import argparse
+import collections
+
+from config import WATCHDOG_MAX_MEMORY, WATCHDOG_MAX_HANDLES, \
+    WATCHDOG_MAX_CPU, WATCHDOG_MAX_TESTS, WATCHDOG_SLOWDOWN, WATCHDOG_WINDOW
+
+# cpu_time -- CPU time used by the process in seconds
+# memory -- Resident memory in bytes
+# handles -- Number of open handles (file descriptors on Linux)
+ProcessStats = collections.namedtuple("ProcessStats",
+                                      "cpu_time memory handles")
+
+
+class ProcStatsSource(object):
+    """Stats of a Linux process read from /proc"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._ticks = os.sysconf("SC_CLK_TCK")
+
+    def __call__(self):
+        path = "/proc/%d/" % self.pid
+
+        with open(path + "stat") as f:
+            # fields after the command name, which can contain spaces
+            fields = f.read().rpartition(")")[2].split()
+
+        utime, stime = int(fields[11]), int(fields[12])
+        memory = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+
+        return ProcessStats((utime + stime) / self._ticks, memory,
+                            len(os.listdir(path + "fd")))
+
+
+class RecyclePolicy(object):
+    """Limits that make PTS recycled, see module documentation"""
+
+    def __init__(self, max_memory=WATCHDOG_MAX_MEMORY,
+                 max_handles=WATCHDOG_MAX_HANDLES, max_cpu=WATCHDOG_MAX_CPU,
+                 max_tests=WATCHDOG_MAX_TESTS, slowdown=WATCHDOG_SLOWDOWN,
+                 window=WATCHDOG_WINDOW):
+        """Constructor
+
+        max_memory -- Bytes
+        max_cpu -- Percent of one core, mean over the last window
+        slowdown -- Factor of relative durations, see module documentation
+
+        """
+        self.max_memory = max_memory
+        self.max_handles = max_handles
+        self.max_cpu = max_cpu
+        self.max_tests = max_tests
+        self.slowdown = slowdown
+        self.window = window
+
+    def check(self, watchdog):
+        """Returns reason to recycle PTS watched by the watchdog, None if
+        there is none"""
+        stats = watchdog.last_stats
+
+        if stats and self.max_memory and stats.memory > self.max_memory:
+            return "memory %d MB over %d MB" % (stats.memory >> 20,
+                                                self.max_memory >> 20)
+
+        if stats and self.max_handles and stats.handles > self.max_handles:
+            return "%d handles over %d" % (stats.handles, self.max_handles)
+
+        cpu = watchdog.get_cpu()
+        if self.max_cpu and cpu is not None and cpu > self.max_cpu:
+            return "CPU %d%% over %d%%" % (cpu, self.max_cpu)
+
+        if self.max_tests and watchdog.test_count >= self.max_tests:
+            return "%d test cases run" % (watchdog.test_count,)
+
+        slowdown = watchdog.get_slowdown()
+        if self.slowdown and slowdown is not None and \
+                slowdown > self.slowdown:
+            return "test cases %.1f times slower" % (slowdown,)
+
+        return None
+
+
+class Watchdog(object):
+    """Samples the PTS process after each test case"""
+
+    def __init__(self, stats_source, policy=None, clock=time.time):
+        """Constructor
+
+        stats_source -- Callable returning ProcessStats of the process
+        policy -- RecyclePolicy, default limits from config if None
+        clock -- Wall clock, in seconds
+
+        """
+        self._stats_source = stats_source
+        self.policy = policy or RecyclePolicy()
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        """Starts watching a new process, called after PTS is started"""
+        self.test_count = 0
+        self.last_stats = None
+        self._last_time = None
+        self._cpu = collections.deque(maxlen=self.policy.window)
+        self._baseline = []
+        self._recent = collections.deque(maxlen=self.policy.window)
+
+    def sample(self):
+        """Samples the process stats, returns CPU use since the previous
+        sample in percent of one core, None if unknown"""
+        stats = self._stats_source()
+        now = self._clock()
+        cpu = None
+
+        if self.last_stats is not None and now > self._last_time:
+            cpu = 100.0 * (stats.cpu_time - self.last_stats.cpu_time) / \
+                (now - self._last_time)
+
+        self.last_stats = stats
+        self._last_time = now
+
+        return cpu
+
+    def record_test(self, duration, expected_duration=0):
+        """Records test case run, returns reason to recycle PTS or None
+
+        duration -- Seconds the test case took
+        expected_duration -- Usual duration of the test case, e.g. median
+                             of its history, 0 if not known
+
+        """
+        self.test_count += 1
+
+        cpu = self.sample()
+        if cpu is not None:
+            self._cpu.append(cpu)
+
+        if expected_duration > 0:
+            ratio = duration / expected_duration
+
+            if len(self._baseline) < self.policy.window:
+                self._baseline.append(ratio)
+            else:
+                self._recent.append(ratio)
+
+        return self.policy.check(self)
+
+    def get_cpu(self):
+        """Returns mean CPU use over the last test cases, None if unknown"""
+        if not self._cpu:
+            return None
+
+        return sum(self._cpu) / len(self._cpu)
+
+    def get_slowdown(self):
+        """Returns mean relative duration of the last test cases relative to
+        the first ones after start, None until there is a full window"""
+        if len(self._recent) < self.policy.window:
+            return None
+
+        baseline = sum(self._baseline) / len(self._baseline)
+        if not baseline:
+            return None
+
+        return sum(self._recent) / len(self._recent) / baseline
+
+    def get_report(self):
+        """Returns dict of the watched values"""
+        stats = self.last_stats
+        return {"tests": self.test_count,
+                "memory": stats.memory if stats else None,
+                "handles": stats.handles if stats else None,
+                "cpu": self.get_cpu(),
+                "slowdown": self.get_slowdown()}
+
+
+def main():
+    """Watches a Linux process with the default policy"""
+    arg_parser = argparse.ArgumentParser(
+        description="Sample a process the way the PTS watchdog does")
+    arg_parser.add_argument("pid", type=int)
+    arg_parser.add_argument("-i", "--interval", type=float, default=5,
+                            help="Seconds between samples, each is taken "
+                                 "as a test case")
+    args = arg_parser.parse_args()
+
+    watchdog = Watchdog(ProcStatsSource(args.pid))
+
+    while True:
+        reason = watchdog.record_test(args.interval)
+        print("%s %s" % (watchdog.get_report(), reason or ""))
+        sys.stdout.flush()
+
+        if reason:
+            watchdog.reset()
+
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass